@@ -30,6 +30,114 @@ Backend functions
     :members:
     :undoc-members:
 
+`index_funcs.py`
+~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.index_funcs
+    :members:
+    :undoc-members:
+
+`lazy_funcs.py`
+~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.lazy_funcs
+    :members:
+    :undoc-members:
+
+`snapshot_funcs.py`
+~~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.snapshot_funcs
+    :members:
+    :undoc-members:
+
+`sqlite_funcs.py`
+~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.sqlite_funcs
+    :members:
+    :undoc-members:
+
+`journal_funcs.py`
+~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.journal_funcs
+    :members:
+    :undoc-members:
+
+`validation_funcs.py`
+~~~~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.validation_funcs
+    :members:
+    :undoc-members:
+
+`shard_funcs.py`
+~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.shard_funcs
+    :members:
+    :undoc-members:
+
+`fuzzy_funcs.py`
+~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.fuzzy_funcs
+    :members:
+    :undoc-members:
+
+`prefix_funcs.py`
+~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.prefix_funcs
+    :members:
+    :undoc-members:
+
+`variant_funcs.py`
+~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.variant_funcs
+    :members:
+    :undoc-members:
+
+`regex_funcs.py`
+~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.regex_funcs
+    :members:
+    :undoc-members:
+
+`text_funcs.py`
+~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.text_funcs
+    :members:
+    :undoc-members:
+
+`cache_funcs.py`
+~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.cache_funcs
+    :members:
+    :undoc-members:
+
+`lca_funcs.py`
+~~~~~~~~~~~~~~
+.. automodule:: etymdendron.lca_funcs
+    :members:
+    :undoc-members:
+
+`transaction_funcs.py`
+~~~~~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.transaction_funcs
+    :members:
+    :undoc-members:
+
+`view_funcs.py`
+~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.view_funcs
+    :members:
+    :undoc-members:
+
+`compact_funcs.py`
+~~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.compact_funcs
+    :members:
+    :undoc-members:
+
+`import_funcs.py`
+~~~~~~~~~~~~~~~~~
+.. automodule:: etymdendron.import_funcs
+    :members:
+    :undoc-members:
+
 `gui_funcs.py`
 ~~~~~~~~~~~~~~
 .. automodule:: etymdendron.gui_funcs
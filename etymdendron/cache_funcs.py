@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+""" This module caches the results of searches in a database
+
+    common_funcs.searchDB() keeps the results of the latest searches of a
+    database in a ResultCache, so that searching again for the same word
+    (as the GUI and a server do all the time) is a dictionary lookup. The
+    least recently used result is dropped once the cache is full. A
+    lazy_funcs.LazyDB keeps no results, as they would hold on to the trees
+    it is meant to let go of.
+
+    The results are stamped with the generation of the databases, a
+    counter bumped by every edit function of common_funcs (editWordDetails,
+    deleteTree and the others, whichever database they edit). A result
+    from an earlier generation is never handed out, so an edit doesn't
+    need to know which results it changes. Edits made around
+    common_funcs, straight to the elements, aren't seen.
+
+"""
+
+###
+# Imports
+import collections
+
+import index_funcs
+import text_funcs
+
+###
+# Constants
+# How many results each database keeps by default, 0 turns the cache off
+CACHE_SIZE = 512
+
+# The generation of the databases, bumped by every edit
+_generation = 0
+
+###
+# Classes
+class ResultCache(object):
+    """ A bounded cache of search results, least recently used first out """
+    def __init__(self, maxsize=CACHE_SIZE):
+        """ Creates an empty cache holding at most maxsize results """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # The generation the results are from
+        self.generation = _generation
+        # key -> result, the most recently used last
+        self._results = collections.OrderedDict()
+
+    def __len__(self):
+        """ The number of results in the cache """
+        return len(self._results)
+
+    def get(self, key):
+        """ Returns the result kept for key, or None """
+        if self.generation != _generation:
+            self._results.clear()
+            self.generation = _generation
+        result = self._results.pop(key, None)
+        if result is None:
+            self.misses += 1
+            return None
+        self._results[key] = result
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """ Keeps result for key, dropping the oldest result if full """
+        if self.maxsize <= 0 or self.generation != _generation:
+            return
+        self._results.pop(key, None)
+        self._results[key] = result
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        """ Drops all the results and zeroes the statistics """
+        self._results.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """ Returns a dict of the statistics of the cache
+
+            The keys are 'hits', 'misses', 'size' (the number of results),
+            'maxsize' and 'hit_rate' (the fraction of the searches that
+            were hits).
+
+        """
+        searches = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._results), 'maxsize': self.maxsize,
+                'hit_rate': float(self.hits) / searches if searches else 0.0}
+
+###
+# Functions
+def newGeneration():
+    """ Makes all the cached results stale, called by every edit """
+    global _generation
+    _generation += 1
+
+def getGeneration():
+    """ Returns the generation of the databases """
+    return _generation
+
+def getCache(word_db):
+    """ Returns the ResultCache of word_db, creating it if needed
+
+        An XML database keeps it on its etym element, the other backends
+        on themselves. If word_db can't hold one, or its cache_results
+        attribute is False, a new cache that keeps nothing is returned
+        each time.
+
+    """
+    holder = word_db.getroot() if hasattr(word_db, 'getroot') else word_db
+    if not getattr(holder, 'cache_results', True):
+        return ResultCache(maxsize=0)
+    cache = getattr(holder, '_result_cache', None)
+    if cache is None:
+        cache = ResultCache()
+        try:
+            holder._result_cache = cache
+        except AttributeError:
+            pass
+    return cache
+
+def queryKey(search_word, field, mode):
+    """ Returns the cache key of a search
+
+        Searches giving the same results get the same key: in 'normal'
+        mode, the words with the same search key (see
+        index_funcs.searchKey()), and in 'fulltext' mode, the queries with
+        the same tokens (see text_funcs.tokenize()).
+
+    """
+    if mode == 'normal':
+        query = index_funcs.searchKey(search_word)
+    elif mode == 'fulltext':
+        query = tuple(sorted(set(text_funcs.tokenize(search_word))))
+    else:
+        query = search_word
+    return (_generation, field, mode, query)
+# EOF
@@ -58,10 +58,11 @@ def choose_word_from_many(words):
 
 ###
 # Display functions
-def display_tree(tree, word, search_word):
+def display_tree(tree, word, search_word=None):
     """ For a given word and tree, display the rest of the tree 
 
-        The search_word is emphasized.
+        word is the matched word element (or a list of them), which is
+        emphasized, see display_children().
 
     """
     # Encapsulate word in a list if it isn't already
@@ -73,35 +74,53 @@ def display_tree(tree, word, search_word):
         tree_details['lang']))
     display_children(tree, 1, word, search_word)
 
-def display_children(node, depth, word, search_word):
+def display_path(path, ancestor):
+    """ Displays the path of words relating two words
+
+        path is what lca_funcs.relationPath() returns, and ancestor the
+        common ancestor on it. The words leading up to ancestor are
+        marked with ^, those leading down from it with v.
+
+    """
+    details = cf.loadWordDetails(ancestor)
+    print('Common ancestor: {0} ({1})'.format(details['text'][0],
+        details['lang']))
+    marker = ''
+    for word in path:
+        details = cf.loadWordDetails(word)
+        print(u'  {0}{1} ({2}, "{3}")'.format(marker,
+            ', '.join(details['text']), details['lang'], details['def']))
+        if word == ancestor:
+            marker = 'v '
+        elif marker == '':
+            marker = '^ '
+
+def display_children(node, depth, word, search_word=None):
     """ Recursive function to display children of a node
 
         depth is what level we're on.
-        word is the word element we're looking for (it will be emphasized
-        in the tree).
-        search_word is the word text we're looking for.
+        word is the list of the word elements the search matched; they
+        are emphasized in the tree, whichever mode found them.
+        search_word is the word text we searched for: if it is one of
+        the texts of a matched word, only that text is emphasized (and
+        put first), otherwise all of them are.
 
     """
     # The len() of a node returns how many children it has
     if cf.countWordChildren(node) > 0:
         for child in cf.loadWordChildren(node):
             depth_marker = '  '*depth
-            child_markup = ''
             child_details = cf.loadWordDetails(child)
+            texts = child_details['text']
             if child in word:
-                # First we have the emphasized word
-                # Then the other matches, if there
-                child_markup = ', '.join(['*{0}*'.format(text_var)
-                    for text_var in child_details['text'] 
-                    if text_var == search_word])
-                child_markup_rest = ', '.join(['{0}'.format(text_var)
-                    for text_var in child_details['text'] 
-                    if text_var != search_word])
-                if child_markup_rest is not '':
-                    child_markup = ', '.join([child_markup, child_markup_rest])
+                # First we have the emphasized text(s), then the others
+                matched = [text_var for text_var in texts
+                           if text_var == search_word] or texts
+                child_markup = u', '.join([u'*{0}*'.format(text_var)
+                    for text_var in matched] + [text_var
+                    for text_var in texts if text_var not in matched])
             else:
-                child_markup = ', '.join(['{0}'.format(text_var)
-                    for text_var in child_details['text']])
+                child_markup = ', '.join(texts)
 
             print(u'{0}Child: {1} ({2}, "{3}")'.format(
                 depth_marker, child_markup, child_details['lang'],
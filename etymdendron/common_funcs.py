@@ -3,10 +3,21 @@
 
 ###
 # Imports
+import os
+import re
+import functools
+from contextlib import contextmanager
+import shutil
+import tempfile
 try:
     from lxml import etree as ET
 except ImportError as im_err:
     print('lxml is missing\n{0}'.format(im_err))
+import global_opts
+import cache_funcs
+import index_funcs
+import text_funcs
+import view_funcs
 
 ###
 # Exceptions
@@ -20,63 +31,680 @@ class EtymExceptWord(EtymException):
     """ A word-related exception """
     pass
 
+###
+# Element classes
+class EtymElement(ET.ElementBase):
+    """ The element class used for a loaded database
+
+        Unlike the plain lxml elements, these can hold Python attributes,
+        which is how the etym root element keeps its search index.
+
+    """
+    pass
+
+_ELEMENT_LOOKUP = ET.ElementDefaultClassLookup(element=EtymElement)
+
+# The running transaction_funcs.Transaction, see transaction()
+_transaction = None
+
+# The subelements of a word, in the order of the DTD
+_DETAIL_RANKS = {'lang': 0, 'text': 1, 'morpheme': 2, 'def': 3, 'word': 4}
+
+# A line break between two tags of a pretty printed tree
+_NEWLINE_TAG = re.compile(br'>\n(?=[ ]*<)')
+# The DOCTYPE of a document, with its internal DTD
+_DOCTYPE = re.compile(br'<!DOCTYPE[^[>]*(\[.*?\]\s*)?>', re.S)
+
+###
+# Backend words
+class BackendWord(object):
+    """ A word of a database that isn't kept as an lxml tree
+
+        A backend (such as sqlite_funcs.SQLiteDB) hands out its words as
+        BackendWord objects. The functions in this module pass them on to
+        the backend method of the same name.
+
+    """
+    def __init__(self, db, word_id):
+        """ word_id is the backend's own key for the word """
+        self.db = db
+        self.id = word_id
+
+    def __eq__(self, other):
+        return (isinstance(other, BackendWord) and self.db is other.db and
+                self.id == other.id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.db), self.id))
+
+    def __repr__(self):
+        return '<BackendWord {0}>'.format(self.id)
+
+    @property
+    def tag(self):
+        """ 'word' or 'tree', like the tag of an element """
+        return self.db.checkNode(self)
+
 ###
 # Functions
-def loadDB(filename):
+def _journaled(func):
+    """ Makes the edit function func record its calls in the edit journal
+
+        A call is recorded once it succeeds, if one of its arguments is
+        part of a database with a journal (see journal_funcs). The edits
+        func makes through other journaled functions aren't recorded, as
+        replaying the outer call makes them again.
+
+        Every call, recorded or not, also starts a new generation of the
+        search result caches (see cache_funcs), drops the views of the
+        trees of the words it is given (see view_funcs), before and after
+        the edit, and marks their shards as edited (see shard_funcs). In a
+        transaction (see transaction()), the words func is given are
+        saved first, and the record is held back until the transaction
+        ends.
+
+    """
+    @functools.wraps(func)
+    def journaledFunc(*args, **kwargs):
+        import journal_funcs
+        import shard_funcs
+        values = list(args) + kwargs.values()
+        edited = []
+        try:
+            if _transaction is not None:
+                _transaction.save(values)
+            shard_funcs.markEdited(values)
+            edited = view_funcs.markEdited(values)
+            journal = journal_funcs.findJournal(values)
+            if journal is None or journal.depth > 0:
+                return func(*args, **kwargs)
+            record = journal.record(func.__name__, args, kwargs)
+            journal.depth += 1
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                journal.depth -= 1
+            if _transaction is None:
+                journal.append(record)
+            else:
+                _transaction.defer(journal, record)
+            return result
+        finally:
+            # Again, as the edit may have read (and moved) the words
+            view_funcs.markEdited(values + edited)
+            cache_funcs.newGeneration()
+    return journaledFunc
+
+def _checkWord(word):
+    """ Checks word with checkWord(), or in a transaction, at its end
+
+    A word whose details are only out of order is put back in order with
+    normalizeWord(), as validateWord() does.
+
+    """
+    if _transaction is None:
+        if not checkWord(word):
+            normalizeWord(word)
+    else:
+        _transaction.check(word)
+
+@contextmanager
+def transaction():
+    """ Groups the edits made in a with block into a transaction
+
+        with transaction():
+            editWordParent(...)
+            ...
+
+        The edit functions of this module don't check their words in a
+        transaction; each word is checked by checkWord() once, at the
+        end. If a check fails, or an exception leaves the block, all the
+        edits of the block are undone and the exception is raised again.
+        See transaction_funcs. A transaction in another one is part of
+        it. The Transaction is given to the block.
+
+    """
+    global _transaction
+    if _transaction is not None:
+        yield _transaction
+        return
+    import transaction_funcs
+    running = _transaction = transaction_funcs.Transaction()
+    try:
+        try:
+            yield running
+            running.validate()
+        except:
+            running.rollback()
+            raise
+    finally:
+        _transaction = None
+    running.commit()
+
+def makeParser(**kwargs):
+    """ Returns an XMLParser that creates EtymElement elements
+
+        The keyword arguments are passed on to ET.XMLParser.
+
+    """
+    parser = ET.XMLParser(**kwargs)
+    parser.set_element_class_lookup(_ELEMENT_LOOKUP)
+    return parser
+
+def loadDB(filename, streaming=False, lazy=False, snapshot=True,
+           journal=False, validation='load', sample=1.0, compact=False,
+           write_snapshot=False):
     """ This function loads the word database given by filename 
 
-        Right now with the XML backend, I read and parse the file.
+        With the XML backend, I read and parse the file. The search
+        index is built here as well. A filename ending in one of
+        sqlite_funcs.SQLITE_EXTENSIONS is opened with the SQLite backend
+        instead, and the other options don't apply.
+
+        If snapshot is True, a fresh binary snapshot of filename (see
+        snapshot_funcs) is used to skip the DTD validation and the index
+        build. Without one, the file is parsed as usual. Nothing is
+        written unless write_snapshot is True as well: the snapshot is
+        then written next to filename (as filename + '.snap') for the
+        next time.
+
+        If streaming is True, the file is read one tree at a time with
+        iterDB() and each tree is indexed as soon as it is parsed.
+
+        If lazy is True, a read-only lazy_funcs.LazyDB is returned
+        instead, which only parses the trees that searches need.
+
+        If journal is True, the edit journal of filename (see
+        journal_funcs) is replayed over the database, and later edits are
+        appended to it.
+
+        validation is when the database is checked against its DTD: at
+        'load' (the default), at 'save', in the 'background' (where sample
+        is the fraction of trees checked) or 'none'. See validation_funcs;
+        its getReport() tells the time spent validating. A snapshot is
+        only written (and used) by a database validated at load.
+
+        A filename ending in one of shard_funcs.MANIFEST_EXTENSIONS is a
+        manifest listing shard files, which are parsed in parallel and
+        merged into one database. streaming, snapshot and journal don't
+        apply to it.
+
+        If compact is True, the file is streamed into a read-only
+        compact_funcs.CompactDB, which keeps the words in flat arrays
+        rather than lxml elements. The trees are validated as they are
+        read if validation is 'load'; the other options don't apply.
 
     """
+    import sqlite_funcs
+    if sqlite_funcs.isSQLiteFile(filename):
+        return sqlite_funcs.SQLiteDB(filename)
+
+    if lazy:
+        import lazy_funcs
+        return lazy_funcs.LazyDB(filename)
+
+    import validation_funcs
+    report = validation_funcs.ValidationReport(validation)
+    if compact:
+        import compact_funcs
+        return compact_funcs.loadCompact(filename, report)
+    if validation != validation_funcs.VALIDATE_LOAD:
+        snapshot = False
+    import shard_funcs
+    if shard_funcs.isManifest(filename):
+        words_db = shard_funcs.loadShards(filename, report)
+        journal = False
+    else:
+        words_db = _parseDB(filename, streaming, snapshot,
+                            snapshot and write_snapshot, report)
+    validation_funcs.attachReport(words_db, report)
+    if validation == validation_funcs.VALIDATE_BACKGROUND:
+        validation_funcs.startBackground(words_db, report, sample)
+    if journal:
+        import journal_funcs
+        journal_funcs.openJournal(words_db, filename)
+    return words_db
+
+def _parseDB(filename, streaming, snapshot, write_snapshot, report):
+    """ Parses and indexes the XML file filename, see loadDB() """
+    if streaming:
+        index = index_funcs.WordIndex()
+        root = None
+        for tree in iterDB(filename, report=report):
+            index.addSubtree(tree, tree)
+            root = tree.getparent()
+        index_funcs.attachIndex(root, index)
+        return root.getroottree()
+
+    if snapshot:
+        import snapshot_funcs
+        words_db = snapshot_funcs.loadSnapshot(filename)
+        if words_db is not None:
+            return words_db
+
     words_db = ET.ElementTree()
     try:
-        words_db.parse(filename, ET.XMLParser(dtd_validation=True,
-            remove_blank_text=True))
+        words_db.parse(filename, makeParser(remove_blank_text=True))
     except ET.XMLSyntaxError as err:
         raise EtymExceptDB("ERROR: Error parsing {0}\n{1}".format(
             filename, err))
     except IOError as err:
         raise EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
             filename, err))
-
+    import validation_funcs
+    if report.mode == validation_funcs.VALIDATE_LOAD:
+        validation_funcs.validateDB(words_db, filename, report)
+
+    index_funcs.attachIndex(words_db.getroot())
+    if write_snapshot:
+        import snapshot_funcs
+        try:
+            snapshot_funcs.writeSnapshot(words_db, filename)
+        except (IOError, OSError):
+            # The snapshot is only an optimization
+            pass
     return words_db
 
+def iterDB(filename, drop=False, report=None):
+    """ Yields the tree elements of the database filename one at a time
+
+        This streams through the file with ET.iterparse, so a tree is
+        handed out as soon as it is parsed (and validated).
+
+        The trees are validated against the DTD of the file unless report
+        (a validation_funcs.ValidationReport, which is told the time spent)
+        has another validation mode than 'load'.
+
+        If drop is True, each tree is detached from the etym root once
+        the caller moves on to the next one. Then the memory used depends
+        on the largest tree rather than on the size of the database.
+        A caller can hold on to a dropped tree by keeping a reference.
+
+    """
+    import validation_funcs
+    if report is None:
+        report = validation_funcs.ValidationReport('load')
+    validate = report.mode == validation_funcs.VALIDATE_LOAD
+    dtd = root = None
+    try:
+        context = ET.iterparse(filename, events=('end',), tag='tree',
+                load_dtd=True, remove_blank_text=True)
+        context.set_element_class_lookup(_ELEMENT_LOOKUP)
+        for event, tree in context:
+            root = tree.getparent()
+            if validate:
+                if dtd is None:
+                    dtd = validation_funcs.getDTD(tree.getroottree())
+                if not report.check(dtd, tree):
+                    raise EtymExceptDB("ERROR: {0} doesn't follow its DTD"
+                            "\n{1}".format(filename, report.errors[-1]))
+            yield tree
+            if drop:
+                root.remove(tree)
+    except ET.XMLSyntaxError as err:
+        raise EtymExceptDB("ERROR: Error parsing {0}\n{1}".format(
+            filename, err))
+    except IOError as err:
+        raise EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
+            filename, err))
+    # The etym element itself must hold only (and at least one) tree
+    if validate and (root is None or any(child.tag != 'tree'
+                                         for child in root)):
+        raise EtymExceptDB("ERROR: {0} doesn't follow its DTD\n"
+                "The etym element must hold only trees".format(filename))
+
+def scanDB(filename, search_word, field='text'):
+    """ Searches the database file filename without loading all of it
+
+        This streams through the file with iterDB(), dropping each tree
+        unless it holds a match. The output is the same as searchDB().
+
+    """
+    if field not in index_funcs.INDEX_FIELDS:
+        raise EtymExceptDB('Cannot search on the field {0}'.format(field))
+
+    matched_words = []
+    for tree in iterDB(filename, drop=True):
+        index = index_funcs.WordIndex()
+        index.addSubtree(tree, tree)
+        matched_words.extend(index.lookup(field, search_word))
+    num_trees = len(set(tree for tree, word in matched_words))
+
+    return (num_trees, matched_words)
+
+def scanDB_many(filename, search_words, field='text'):
+    """ Searches the database file filename for all of search_words at once
+
+        This is scanDB() for many words: the file is streamed through
+        once, and each value of each word is looked up in the set of
+        search words. Returns a dict: search word -> (num_trees, words),
+        as searchDB_many() does.
+
+    """
+    if field not in index_funcs.INDEX_FIELDS:
+        raise EtymExceptDB('Cannot search on the field {0}'.format(field))
+
+    matches = dict((search_word, []) for search_word in search_words)
+    for tree in iterDB(filename, drop=True):
+        for word in tree.iterdescendants(tag='word'):
+            for child in word.iterchildren(tag=field):
+                if child.text in matches:
+                    matches[child.text].append((tree, word))
+
+    return dict((search_word, (len(set(tree for tree, word in
+                                       matched_words)), matched_words))
+                for search_word, matched_words in matches.iteritems())
+
+def newDB():
+    """ Returns a new, empty word database (using the XML backend) """
+    root = ET.fromstring("<?xml version='1.0' encoding='utf-8' "
+            "standalone='yes'?>\n" + global_opts.WORDS_DTD + "\n<etym/>",
+            makeParser())
+    return root.getroottree()
+
 def saveDB(words_db, filename):
     """ This saves words_db into filename
 
-        This is using the XML backend.
+        An XML database is written as XML, unless filename ends in one of
+        sqlite_funcs.SQLITE_EXTENSIONS, or is a manifest (see shard_funcs),
+        in which case only the shards that changed are written. Other
+        databases save themselves.
+
+        The XML is streamed into a temporary file in the same directory
+        (see writeDB()), which is synced to disk and then renamed over
+        filename. So filename always holds either the old or the new
+        database, never a partly written one.
+
+        If words_db was loaded with an edit journal from filename, the
+        journal is emptied, as its edits are now in the file. If it was
+        loaded with validation at 'save', it is validated first.
 
     """
-    with open(filename, 'w') as f:
-        f.write(ET.tostring(words_db, encoding='utf-8', pretty_print=True,
-            xml_declaration=True, standalone=True))
+    if not isinstance(words_db, ET._ElementTree):
+        words_db.saveDB(filename)
+        return
+    import sqlite_funcs
+    if sqlite_funcs.isSQLiteFile(filename):
+        sqlite_funcs.importXML(words_db, filename).close()
+        return
+
+    import validation_funcs
+    report = validation_funcs.getReport(words_db)
+    if report is not None and report.mode == validation_funcs.VALIDATE_SAVE:
+        validation_funcs.validateDB(words_db, filename, report)
+
+    import shard_funcs
+    if shard_funcs.isManifest(filename):
+        shard_funcs.saveShards(words_db, filename)
+        return
+
+    replaceFile(filename, lambda f: writeDB(words_db, f))
+
+    # Saving into its own file folds the edit journal in
+    import journal_funcs
+    journal = journal_funcs.getJournal(words_db)
+    if journal is not None and (os.path.abspath(journal.filename) ==
+                                os.path.abspath(filename)):
+        journal.clear()
+
+def replaceFile(filename, write):
+    """ Replaces filename with what write(f) writes into the file object f
+
+        The data is written into a temporary file next to filename, which
+        is synced to disk and then renamed over filename. If write fails,
+        filename is left as it was. The new file keeps the mode of
+        filename, or if there is none, gets the mode open() would give it.
 
-def searchDB(word_db, search_word):
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_file = tempfile.mkstemp(prefix='.etym', suffix='.tmp',
+                                    dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_file)
+        else:
+            # mkstemp() makes the file 0600, whatever the umask
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_file, 0o666 & ~umask)
+        try:
+            os.rename(tmp_file, filename)
+        except OSError:
+            # Windows won't rename over an existing file
+            os.remove(filename)
+            os.rename(tmp_file, filename)
+    except:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+def writeDB(words_db, f, trees=None):
+    """ Writes the XML database words_db into the file object f
+
+        The output is the same as ET.tostring(words_db, pretty_print=True),
+        but it is written one tree at a time, so the whole document is
+        never held as one string. Trees emptied by deleteTree() are left
+        out, as they wouldn't pass the DTD.
+
+        If trees is given, only those trees of words_db are written, and
+        not the comments before the etym element.
+
+    """
+    root = words_db.getroot()
+    docinfo = words_db.docinfo
+    f.write(b"<?xml version='1.0' encoding='utf-8' standalone='yes'?>\n")
+    if docinfo.internalDTD is not None:
+        f.write(_internalDTD(words_db) + b'\n')
+    elif docinfo.doctype:
+        f.write(docinfo.doctype.encode('utf-8') + b'\n')
+    if trees is None:
+        for node in reversed(list(root.itersiblings(preceding=True))):
+            f.write(ET.tostring(node, encoding='utf-8', with_tail=False) +
+                    b'\n')
+        trees = root.iterchildren(tag='tree')
+    f.write(b'<etym>\n')
+    for tree in trees:
+        if len(tree) == 0:
+            continue
+        data = ET.tostring(tree, encoding='utf-8', pretty_print=True)
+        # Indent the tree one level, as it sits inside the etym element
+        f.write(b'  ' + _NEWLINE_TAG.sub(b'>\n  ', data))
+    f.write(b'</etym>\n')
+
+def _internalDTD(words_db):
+    """ Returns the DOCTYPE of words_db with its internal DTD, as lxml
+        writes it
+
+        lxml can't write a DTD on its own, so the document is written with
+        the trees taken out of the etym element for the time being.
+
+    """
+    root = words_db.getroot()
+    trees = list(root)
+    del root[:]
+    try:
+        data = ET.tostring(words_db, encoding='utf-8')
+    finally:
+        root.extend(trees)
+    return _DOCTYPE.search(data).group(0)
+
+def searchDB(word_db, search_word, field='text', mode='exact'):
     """ Searches the database word_db for the word search_word
 
         Returns a tuple: (num_trees, words)
         The 'words' element is itself a list of tuples: 
         [(tree,word), (tree,word), ...]
 
+        field is the word detail that is matched, either 'text' (the
+        default) or 'morpheme'. The lookup goes through the search index
+        of word_db.
+
+        mode is how search_word is matched (one of
+        index_funcs.SEARCH_MODES): 'exact' (the default), 'normal' or
+        'fuzzy'. 'normal' matches the values with the same search key
+        (see index_funcs.searchKey()), ignoring case, diacritics and the
+        '*' and '-' around PIE roots; it also finds the tree roots, as
+        (tree, tree). 'fuzzy' finds the values nearly matching search_word
+        through a trigram index (see fuzzy_funcs). The words of the best
+        match come first. 'regex' takes search_word as a regular
+        expression, matched against every word and tree root in a pool
+        of processes (see regex_funcs); field can then be 'def' too.
+        'fulltext' ranks the words whose field, 'def' or 'lang', best
+        matches the words of search_word (see text_funcs), best first.
+
+        The results of the latest searches are cached with word_db until
+        an edit function of this module is called (see cache_funcs);
+        cache_funcs.getCache(word_db).stats() tells how well it does.
+
     """
-     # We go through each of the possible trees
-    matched_words = []
-    found_roots = set()
-    num_trees = 0
-    for tree in word_db.getroot().iterchildren():
-        for word in tree.iterdescendants(tag='word'):
-            for text in word.iterchildren(tag='text'):
-                if text.text == search_word:
-                    # Alright, we found a match
-                    # Add the root to our list
-                    if tree not in found_roots:
-                        num_trees += 1
-                    found_roots.add(tree)
-                    # Add the found word to our list
-                    matched_words.append((tree, word))
+    _checkSearch(field, mode)
+    cache = cache_funcs.getCache(word_db)
+    key = cache_funcs.queryKey(search_word, field, mode)
+    result = cache.get(key)
+    if result is None:
+        result = _searchDB(word_db, search_word, field, mode)
+        cache.put(key, result)
+    num_trees, matched_words = result
+    # A copy, so the caller can't change the cached result
+    return (num_trees, list(matched_words))
+
+def _searchDB(word_db, search_word, field, mode):
+    """ Searches word_db without the result cache, see searchDB() """
+    if not isinstance(word_db, ET._ElementTree):
+        return word_db.searchDB(search_word, field, mode)
+
+    if mode == 'regex':
+        import regex_funcs
+        matched_words = regex_funcs.searchTrees(list(
+            word_db.getroot().iterchildren(tag='tree')), search_word, field)
+        num_trees = len(set(tree for tree, word in matched_words))
+        return (num_trees, matched_words)
+
+    index = index_funcs.getIndex(word_db.getroot())
+    if mode == 'fulltext':
+        matched_words = index.textLookup(word_db.getroot(), field,
+                                         search_word, text_funcs.MAX_RESULTS)
+    elif mode == 'fuzzy':
+        matched_words = index.fuzzyLookup(field, search_word)
+    elif mode == 'normal':
+        matched_words = index.normalLookup(field, search_word)
+    else:
+        matched_words = index.lookup(field, search_word)
+    num_trees = len(set(tree for tree, word in matched_words))
 
     return (num_trees, matched_words)
 
+def searchDB_many(word_db, search_words, field='text', mode='exact'):
+    """ Searches the database word_db for each word in search_words
+
+        Returns a dict: search word -> (num_trees, words), each value
+        being what searchDB() returns for that word. Each word is a
+        lookup in the search index, so the whole batch costs one pass
+        over the database (building the index, if it isn't built yet)
+        rather than one per word. See scanDB_many() to search a file
+        without loading it.
+
+    """
+    _checkSearch(field, mode)
+    if not isinstance(word_db, ET._ElementTree):
+        return word_db.searchDB_many(search_words, field, mode)
+
+    results = {}
+    for search_word in search_words:
+        if search_word not in results:
+            results[search_word] = searchDB(word_db, search_word, field, mode)
+    return results
+
+def _checkSearch(field, mode):
+    """ Raises EtymExceptDB unless field can be searched in mode """
+    if mode not in index_funcs.SEARCH_MODES:
+        raise EtymExceptDB('Unknown search mode {0}'.format(mode))
+    if mode == 'regex':
+        import regex_funcs
+        fields = regex_funcs.REGEX_FIELDS
+    elif mode == 'fulltext':
+        fields = text_funcs.TEXT_FIELDS
+    else:
+        fields = index_funcs.INDEX_FIELDS
+    if field not in fields:
+        raise EtymExceptDB('Cannot search on the field {0}'.format(field))
+
+def completeDB(word_db, prefix, field='text', limit=10):
+    """ Completes prefix to the values of the database word_db starting
+        with it, such as for a search box suggesting words as they are
+        typed
+
+        Returns a list of at most limit values of field ('text' or
+        'morpheme'), in alphabetical order. The values are compared by
+        their search key (see index_funcs.searchKey()), ignoring case and
+        diacritics. The completions come from a prefix index, built on
+        the first call and kept current by the edit functions.
+
+    """
+    if field not in index_funcs.INDEX_FIELDS:
+        raise EtymExceptDB('Cannot complete the field {0}'.format(field))
+    if not isinstance(word_db, ET._ElementTree):
+        return word_db.completeDB(prefix, field, limit)
+    return index_funcs.getIndex(word_db.getroot()).complete(field, prefix,
+                                                            limit)
+
+def iterLanguage(word_db, lang, under=None):
+    """ Yields the words of the database word_db whose lang is lang
+
+        Yields (tree, word) tuples in document order, as searchDB()
+        returns them; a tree root in lang is yielded as (tree, tree). The
+        words come from the language table of the search index, so only
+        the words in lang are looked at.
+
+        under limits the words to the descendants of a tree root or word
+        (itself included, as in isDescendant()), or of any of a list of
+        them. For example, the Modern English descendants of the PIE
+        roots are:
+
+            roots = [word for tree, word in iterLanguage(word_db, 'PIE')]
+            iterLanguage(word_db, 'Modern English', roots)
+
+    """
+    if under is not None and not isinstance(under, (list, tuple, set)):
+        under = [under]
+    if not isinstance(word_db, ET._ElementTree):
+        for match in word_db.iterLanguage(lang, under):
+            yield match
+        return
+
+    root = word_db.getroot()
+    matches = index_funcs.getIndex(root).langLookup(root, lang)
+    if under is not None:
+        under = set(under)
+    for tree, word in matches:
+        if under is None or tree in under or word in under or any(
+                ancestor in under for ancestor in word.iterancestors('word')):
+            yield (tree, word)
+
+def countLanguages(word_db):
+    """ Returns the dict: lang -> how many words of word_db are in lang
+
+        The tree roots are counted too. See iterLanguage().
+
+    """
+    if not isinstance(word_db, ET._ElementTree):
+        return word_db.countLanguages()
+    root = word_db.getroot()
+    return index_funcs.getIndex(root).langCounts(root)
+
+def countTrees(word_db):
+    """ Returns how many trees are in the database word_db """
+    if isinstance(word_db, ET._ElementTree):
+        return len(word_db.getroot())
+    return len(word_db)
+
 def loadWordDetails(word):
     """ Returns the details of the element word
 
@@ -91,21 +719,18 @@ def loadWordDetails(word):
         whereas there can be more than one 'text' element. These text 
         elements are stored in a list.
 
+        The details come from the view of word (see view_funcs), which is
+        read once until the next edit; the dict is new at each call.
+
     """
     if word == []:
         raise EtymExceptWord('No word given for loadWordDetails')
+    if isinstance(word, BackendWord):
+        return word.db.loadWordDetails(word)
 
-    wordDets = {'lang': None, 'def': None, 'text': None, 
-                'morpheme': None, 'tag': None}
-    
-    wordDets['lang'] = word.xpath('lang')[0].text
-    wordDets['def'] = word.xpath('def')[0].text
-    wordDets['morpheme'] = word.xpath('morpheme')[0].text
-    wordDets['text'] = [n.text for n in word.xpath('text')]
-    wordDets['tag'] = word.tag
-
-    return wordDets
+    return view_funcs.getView(word).details()
 
+@_journaled
 def editWordDetails(word, details):
     """ Edits the element word using details
 
@@ -132,6 +757,8 @@ def editWordDetails(word, details):
                     '\n details: {0}'.format(details))
     if type(details['text']) is not list:
         raise EtymExceptWord("'text' value is not a list")
+    if isinstance(word, BackendWord):
+        return word.db.editWordDetails(word, details)
 
     # Create the new Element objects
     new_elements = []
@@ -146,6 +773,14 @@ def editWordDetails(word, details):
             new_element.text = details[item]
         new_elements.append(new_element)
 
+    # The index drops a word using the values it holds, so do it now
+    index, tree = index_funcs.findIndex(word)
+    if index is not None:
+        if word.tag == 'word':
+            index.removeWord(word)
+        else:
+            index.removeRoot(word)
+
     # Save subword(s) and remove them from tree
     for child in word.iterchildren(tag='word'):
         new_elements.append(child)
@@ -160,6 +795,13 @@ def editWordDetails(word, details):
     for item in new_elements:
         word.append(item)
 
+    # Keep the search index current
+    if index is not None:
+        if word.tag == 'word':
+            index.addWord(word)
+        else:
+            index.addRoot(word)
+
 def loadWordParents(word):
     """ This returns the parent(s) of a given word
 
@@ -171,7 +813,9 @@ def loadWordParents(word):
     so this doesn't return a list.
 
     """
-    return word.getparent()
+    if isinstance(word, BackendWord):
+        return word.db.loadWordParents(word)
+    return view_funcs.getView(word).parent
 
 def loadWordChildren(word):
     """ This returns the child(ren) of a given word
@@ -181,12 +825,17 @@ def loadWordChildren(word):
     If no children are found, then it returns [].
 
     """
-    return word.xpath('word')
+    if isinstance(word, BackendWord):
+        return word.db.loadWordChildren(word)
+    return list(view_funcs.getView(word).children)
 
 def countWordChildren(word):
     """ Returns how many children a word has """
-    return len(word.xpath('word'))
+    if isinstance(word, BackendWord):
+        return word.db.countWordChildren(word)
+    return len(view_funcs.getView(word).children)
 
+@_journaled
 def createWord(word_details, word_parent=None, word_children=None):
     """ Creates a new word given the word_details dictionary
     
@@ -236,58 +885,124 @@ def createWord(word_details, word_parent=None, word_children=None):
         raise EtymExceptWord('No word_details specified!')
 
     # Attach to parent word
+    if isinstance(word_parent, BackendWord):
+        # The backend copies the element in and hands out its own word
+        return word_parent.db.editWordParent(new_word, word_parent)
     if word_parent is not None:
         editWordParent(new_word, word_parent)
 
     # Return the newly created word
     return new_word
 
-def validateWord(word):
-    """ Validates the elements of a word
+def checkWord(word):
+    """ Checks that the elements of a word follow the DTD, without changes
 
-    word is an Element object and is checked that it follows the DTD.
-    If all the subelements exist (lang, def, subwords, etc), then it
-    rewrites them in the proper order.
+    word is an Element object. Its subelements must be the details (one
+    lang, one or more text and morpheme, one def) and the subwords. They
+    are looked at once, in one pass, and nothing is rewritten, so this
+    is cheap enough to run on every word of a database.
 
-    """
+    Returns True if the subelements are in the order of the DTD, and
+    False if only that is wrong (normalizeWord() fixes it). Raises
+    EtymExceptWord otherwise.
 
+    """
     if word is None:
         raise EtymExceptWord('word is None!')
+    if isinstance(word, BackendWord):
+        return word.db.validateWord(word)
 
     # First check the tag
     if word.tag not in ['word', 'tree', 'etym']:
         raise EtymExceptWord('Invalid word tag (tag={0})'.format(word.tag))
+    if word.tag == 'etym':
+        return True
+
+    # Count the subelements and see whether they are in order
+    langs = texts = morphemes = defs = 0
+    rank = 0
+    in_order = True
+    for child in word:
+        child_rank = _DETAIL_RANKS.get(child.tag)
+        if child_rank is None:
+            # Only allowable items are allowed
+            raise EtymExceptWord('Extra item(s) found in word details'
+                    '\n details: {0}'.format(_childTags(word)))
+        if child_rank < rank:
+            in_order = False
+        else:
+            rank = child_rank
+        if child_rank == 0:
+            langs += 1
+        elif child_rank == 1:
+            texts += 1
+        elif child_rank == 2:
+            morphemes += 1
+        elif child_rank == 3:
+            defs += 1
+
+    # Need at least one of each detail, and at most one lang and def
+    for item, count in (('lang', langs), ('text', texts),
+                        ('morpheme', morphemes), ('def', defs)):
+        if count < 1:
+            raise EtymExceptWord('Required item "{0}" not found in word details'
+                '\n details: {1}'.format(item, _childTags(word)))
+    for item, count in (('lang', langs), ('def', defs)):
+        if count > 1:
+            raise EtymExceptWord('Too many of "{0}" found in word details'
+                '\n details: {1}'.format(item, _childTags(word)))
+
+    return in_order
+
+def normalizeWord(word):
+    """ Puts the elements of a word in the order of the DTD
+
+    word must pass checkWord(). Its subelements are moved (not copied) so
+    that the lang comes first, then the texts, the morphemes, the def and
+    the subwords, each kind keeping its own order. Returns True if word
+    had to be reordered, False if it was in order already.
+
+    Only a reorder is an edit: a word already in order isn't journaled
+    and doesn't start a new generation of the caches.
 
-    # Check all of the subelements are present in right numbers
-    if word.tag in ['word', 'tree']:
-        test_items = {'lang':0, 'text':0, 'morpheme':0, 'def':0, 'word':0}
-        word_items = [child.tag for child in word]
-        for item in word_items:
-            if item not in test_items.keys():
-                # Only allowable items are allowed
-                raise EtymExceptWord('Extra item(s) found in word details'
-                        '\n details: {0}'.format(word_items))
-            else:
-                test_items[item] += 1
+    """
+    if isinstance(word, BackendWord):
+        # The rows of a backend don't have an order
+        checkWord(word)
+        return False
+    if checkWord(word):
+        return False
+    _reorderWord(word)
+    return True
 
-        # Need at least one of the following
-        for item in ['lang', 'text', 'morpheme', 'def']:
-            if test_items[item] < 1:
-                raise EtymExceptWord('Required item "{0}" not found in word details'
-                    '\n details: {1}'.format(item, word_items))
+@_journaled
+def _reorderWord(word):
+    """ Moves the subelements of word into the order of the DTD """
+    # The subwords keep their order, so the search index stays good
+    for child in sorted(word, key=lambda child: _DETAIL_RANKS[child.tag]):
+        word.append(child)
 
-        # Need at most one of the following
-        for item in ['lang', 'def']:
-            if test_items[item] > 1:
-                raise EtymExceptWord('Too many of "{0}" found in word details'
-                    '\n details: {1}'.format(item, word_items))
+def validateWord(word):
+    """ Validates the elements of a word
 
-        # Now put the items in the right order
-        word_dets = loadWordDetails(word)
-        editWordDetails(word, word_dets)
+    word is an Element object and is checked that it follows the DTD.
+    If all the subelements exist (lang, def, subwords, etc), then it
+    puts them in the proper order. This is checkWord() followed by
+    normalizeWord(); the edit functions only normalize the words that
+    checkWord() finds out of order.
 
+    """
+    if isinstance(word, BackendWord):
+        return word.db.validateWord(word)
+    checkWord(word)
+    normalizeWord(word)
     return True
 
+def _childTags(word):
+    """ Returns the list of the tags of the subelements of word """
+    return [child.tag for child in word]
+
+@_journaled
 def editWordChildren(word, children):
     """ Changes the children of a word
 
@@ -310,17 +1025,24 @@ def editWordChildren(word, children):
     # Check that each child is valid
     if num_children > 0:
         for child in children:
-            validateWord(child)
+            _checkWord(child)
 
     # Remove extant children
+    index, tree = index_funcs.findIndex(word)
     for child in word.iterchildren(tag='word'):
+        if index is not None:
+            index.removeSubtree(child)
         word.remove(child)
 
     # Add in the new ones
     if num_children > 0:
         for child in children:
+            _unindexWord(child)
             word.append(child)
+            if index is not None:
+                index.addSubtree(tree, child)
 
+@_journaled
 def editWordParent(word, parent):
     """ Changes the parent of a word
 
@@ -334,21 +1056,28 @@ def editWordParent(word, parent):
     """
 
     # Check inputs
-    validateWord(word)
+    if isinstance(parent, BackendWord):
+        return parent.db.editWordParent(word, parent)
+    if isinstance(word, BackendWord):
+        return word.db.editWordParent(word, parent)
+    _checkWord(word)
     if parent is not None:
-        validateWord(parent)
+        _checkWord(parent)
 
     # Sever the word from its old parent
+    _unindexWord(word)
     old_parent = word.getparent()
     if old_parent is not None:
-        for child in old_parent.iterchildren(tag='word'):
-            if child == word:
-                old_parent.remove(child)
+        old_parent.remove(word)
 
     # Attach it to its new one
     if parent is not None:
         parent.append(word)
+        index, tree = index_funcs.findIndex(word)
+        if index is not None:
+            index.addSubtree(tree, word)
 
+@_journaled
 def deleteWord(word):
     """ Deletes the word from the tree
 
@@ -359,22 +1088,30 @@ def deleteWord(word):
 
     The word is then removed from the tree.
 
+    This runs as a transaction (see transaction()), so the parent is
+    checked once rather than once for each child moved onto it.
+
     """
 
     # Check input
-    validateWord(word)
+    if isinstance(word, BackendWord):
+        return word.db.deleteWord(word)
 
-    # Load in parent and children
-    word_children = loadWordChildren(word)
-    word_parent = loadWordParents(word)
+    with transaction():
+        _checkWord(word)
 
-    # Attach the children to the new parent
-    for child in word_children:
-        editWordParent(child, word_parent)
+        # Load in parent and children
+        word_children = loadWordChildren(word)
+        word_parent = loadWordParents(word)
 
-    # Sever the word from its parent
-    editWordParent(word, None)
+        # Attach the children to the new parent
+        for child in word_children:
+            editWordParent(child, word_parent)
 
+        # Sever the word from its parent
+        editWordParent(word, None)
+
+@_journaled
 def moveWord(source, dest):
     """ Moves a word in the tree to a different location
 
@@ -387,14 +1124,27 @@ def moveWord(source, dest):
     This is just a wrapper (possibly unneeded) for editWordParent()
 
     """
-    validateWord(source)
-    validateWord(dest)
+    if isinstance(source, BackendWord):
+        return source.db.moveWord(source, dest)
+    _checkWord(source)
+    _checkWord(dest)
 
     editWordParent(source, dest)
 
 def findRoot(word):
-    """ Returns the tree root for a given word """
-    return word.xpath('ancestor::tree')[0]
+    """ Returns the tree root for a given word
+
+    In a loaded database, this is a lookup of the ancestry label of the
+    word (see index_funcs.WordIndex.label()).
+
+    """
+    if isinstance(word, BackendWord):
+        return word.db.findRoot(word)
+    index = index_funcs.rootIndex(word)
+    label = index.label(word) if index is not None else None
+    if label is not None:
+        return label[0]
+    return word.xpath('ancestor-or-self::tree')[0]
 
 def isDescendant(source, test_word):
     """ Determines if test_word is a descendant of source
@@ -402,14 +1152,26 @@ def isDescendant(source, test_word):
     Returns True if so, False otherwise. Also returns true if 
     source and test_word are the same.
 
-    """
-    validateWord(source)
-    validateWord(test_word)
+    In a loaded database, this compares the ancestry labels of the two
+    words (see index_funcs.WordIndex.label()) instead of listing the
+    descendants of source.
 
+    """
+    if isinstance(source, BackendWord):
+        return source.db.isDescendant(source, test_word)
+    for word in (source, test_word):
+        if checkNode(word) not in ['word', 'tree']:
+            raise EtymExceptWord('Invalid word tag (tag={0})'.format(
+                word.tag))
+
+    index = index_funcs.rootIndex(source)
+    if index is not None:
+        result = index.isDescendant(source, test_word)
+        if result is not None:
+            return result
     # Find all descendants
-    descs = source.xpath('descendant-or-self::word')
-    # Perform the test
-    return (test_word in descs)
+    return source == test_word or test_word in source.iterdescendants(
+        tag='word')
 
 def checkNode(word):
     """ Checks the word and returns the type 
@@ -420,18 +1182,25 @@ def checkNode(word):
     """
     if word is None:
         raise EtymExceptWord('word is None')
+    if isinstance(word, BackendWord):
+        return word.db.checkNode(word)
 
     return word.tag
 
+@_journaled
 def deleteTree(tree):
     """ Removes the tree and all its children from the XML db """
 
     # Check input
-    validateWord(tree)
+    if isinstance(tree, BackendWord):
+        return tree.db.deleteTree(tree)
+    _checkWord(tree)
 
     # Sever the tree from the db
+    _unindexWord(tree)
     tree.clear()
 
+@_journaled
 def addTree(word_db, tree_details, children):
     """ Add a tree to the XML db 
 
@@ -463,6 +1232,8 @@ def addTree(word_db, tree_details, children):
         raise EtymExceptWord("'text' value is not a list")
 
     tree_details['tag'] = 'tree'
+    if not isinstance(word_db, ET._ElementTree):
+        return word_db.addTree(tree_details, children)
 
     # Find the root etym element (it's the parent of each tree)
     etym_root = word_db.getroot()
@@ -471,5 +1242,46 @@ def addTree(word_db, tree_details, children):
     new_tree = createWord(tree_details, word_parent=etym_root,
                           word_children=children)
     return new_tree
+
+@_journaled
+def addTrees(word_db, trees):
+    """ Adds the finished tree elements trees to the db, in bulk
+
+    Returns the number of trees added.
+
+    Unlike addTree(), the trees come with all their words already in
+    place, as import_funcs builds them. Each one is checked against the
+    DTD of word_db once, and none is added unless they all pass (raising
+    EtymExceptWord). They are then appended to the etym element together
+    and indexed, without checking each word as it is attached.
+
+    """
+    if word_db is None:
+        raise EtymExceptDB("'word_db' argument is invalid")
+
+    import validation_funcs
+    xml_db = isinstance(word_db, ET._ElementTree)
+    dtd = validation_funcs.getDTD(word_db if xml_db else newDB())
+    for tree in trees:
+        if tree.tag != 'tree' or not dtd.validate(tree):
+            raise EtymExceptWord("Tree {0} doesn't follow the DTD\n{1}".format(
+                tree.get('id'), dtd.error_log.filter_from_errors()))
+    if not xml_db:
+        return word_db.addTrees(trees)
+
+    etym_root = word_db.getroot()
+    etym_root.extend(trees)
+    index = getattr(etym_root, '_word_index', None)
+    if index is not None:
+        with index_funcs.pausedGC():
+            for tree in trees:
+                index.addSubtree(tree, tree)
+    return len(trees)
+
+def _unindexWord(word):
+    """ Removes word and its descendants from its database's index """
+    index, tree = index_funcs.findIndex(word)
+    if index is not None:
+        index.removeSubtree(word)
 # EOF
 
@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+""" This module keeps a word database in a few flat arrays
+
+    common_funcs.loadDB(filename, compact=True) streams through the XML
+    file one tree at a time and returns a read-only CompactDB, which needs
+    a small fraction of the memory of the lxml elements (an element for
+    every word and for each of its details). Its words are handed out as
+    common_funcs.BackendWord objects, so the read side of common_funcs
+    (searchDB, loadWordDetails, loadWordChildren, loadWordParents,
+    findRoot, isDescendant and the others) works on it as on a loaded
+    database. saveDB() turns it back into lxml elements to write it out.
+
+    The tree roots and words are numbered in document order, so the
+    descendants of a word are the numbers after it, up to the end of its
+    subtree. The arrays are:
+        parents: the number of the parent of each word, -1 for a tree root
+        ends: the number following the last descendant of each word
+        langs, defs: the string number of the lang and def of each word
+        texts, morphemes: the string numbers of the texts (morphemes) of
+            all the words, with the offset of the first one of each word
+    All the values are interned in one StringTable, packed into a single
+    UTF-8 string and sorted so that a value is found by a binary search.
+    For the lang, text and morpheme, the postings list the words holding
+    each value, in document order.
+
+"""
+
+###
+# Imports
+import struct
+from array import array
+
+import common_funcs as cf
+import index_funcs
+import fuzzy_funcs
+import prefix_funcs
+import regex_funcs
+import text_funcs
+
+###
+# Constants
+# A detail not found (yet)
+_MISSING = object()
+# The length of the blob of a StringTable and its number of offsets
+_TABLE_HEADER = struct.Struct('<QQ')
+
+###
+# Classes
+class StringTable(object):
+    """ Sorted strings packed into one UTF-8 string, numbered from 1
+
+        Number 0 stands for None (an element without text).
+
+    """
+    def __init__(self, values):
+        """ Packs values, a sorted list of UTF-8 encoded strings """
+        self._blob = b''.join(values)
+        self._offsets = array('I', [0, 0])
+        end = 0
+        for value in values:
+            end += len(value)
+            self._offsets.append(end)
+
+    def __len__(self):
+        """ The number of strings, counting None """
+        return len(self._offsets) - 1
+
+    def __getitem__(self, num):
+        """ Returns the string number num, as unicode """
+        if num == 0:
+            return None
+        return self._blob[self._offsets[num]:self._offsets[num + 1]].decode(
+            'utf-8')
+
+    def find(self, value):
+        """ Returns the number of the string value, or None if it isn't one
+        """
+        if value is None:
+            return 0
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        low, high = 1, len(self._offsets) - 1
+        while low < high:
+            mid = (low + high) // 2
+            if self._raw(mid) < value:
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(self._offsets) - 1 or self._raw(low) != value:
+            return None
+        return low
+
+    def write(self, f):
+        """ Writes the table into the file object f, see readStringTable()
+        """
+        f.write(_TABLE_HEADER.pack(len(self._blob), len(self._offsets)))
+        f.write(self._blob)
+        f.write(self._offsets.tostring())
+
+    def _raw(self, num):
+        """ Returns the string number num, UTF-8 encoded """
+        return self._blob[self._offsets[num]:self._offsets[num + 1]]
+
+class CompactDB(object):
+    """ A read-only word database kept in flat arrays """
+    def __init__(self, trees):
+        """ Builds the database from the lxml tree elements trees
+
+            trees can be any iterable, such as common_funcs.iterDB(), and
+            each tree is only read once. Emptied trees (see
+            common_funcs.deleteTree()) are skipped.
+
+        """
+        self.parents = array('i')
+        self.ends = array('I')
+        self.langs = array('I')
+        self.defs = array('I')
+        self.texts = array('I')
+        self.text_offsets = array('I', [0])
+        self.morphemes = array('I')
+        self.morpheme_offsets = array('I', [0])
+        # The numbers of the tree roots, in order, and the string numbers
+        # of their XML id attributes
+        self.roots = array('I')
+        self.tree_ids = array('I')
+        # value -> its string number, while building; 0 is None
+        strings = {None: 0}
+        with index_funcs.pausedGC():
+            for tree in trees:
+                if len(tree):
+                    self._addTree(tree, strings)
+            self._sortStrings(strings)
+        # field -> (string number -> offset into the postings, postings)
+        self._postings = {
+            'lang': self._buildPostings(self.langs),
+            'text': self._buildPostings(self.texts, self.text_offsets),
+            'morpheme': self._buildPostings(self.morphemes,
+                                            self.morpheme_offsets)}
+        # field -> search key -> [string number, ...], once built
+        self._keys = {}
+        # field -> fuzzy_funcs.TrigramIndex, once built
+        self._trigrams = {}
+        # field -> prefix_funcs.PrefixIndex, once built
+        self._prefixes = {}
+        # field -> text_funcs.TextIndex of word numbers, once built
+        self._text_indexes = {}
+
+    def __len__(self):
+        """ The number of trees in the database """
+        return len(self.roots)
+
+    ###
+    # Reading
+    def searchDB(self, search_word, field='text', mode='exact'):
+        """ Searches the database, see common_funcs.searchDB() """
+        if mode == 'fuzzy':
+            if field not in self._trigrams:
+                self._trigrams[field] = fuzzy_funcs.TrigramIndex(
+                    self._values(field))
+            matched_words = index_funcs.uniqueMatches(
+                self._lookup(field, value) for value in
+                self._trigrams[field].search(search_word))
+        elif mode == 'fulltext':
+            if field not in self._text_indexes:
+                texts = self._text_indexes[field] = text_funcs.TextIndex()
+                values = self.defs if field == 'def' else self.langs
+                with index_funcs.pausedGC():
+                    for num, string_num in enumerate(values):
+                        texts.add(num, self.strings[string_num])
+            matches = sorted((-score, num) for score, num in
+                             self._text_indexes[field].search(
+                                 search_word, text_funcs.MAX_RESULTS))
+            matched_words = [self._match(num) for score, num in matches]
+        elif mode == 'regex':
+            regex = regex_funcs.compilePattern(search_word)
+            string_nums = set(string_num for string_num in
+                              xrange(1, len(self.strings))
+                              if regex.search(self.strings[string_num]))
+            if field == 'def':
+                nums = [num for num, string_num in enumerate(self.defs)
+                        if string_num in string_nums]
+            else:
+                nums = self._holding(field, string_nums)
+            matched_words = self._matches(nums)
+        elif mode == 'normal':
+            matched_words = self._matches(self._holding(field,
+                self._keyStrings(field).get(
+                    index_funcs.searchKey(search_word), ())))
+        else:
+            matched_words = self._lookup(field, search_word)
+        num_trees = len(set(tree for tree, word in matched_words))
+
+        return (num_trees, matched_words)
+
+    def searchDB_many(self, search_words, field='text', mode='exact'):
+        """ Searches the database for each of search_words, see
+            common_funcs.searchDB_many()
+
+        """
+        return dict((search_word, self.searchDB(search_word, field, mode))
+                    for search_word in set(search_words))
+
+    def completeDB(self, prefix, field='text', limit=10):
+        """ Completes prefix, see common_funcs.completeDB() """
+        if field not in self._prefixes:
+            self._prefixes[field] = prefix_funcs.PrefixIndex(
+                self._values(field), index_funcs.searchKey)
+        return self._prefixes[field].complete(prefix, limit)
+
+    def iterLanguage(self, lang, under=None):
+        """ Yields the (tree, word) in lang, see common_funcs.iterLanguage()
+        """
+        string_num = self._stringNum(lang)
+        if string_num is None:
+            return
+        for num in self._posting('lang', string_num):
+            word = self._word(num)
+            if under is None or any(self.isDescendant(source, word)
+                                    for source in under):
+                yield self._match(num)
+
+    def countLanguages(self):
+        """ Returns lang -> number of words, see common_funcs.countLanguages()
+        """
+        offsets, postings = self._postings['lang']
+        return dict((self.strings[string_num],
+                     offsets[string_num+1] - offsets[string_num])
+                    for string_num in xrange(len(self.strings))
+                    if offsets[string_num+1] > offsets[string_num])
+
+    def loadWordDetails(self, word):
+        """ Returns the details of word, see common_funcs.loadWordDetails() """
+        num = self._num(word)
+        morphemes = self._strings(self.morphemes, self.morpheme_offsets, num)
+        return {'lang': self.strings[self.langs[num]],
+                'def': self.strings[self.defs[num]],
+                'text': self._strings(self.texts, self.text_offsets, num),
+                'morpheme': morphemes[0] if morphemes else None,
+                'tag': 'tree' if self.parents[num] < 0 else 'word'}
+
+    def loadWordParents(self, word):
+        """ Returns the parent of word, or None for a tree root """
+        parent = self.parents[self._num(word)]
+        if parent < 0:
+            return None
+        return self._word(parent)
+
+    def loadWordChildren(self, word):
+        """ Returns the list of children of word """
+        return [self._word(child) for child in self._children(self._num(word))]
+
+    def countWordChildren(self, word):
+        """ Returns how many children word has """
+        return sum(1 for child in self._children(self._num(word)))
+
+    def checkNode(self, word):
+        """ Returns 'word' or 'tree', see common_funcs.checkNode() """
+        return 'tree' if self.parents[self._num(word)] < 0 else 'word'
+
+    def findRoot(self, word):
+        """ Returns the tree root of word """
+        return self._word(self._root(self._num(word)))
+
+    def isDescendant(self, source, test_word):
+        """ Whether test_word is source or one of its descendants """
+        num = self._num(source)
+        return num <= self._num(test_word) < self.ends[num]
+
+    def validateWord(self, word):
+        """ Checks that word exists (the arrays always follow the DTD) """
+        self._num(word)
+        return True
+
+    ###
+    # Editing
+    def editWordDetails(self, word, details):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def editWordParent(self, word, parent):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def moveWord(self, source, dest):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def deleteWord(self, word):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def deleteTree(self, tree):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def addTree(self, tree_details, children):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    def addTrees(self, trees):
+        """ Raises EtymExceptDB, the database is read-only """
+        self._readOnly()
+
+    ###
+    # Saving
+    def saveDB(self, filename):
+        """ Saves the database into filename, see common_funcs.saveDB() """
+        cf.saveDB(self.toElementTree(), filename)
+
+    def toElementTree(self):
+        """ Returns the whole database as an lxml ElementTree """
+        words_db = cf.newDB()
+        root = words_db.getroot()
+        for tree_num, tree_id in zip(self.roots, self.tree_ids):
+            # The elements of the words whose subtree isn't finished
+            elements = []
+            for num in xrange(tree_num, self.ends[tree_num]):
+                parent = self.parents[num]
+                while elements and elements[-1][0] != parent:
+                    elements.pop()
+                element = self._element(num)
+                if elements:
+                    elements[-1][1].append(element)
+                else:
+                    if tree_id:
+                        element.set('id', self.strings[tree_id])
+                    root.append(element)
+                elements.append((num, element))
+        return words_db
+
+    ###
+    # Helpers
+    def _addTree(self, tree, strings):
+        """ Appends the words of the element tree, interning their values """
+        parents = self.parents
+        texts = self.texts
+        morphemes = self.morphemes
+        intern = strings.setdefault
+        # The numbers of the ancestors of the current word
+        stack = []
+        for event, node in cf.ET.iterwalk(tree, events=('start', 'end'),
+                                          tag=('tree', 'word')):
+            if event == 'end':
+                self.ends[stack.pop()] = len(parents)
+                continue
+            num = len(parents)
+            if stack:
+                parents.append(stack[-1])
+            else:
+                parents.append(-1)
+                self.roots.append(num)
+                self.tree_ids.append(intern(tree.get('id'), len(strings)))
+            self.ends.append(0)
+            stack.append(num)
+
+            # The first lang and def count, as with loadWordDetails()
+            lang = definition = _MISSING
+            for child in node:
+                tag = child.tag
+                if tag == 'text':
+                    texts.append(intern(child.text, len(strings)))
+                elif tag == 'morpheme':
+                    morphemes.append(intern(child.text, len(strings)))
+                elif tag == 'lang':
+                    if lang is _MISSING:
+                        lang = child.text
+                elif tag == 'def':
+                    if definition is _MISSING:
+                        definition = child.text
+            self.langs.append(intern(None if lang is _MISSING else lang,
+                                     len(strings)))
+            self.defs.append(intern(None if definition is _MISSING
+                                    else definition, len(strings)))
+            self.text_offsets.append(len(texts))
+            self.morpheme_offsets.append(len(morphemes))
+
+    def _sortStrings(self, strings):
+        """ Packs the strings into the sorted StringTable, and renumbers the
+            values to match
+
+        """
+        values = [None] * len(strings)
+        for value, string_num in strings.iteritems():
+            values[string_num] = value
+        # UTF-8 sorts in the order of the code points, as unicode does
+        encoded = [value.encode('utf-8') for value in values[1:]]
+        del values
+        order = sorted(xrange(len(encoded)), key=encoded.__getitem__)
+        self.strings = StringTable([encoded[pos] for pos in order])
+        del encoded
+        renumber = array('I', [0]) * len(strings)
+        for string_num, pos in enumerate(order, 1):
+            renumber[pos + 1] = string_num
+        for name in ['langs', 'defs', 'texts', 'morphemes', 'tree_ids']:
+            setattr(self, name, array('I', map(renumber.__getitem__,
+                                               getattr(self, name))))
+
+    def _buildPostings(self, values, offsets=None):
+        """ Returns the postings of a field: (offsets, words)
+
+            values holds the string number of the field of each word, or,
+            if offsets is given, of all the words, from offsets[num] for
+            word num. The words holding string number string_num are then
+            words[offsets[string_num]:offsets[string_num+1]].
+
+        """
+        counts = array('I', [0]) * (len(self.strings) + 1)
+        for string_num in values:
+            counts[string_num + 1] += 1
+        for string_num in xrange(1, len(counts)):
+            counts[string_num] += counts[string_num - 1]
+        # Fill them in document order
+        words = array('I', [0]) * len(values)
+        filled = array('I', counts)
+        if offsets is None:
+            for num, string_num in enumerate(values):
+                words[filled[string_num]] = num
+                filled[string_num] += 1
+        else:
+            num = 0
+            for pos, string_num in enumerate(values):
+                while offsets[num + 1] <= pos:
+                    num += 1
+                words[filled[string_num]] = num
+                filled[string_num] += 1
+        return (counts, words)
+
+    def _posting(self, field, string_num):
+        """ Returns the numbers of the words holding the string string_num
+            in field, in document order
+
+        """
+        offsets, postings = self._postings[field]
+        return postings[offsets[string_num]:offsets[string_num + 1]]
+
+    def _holding(self, field, string_nums):
+        """ Returns the sorted numbers of the words holding any of
+            string_nums in field
+
+        """
+        nums = set()
+        for string_num in string_nums:
+            nums.update(self._posting(field, string_num))
+        return sorted(nums)
+
+    def _lookup(self, field, value):
+        """ Returns the (tree, word) matches of value, in document order
+
+            Tree roots aren't matched, as with common_funcs.searchDB().
+
+        """
+        string_num = self._stringNum(value)
+        if string_num is None:
+            return []
+        return [self._match(num) for num in self._posting(field, string_num)
+                if self.parents[num] >= 0]
+
+    def _matches(self, nums):
+        """ Returns the (tree, word) matches of the word numbers nums """
+        return [self._match(num) for num in nums]
+
+    def _match(self, num):
+        """ Returns the (tree, word) match of the word number num """
+        return (self._word(self._root(num)), self._word(num))
+
+    def _values(self, field):
+        """ Yields each value held by some word (not a tree root) in field """
+        offsets, postings = self._postings[field]
+        for string_num in xrange(1, len(self.strings)):
+            if any(self.parents[num] >= 0 for num in
+                   postings[offsets[string_num]:offsets[string_num + 1]]):
+                yield self.strings[string_num]
+
+    def _keyStrings(self, field):
+        """ Returns the dict: search key -> string numbers of field
+
+            The values are filed under each of their search keys (see
+            index_funcs.searchKeys()), and under themselves.
+
+        """
+        if field not in self._keys:
+            keys = self._keys[field] = {}
+            offsets, postings = self._postings[field]
+            with index_funcs.pausedGC():
+                for string_num in xrange(1, len(self.strings)):
+                    if offsets[string_num + 1] > offsets[string_num]:
+                        value = self.strings[string_num]
+                        for key in set(index_funcs.searchKeys(value) +
+                                       [value]):
+                            keys.setdefault(key, []).append(string_num)
+        return self._keys[field]
+
+    def _stringNum(self, value):
+        """ Returns the string number of value, or None if it isn't held """
+        if isinstance(value, bytes):
+            # lxml only gives str for ASCII text
+            try:
+                value.decode('ascii')
+            except UnicodeDecodeError:
+                return None
+        return self.strings.find(value)
+
+    def _strings(self, values, offsets, num):
+        """ Returns the list of the values of word num in a CSR field """
+        return [self.strings[string_num] for string_num in
+                values[offsets[num]:offsets[num + 1]]]
+
+    def _children(self, num):
+        """ Yields the numbers of the children of word num """
+        child = num + 1
+        while child < self.ends[num]:
+            yield child
+            child = self.ends[child]
+
+    def _root(self, num):
+        """ Returns the number of the tree root of word num """
+        while self.parents[num] >= 0:
+            num = self.parents[num]
+        return num
+
+    def _element(self, num):
+        """ Returns a new lxml element of word num, without its children """
+        element = cf.ET.Element('tree' if self.parents[num] < 0 else 'word')
+        cf.ET.SubElement(element, 'lang').text = self.strings[self.langs[num]]
+        for field, values, offsets in [
+                ('text', self.texts, self.text_offsets),
+                ('morpheme', self.morphemes, self.morpheme_offsets)]:
+            for value in self._strings(values, offsets, num):
+                cf.ET.SubElement(element, field).text = value
+        cf.ET.SubElement(element, 'def').text = self.strings[self.defs[num]]
+        return element
+
+    def _num(self, word):
+        """ Returns the number of the BackendWord word of this database """
+        if not isinstance(word, cf.BackendWord) or word.db is not self:
+            raise cf.EtymExceptWord('The word is from another database')
+        if not 0 <= word.id < len(self.parents):
+            raise cf.EtymExceptWord('Word {0} not found'.format(word.id))
+        return word.id
+
+    def _word(self, num):
+        """ Returns the BackendWord of the word number num """
+        return cf.BackendWord(self, num)
+
+    def _readOnly(self):
+        """ Raises EtymExceptDB, as the database can't be edited """
+        raise cf.EtymExceptDB('A compact database is read-only, edit the '
+                              'lxml tree of its toElementTree() instead')
+
+###
+# Functions
+def loadCompact(filename, report=None):
+    """ Streams the XML file filename into a new CompactDB
+
+        Only one tree of filename is parsed (and validated, see
+        common_funcs.iterDB() for report) at a time.
+
+    """
+    return CompactDB(cf.iterDB(filename, drop=True, report=report))
+
+def readStringTable(f):
+    """ Reads a StringTable written by StringTable.write() from the file
+        object f
+
+    """
+    blob_size, num_offsets = _TABLE_HEADER.unpack(f.read(_TABLE_HEADER.size))
+    table = StringTable([])
+    table._blob = f.read(blob_size)
+    if len(table._blob) != blob_size:
+        raise EOFError('StringTable cut short')
+    table._offsets = array('I')
+    table._offsets.fromfile(f, num_offsets)
+    return table
+
+def compactDB(words_db):
+    """ Returns a CompactDB with the words of the loaded database words_db
+    """
+    return CompactDB(words_db.getroot().iterchildren(tag='tree'))
+# EOF
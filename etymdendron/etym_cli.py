@@ -16,7 +16,8 @@ import argparse
 # Imports (local)
 from global_opts import WORDS_FILE
 import cli_funcs
-from common_funcs import loadDB, searchDB
+from common_funcs import loadDB, searchDB, countTrees, EtymExceptDB
+from lca_funcs import commonAncestor, relationPath
 
 def main():
     """ The main routine """
@@ -25,11 +26,32 @@ def main():
     parser = argparse.ArgumentParser(description='Run etymdendron')
     parser.add_argument('word', help='Word to search for (will be asked for '
         'if not specified)', nargs='?', default=None)
+    parser.add_argument('--full', action='store_true', help='Load the whole '
+        'database instead of only the trees that are searched')
+    parser.add_argument('--fuzzy', action='store_true', help='Also find '
+        'words that nearly match, best match first')
+    parser.add_argument('--normal', action='store_true', help='Ignore case, '
+        'accents and the * and - around PIE roots, and match the variant '
+        'spellings packed into a text, such as wizun in wiz(z)un (also '
+        'finds tree roots). A search without any of these options falls '
+        'back to this when nothing matches exactly')
+    parser.add_argument('--regex', action='store_true', help='Search with '
+        'a regular expression, such as ^hr?os')
+    parser.add_argument('--definition', action='store_true', help='Rank the '
+        'words whose definition best matches the search words (loads the '
+        'whole database)')
+    parser.add_argument('--relate', metavar='OTHER', help='Show the common '
+        'ancestor of the word and OTHER and the path between them, instead '
+        'of the tree of the word (loads the whole database)')
     args = parser.parse_args()
+    if args.relate is not None and (args.fuzzy or args.normal or args.regex
+                                    or args.definition):
+        parser.error('--relate only takes exact words')
 
     ###
     # First let's load the XML
-    words_tree = loadDB(WORDS_FILE)
+    words_tree = loadDB(WORDS_FILE, lazy=not (args.full or args.definition
+                                              or args.relate is not None))
     if type(words_tree) is str:
         print(words_tree) # This holds the error message
         sys.exit(1)
@@ -40,7 +62,7 @@ def main():
     print('====   Etymdendron   ====')
     print('=========================')
     print('{0} loaded, {1} trees found'.format(WORDS_FILE,
-        len(words_tree.getroot())))
+        countTrees(words_tree)))
 
     ###
     # Search for a word
@@ -48,8 +70,31 @@ def main():
         search_word = cli_funcs.get_search_word()
     else:
         search_word = args.word
+    if args.relate is not None:
+        relate(words_tree, search_word, args.relate)
 
-    num_trees, matched_words = searchDB(words_tree, search_word)
+    try:
+        if args.definition:
+            num_trees, matched_words = searchDB(words_tree, search_word,
+                                                'def', mode='fulltext')
+        else:
+            num_trees, matched_words = searchDB(words_tree, search_word,
+                mode='fuzzy' if args.fuzzy else
+                     'normal' if args.normal else
+                     'regex' if args.regex else 'exact')
+            if num_trees == 0 and not (args.fuzzy or args.normal or
+                                       args.regex):
+                # Variant spellings are only matched by a normal search
+                num_trees, matched_words = searchDB(words_tree, search_word,
+                                                    mode='normal')
+                if num_trees > 0:
+                    print('{0} is not found as is, showing the words it '
+                          'matches ignoring case, accents and variant '
+                          'spellings'.format(search_word))
+    except EtymExceptDB as err:
+        # Such as a bad regular expression
+        print(err)
+        sys.exit(1)
 
     ###
     # Display the tree if we have matches
@@ -77,5 +122,27 @@ def main():
     # That's all!
     sys.exit(0)
 
+def relate(words_tree, word, other):
+    """ Shows how the words word and other are related in words_tree """
+    chosen_words = []
+    for search_word in (word, other):
+        num_trees, matched_words = searchDB(words_tree, search_word)
+        if num_trees == 0:
+            print('{0} is not found in {1}'.format(search_word, WORDS_FILE))
+            sys.exit(0)
+        elif len(matched_words) > 1:
+            chosen_root, chosen_word = cli_funcs.choose_word_from_many(
+                    matched_words)
+        else:
+            chosen_root, chosen_word = matched_words[0]
+        chosen_words.append(chosen_word)
+
+    path = relationPath(*chosen_words)
+    if path is None:
+        print('{0} and {1} are not in the same tree'.format(word, other))
+    else:
+        cli_funcs.display_path(path, commonAncestor(*chosen_words))
+    sys.exit(0)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+""" This module finds the values that nearly match a search word
+
+    A TrigramIndex maps each trigram (three letter slice) to the values
+    holding it. A fuzzy search looks up the trigrams of the search word
+    and ranks the values holding its rarer trigrams by their trigram
+    similarity. The best of those are then ranked by their edit distance
+    to the search word.
+
+    So only the values sharing a rare trigram with the search word are
+    looked at, instead of every value in the database.
+
+"""
+
+###
+# Imports
+import math
+from collections import defaultdict
+
+###
+# Constants
+# The least trigram similarity (from 0 to 1) of a match
+SIMILARITY = 0.3
+# How many values a fuzzy search returns by default
+MAX_VALUES = 10
+# How many candidates per returned value are ranked by edit distance
+CANDIDATES = 3
+
+###
+# Classes
+class TrigramIndex(object):
+    """ An index of values by their trigrams """
+    def __init__(self, values=()):
+        """ Creates the index, adding values to it """
+        # trigram -> set of values
+        self._values = defaultdict(set)
+        # value -> its set of trigrams
+        self._trigrams = {}
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        """ The number of values in the index """
+        return len(self._trigrams)
+
+    def add(self, value):
+        """ Adds value to the index """
+        if value is None or value in self._trigrams:
+            return
+        value_trigrams = trigrams(value)
+        self._trigrams[value] = value_trigrams
+        for trigram in value_trigrams:
+            self._values[trigram].add(value)
+
+    def remove(self, value):
+        """ Removes value from the index """
+        for trigram in self._trigrams.pop(value, ()):
+            values = self._values[trigram]
+            values.discard(value)
+            if not values:
+                del self._values[trigram]
+
+    def search(self, search_word, limit=MAX_VALUES, similarity=SIMILARITY):
+        """ Returns the values nearly matching search_word, best first
+
+            At most limit values are returned, each with a trigram
+            similarity to search_word of at least similarity.
+
+        """
+        search_trigrams = trigrams(search_word)
+        # A match shares at least min_common trigrams with search_word, so
+        # it holds one of the rarest len - min_common + 1 of them
+        min_common = max(1, int(math.ceil(similarity *
+                                          len(search_trigrams))))
+        postings = sorted((self._values.get(trigram, ()) for trigram in
+                           search_trigrams), key=len)
+        candidates = set()
+        for values in postings[:len(postings) - min_common + 1]:
+            candidates.update(values)
+
+        # Rank by trigram similarity (the Jaccard index of the trigrams)
+        scored = []
+        for value in candidates:
+            value_trigrams = self._trigrams[value]
+            num = len(search_trigrams & value_trigrams)
+            score = float(num) / (len(search_trigrams) +
+                                  len(value_trigrams) - num)
+            if score >= similarity:
+                scored.append((-score, value))
+        scored.sort()
+        candidates = scored[:limit * CANDIDATES]
+
+        # Then refine the best ones by edit distance
+        search_word = foldCase(search_word)
+        ranked = sorted((editDistance(search_word, foldCase(value)), score,
+                         value) for score, value in candidates)
+        return [value for distance, score, value in ranked[:limit]]
+
+###
+# Functions
+def foldCase(value):
+    """ Returns value as lower case unicode """
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return value.lower()
+
+def trigrams(value):
+    """ Returns the set of trigrams of value
+
+        The value is padded with two spaces in front and one behind, so
+        that the start and end of a word weigh more.
+
+    """
+    value = u'  ' + foldCase(value) + u' '
+    return set(value[pos:pos+3] for pos in xrange(len(value) - 2))
+
+def editDistance(first, second):
+    """ Returns the Levenshtein distance between the strings first, second """
+    if len(first) < len(second):
+        first, second = second, first
+    previous = range(len(second) + 1)
+    for pos, char in enumerate(first, 1):
+        current = [pos]
+        for other_pos, other_char in enumerate(second, 1):
+            current.append(min(previous[other_pos] + 1,
+                               current[other_pos-1] + 1,
+                               previous[other_pos-1] + (char != other_char)))
+        previous = current
+    return previous[-1]
+# EOF
@@ -7,3 +7,14 @@ import os.path
 # Global constants
 WORDS_FILE = os.path.join(os.path.dirname(__file__), 'words.xml')
 
+# The DTD of the word database, used when writing out a new XML file
+WORDS_DTD = '''<!DOCTYPE etym [
+<!ELEMENT etym (tree)+>
+<!ELEMENT tree (lang , text+ , morpheme+ , def , word+)>
+<!ELEMENT lang (#PCDATA)>
+<!ELEMENT text (#PCDATA)>
+<!ELEMENT morpheme (#PCDATA)>
+<!ELEMENT def (#PCDATA)>
+<!ELEMENT word (lang , text+ , morpheme+ , def , word*)>
+<!ATTLIST tree id CDATA #IMPLIED>
+]>'''
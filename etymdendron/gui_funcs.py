@@ -7,6 +7,23 @@ import wx.xrc
 import os.path
 from global_opts import WORDS_FILE
 import common_funcs as cf
+import validation_funcs
+
+# Suggests words in the search box as they are typed (needs wxPython 2.9)
+if hasattr(wx, 'TextCompleterSimple'):
+    class WordCompleter(wx.TextCompleterSimple):
+        """ Completes the search box from the database of the app """
+        def __init__(self, app):
+            wx.TextCompleterSimple.__init__(self)
+            self.app = app
+
+        def GetCompletions(self, prefix):
+            """ Returns the words starting with prefix """
+            if not prefix or getattr(self.app, 'words_tree', None) is None:
+                return []
+            return cf.completeDB(self.app.words_tree, prefix)
+else:
+    WordCompleter = None
 
 # Define the application
 class EtymApp(wx.App):
@@ -81,6 +98,11 @@ class EtymApp(wx.App):
         self.altbox = wx.xrc.XRCCTRL(self.frame, 'et_txtAlt')
         self.searchchoice = wx.xrc.XRCCTRL(self.frame, 'et_choice')
         self.searchbtn = wx.xrc.XRCCTRL(self.frame, 'et_btnSearch')
+        self.fuzzychk = wx.xrc.XRCCTRL(self.frame, 'et_checkFuzzy')
+        self.normalchk = wx.xrc.XRCCTRL(self.frame, 'et_checkNormal')
+        self.defchk = wx.xrc.XRCCTRL(self.frame, 'et_checkDef')
+        if WordCompleter is not None:
+            self.searchbox.AutoComplete(WordCompleter(self))
         self.editchk = wx.xrc.XRCCTRL(self.frame, 'et_checkEdit')
         self.editbtn_save = wx.xrc.XRCCTRL(self.frame, 'et_btnEditSave')
         self.editbtn_revert = wx.xrc.XRCCTRL(self.frame, 'et_btnEditRevert')
@@ -126,8 +148,17 @@ class EtymApp(wx.App):
         """ Searches for a word, displays results """
         self.search_word = self.searchbox.GetValue()
         if self.search_word is not '': # Simple validation for now
+            search_field = 'text'
+            if self.defchk.GetValue():
+                search_field, search_mode = 'def', 'fulltext'
+            elif self.fuzzychk.GetValue():
+                search_mode = 'fuzzy'
+            elif self.normalchk.GetValue():
+                search_mode = 'normal'
+            else:
+                search_mode = 'exact'
             num_trees, matched_words = cf.searchDB(self.words_tree,
-                    self.search_word)
+                    self.search_word, search_field, mode=search_mode)
             self.treebox.DeleteAllItems() # Clear the tree control out
             self.searchchoice.Clear() # Clear out the choice box
             self.searchchoice.Disable()
@@ -230,7 +261,8 @@ class EtymApp(wx.App):
 # Some methods for the class
     def LoadWordDB(self, filename=WORDS_FILE):
         """ Load the database file """
-        self.words_tree = cf.loadDB(filename)
+        # Edits are journaled as they are made, see journal_funcs
+        self.words_tree = cf.loadDB(filename, journal=True)
         if type(self.words_tree) is str:
             dlg_err = wx.MessageDialog(self.frame, self.words_tree
                 ,'Error', wx.OK|wx.ICON_EXCLAMATION)
@@ -238,14 +270,27 @@ class EtymApp(wx.App):
             dlg_err.Destroy()
             self.words_tree = None
         else:
-            print('{0} loaded, {1} trees found'.format(filename,
-            len(self.words_tree.getroot())))
+            print('{0} loaded, {1} trees found ({2})'.format(filename,
+            len(self.words_tree.getroot()),
+            validation_funcs.getReport(self.words_tree)))
+            if WordCompleter is not None:
+                # Build the prefix index now, not on the first key press
+                cf.completeDB(self.words_tree, '')
 
     def SaveWordDB(self, filename=WORDS_FILE):
-        """ Saves the database file """
-        cf.saveDB(self.words_tree, filename)
+        """ Saves the database file
+
+            The save streams the trees into a temporary file that replaces
+            filename once it is complete (see common_funcs.saveDB).
+
+        """
+        wx.BeginBusyCursor()
+        try:
+            cf.saveDB(self.words_tree, filename)
+        finally:
+            wx.EndBusyCursor()
         print('{0} saved with {1} trees'.format(filename,
-            len(self.words_tree.getroot())))
+            cf.countTrees(self.words_tree)))
 
     def DisplayTree(self, root, nodes, select=None):
         """ Displays the tree in the wx.TreeCtrl object 
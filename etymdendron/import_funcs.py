@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+""" This module imports words in bulk from a TSV or JSON Lines file
+
+    Each row of the file is a word (or tree root) with the columns of
+    IMPORT_COLUMNS:
+        tree: the id of the tree the word is in (the id attribute of the
+            tree element)
+        id: the id of the word, unique in its tree
+        parent: the id of the parent of the word, empty for the tree root
+        lang, def: the lang and def of the word
+        text, morpheme: its texts (morphemes), separated by TEXT_SEPARATOR
+            (in JSON Lines, they can also be a list)
+    A TSV file names its columns on its first line. For example:
+        tree    id  parent  lang    text    morpheme    def
+        7   1       PIE *ekwo-  *ekwo-  Horse
+        7   2   1   Latin   equus   equus   Horse
+
+    The rows of a tree must follow each other, but a word can come before
+    its parent. importFile() streams through the file and builds each tree
+    in one pass. It then hands the finished trees to
+    common_funcs.addTrees(), BATCH_TREES at a time, which checks each
+    tree against the DTD once and attaches them together. The whole
+    import is one transaction (see common_funcs.transaction()): if a row
+    or a tree is bad, no tree is added.
+
+"""
+
+###
+# Imports
+import io
+import os
+import json
+import time
+
+import common_funcs as cf
+
+###
+# Constants
+IMPORT_COLUMNS = ('tree', 'id', 'parent', 'lang', 'text', 'morpheme', 'def')
+# The columns a TSV file must have
+REQUIRED_COLUMNS = ('tree', 'id', 'parent')
+# File extensions read as JSON Lines, any other file is read as TSV
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson', '.json')
+# Separates the texts (and morphemes) of a word in one column
+TEXT_SEPARATOR = '|'
+# How many trees are attached (and progress reported) at a time
+BATCH_TREES = 1000
+
+###
+# Classes
+class ImportReport(object):
+    """ How far an import has got, and how fast """
+    def __init__(self, source):
+        """ Starts the report of importing source (a filename) """
+        self.source = source
+        self.rows = 0
+        self.trees = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        """ A one line summary of the report """
+        return ('import {0}: {1} rows, {2} trees in {3:.1f}s '
+                '({4:.0f} rows/s)'.format(self.source, self.rows, self.trees,
+                                          self.seconds, self.rate()))
+
+    def rate(self):
+        """ Returns the number of rows imported per second """
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+###
+# Functions
+def importFile(word_db, filename, progress=None, batch=BATCH_TREES):
+    """ Imports the words of the TSV or JSON Lines file filename into
+        word_db, see importRows()
+
+    """
+    return importRows(word_db, readRows(filename), progress, batch,
+                      source=filename)
+
+def importRows(word_db, rows, progress=None, batch=BATCH_TREES,
+               source='rows'):
+    """ Imports rows (dicts with the IMPORT_COLUMNS) into word_db
+
+        The trees are added after the trees already in word_db. progress
+        is called with the ImportReport each time a batch of trees has
+        been attached, and at the end; an exception it raises stops the
+        import (undoing it). Returns the ImportReport.
+
+    """
+    report = ImportReport(source)
+    start = time.time()
+    trees = []
+    with cf.transaction():
+        for tree in buildTrees(rows, report):
+            trees.append(tree)
+            if len(trees) >= batch:
+                _attach(word_db, trees, report, start, progress)
+                trees = []
+        _attach(word_db, trees, report, start, progress)
+    return report
+
+def buildTrees(rows, report):
+    """ Yields the tree elements made of rows, each one once it's complete
+
+        report (an ImportReport) counts the rows read. Raises
+        EtymExceptDB if a row doesn't fit in its tree.
+
+    """
+    tree_id = root = None
+    # word id -> element, word id -> parent id, and parent id ->
+    # [elements waiting for it], of the tree being built
+    words = {}
+    parents = {}
+    waiting = {}
+    done = set()
+    for row in rows:
+        report.rows += 1
+        row_tree = _rowId(row, 'tree', report)
+        if row_tree != tree_id:
+            if tree_id is not None:
+                yield _finishTree(tree_id, root, waiting, report)
+                done.add(tree_id)
+            if row_tree in done:
+                _rowError(report, 'the rows of tree {0} are not '
+                          'together'.format(row_tree))
+            tree_id = row_tree
+            root = None
+            words = {}
+            parents = {}
+            waiting = {}
+
+        word_id = _rowId(row, 'id', report)
+        if word_id in words:
+            _rowError(report, 'word {0} is already in tree {1}'.format(
+                word_id, tree_id))
+        parent_id = row.get('parent')
+        if parent_id is not None and parent_id != '':
+            parent_id = unicode(parent_id)
+        else:
+            parent_id = None
+        if parent_id is not None:
+            _checkCycle(word_id, parent_id, parents, report)
+            parents[word_id] = parent_id
+        word = words[word_id] = _makeWord(row, parent_id)
+        if parent_id is None:
+            if root is not None:
+                _rowError(report, 'tree {0} has a second root'.format(
+                    tree_id))
+            root = word
+            root.set('id', tree_id)
+        elif parent_id in words:
+            words[parent_id].append(word)
+        else:
+            waiting.setdefault(parent_id, []).append(word)
+        # The words that came before their parent
+        for child in waiting.pop(word_id, ()):
+            word.append(child)
+    if tree_id is not None:
+        yield _finishTree(tree_id, root, waiting, report)
+
+def readRows(filename):
+    """ Yields the rows of filename, read as JSON Lines or as TSV
+        depending on its extension
+
+    """
+    if os.path.splitext(filename)[1].lower() in JSONL_EXTENSIONS:
+        return readJSONL(filename)
+    return readTSV(filename)
+
+def readTSV(filename):
+    """ Yields the rows of the TSV file filename, as dicts
+
+        The first line names the columns, which must include the
+        REQUIRED_COLUMNS. Blank lines are skipped.
+
+    """
+    try:
+        with io.open(filename, 'r', encoding='utf-8') as f:
+            columns = f.readline().rstrip(u'\r\n').split(u'\t')
+            missing = [column for column in REQUIRED_COLUMNS
+                       if column not in columns]
+            if missing:
+                raise cf.EtymExceptDB('ERROR: {0} has no {1} column'.format(
+                    filename, ', '.join(missing)))
+            for line in f:
+                line = line.rstrip(u'\r\n')
+                if line:
+                    yield dict(zip(columns, line.split(u'\t')))
+    except (IOError, UnicodeDecodeError) as err:
+        raise cf.EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
+            filename, err))
+
+def readJSONL(filename):
+    """ Yields the rows of the JSON Lines file filename, as dicts
+
+        Each line is a JSON object. Blank lines are skipped.
+
+    """
+    try:
+        with open(filename, 'rb') as f:
+            for num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as err:
+                    raise cf.EtymExceptDB("ERROR: Error parsing line {0} of "
+                                          "{1}\n{2}".format(num, filename, err))
+                if not isinstance(row, dict):
+                    raise cf.EtymExceptDB("ERROR: Line {0} of {1} isn't a "
+                                          "JSON object".format(num, filename))
+                yield row
+    except IOError as err:
+        raise cf.EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
+            filename, err))
+
+def _attach(word_db, trees, report, start, progress):
+    """ Adds the finished trees to word_db and reports the progress """
+    if trees:
+        try:
+            cf.addTrees(word_db, trees)
+        except cf.EtymExceptWord as err:
+            raise cf.EtymExceptDB('ERROR: Error importing {0}\n{1}'.format(
+                report.source, err))
+        report.trees += len(trees)
+    report.seconds = time.time() - start
+    if progress is not None:
+        progress(report)
+
+def _makeWord(row, parent_id):
+    """ Returns the new element of the word (or tree root) of row """
+    word = cf.ET.Element('word' if parent_id is not None else 'tree')
+    cf.ET.SubElement(word, 'lang').text = row.get('lang') or None
+    for field in ('text', 'morpheme'):
+        for value in _values(row.get(field)):
+            cf.ET.SubElement(word, field).text = value
+    cf.ET.SubElement(word, 'def').text = row.get('def') or None
+    return word
+
+def _values(value):
+    """ Returns the list of texts (or morphemes) of a column """
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = value.split(TEXT_SEPARATOR)
+    return [text.strip() for text in value if text and text.strip()]
+
+def _finishTree(tree_id, root, waiting, report):
+    """ Returns the root of the finished tree tree_id, checking that all
+        of its words were attached
+
+    """
+    if root is None:
+        _rowError(report, 'tree {0} has no root (a row without a '
+                  'parent)'.format(tree_id))
+    if waiting:
+        _rowError(report, 'tree {0} has no word {1}, the parent of '
+                  'other words'.format(tree_id, sorted(waiting)[0]))
+    return root
+
+def _checkCycle(word_id, parent_id, parents, report):
+    """ Raises EtymExceptDB if word_id would be its own ancestor
+
+        parents maps the ids of the words read so far to the ids of their
+        parents, so the chain of parent_id is followed up to a word whose
+        parent hasn't been read (or the root).
+
+    """
+    ancestor = parent_id
+    while ancestor is not None:
+        if ancestor == word_id:
+            if parent_id == word_id:
+                _rowError(report, 'word {0} is its own parent'.format(
+                    word_id))
+            _rowError(report, 'word {0} is its own ancestor (through '
+                      'word {1})'.format(word_id, parent_id))
+        ancestor = parents.get(ancestor)
+
+def _rowId(row, column, report):
+    """ Returns the id in column of row, as unicode """
+    value = row.get(column)
+    if value is None or value == '':
+        _rowError(report, 'no {0}'.format(column))
+    return unicode(value)
+
+def _rowError(report, message):
+    """ Raises EtymExceptDB about the row last read """
+    raise cf.EtymExceptDB('ERROR: Error importing {0}, row {1}: {2}'.format(
+        report.source, report.rows, message))
+# EOF
@@ -0,0 +1,672 @@
+#!/usr/bin/env python
+""" This module holds the in-memory search index for a word database
+
+    The index is built once when the database is loaded and is then kept
+    current by the editing functions in common_funcs, so that a search is
+    a dict lookup instead of a walk over every word in the database.
+
+    Each value also gets a search key (see searchKey()), worked out once
+    when the value is indexed, so that a normalised search is a lookup
+    of the key of the search word. A value packing several spellings
+    (see variant_funcs) gets the key of each of them.
+
+"""
+
+###
+# Imports
+import gc
+import re
+import unicodedata
+from itertools import chain
+from contextlib import contextmanager
+
+from lxml import etree as ET
+
+import fuzzy_funcs
+import prefix_funcs
+import variant_funcs
+import text_funcs
+
+###
+# Constants
+# The word detail elements that are indexed
+INDEX_FIELDS = ('text', 'morpheme')
+# How common_funcs.searchDB() can match the search word
+SEARCH_MODES = ('exact', 'normal', 'fuzzy', 'regex', 'fulltext')
+# Finds the bytes of a non-ASCII character
+_NON_ASCII = re.compile(br'[\x80-\xff]')
+# Removes the combining marks (the diacritics split off by NFKD)
+_COMBINING = dict.fromkeys(code for code in xrange(0x10000)
+                           if unicodedata.combining(unichr(code)))
+
+###
+# Classes
+class WordIndex(object):
+    """ An inverted index of a word database
+
+        For each field in INDEX_FIELDS, the index maps each value to the
+        list of word elements holding that value. A word appears once for
+        every time it holds the value (a word can list the same text
+        twice), just like a full scan of the database would find it.
+
+        Only 'word' elements are indexed, the tree roots are not. The
+        values of the tree roots are kept apart in roots, and are only
+        found by a normalised search (see normalLookup()).
+
+        The index doesn't keep a copy of each word's values: a word is
+        removed using the values it holds at that time, so a word must be
+        removed from the index before its details are changed.
+
+        An index can sit on top of a read-only base index (such as the
+        postings of a snapshot, see snapshot_funcs). The base answers
+        every value that hasn't been changed since; a changed value is
+        copied out of the base into this index first.
+
+        The trigram index of a field (see fuzzy_funcs) is built from the
+        values of the field the first time a fuzzy search needs it, and
+        is kept current from then on.
+
+        Likewise, the prefix index of a field (see prefix_funcs), which
+        completes the start of a value, is built the first time it is
+        needed and is kept current from then on.
+
+        The full-text index of a free text field (see text_funcs) is
+        built the first time a full-text search needs it, from every word
+        and tree root of the database, and is kept current from then on.
+
+        The search keys are worked out as the values are indexed. With a
+        base index, they are worked out the first time a normalised
+        search needs them instead, so as not to slow down the load.
+
+        The language table maps each lang to the set of words and tree
+        roots in that language (see langLookup()). It is filled in as the
+        words are indexed, or with a base index, from the whole database
+        the first time it is needed.
+
+        The ancestry labels number the words and tree root of a tree in
+        the order a walk over it enters and leaves them (an Euler tour),
+        so that a node is a descendant of another when its interval of
+        numbers sits inside the other's (see isDescendant()). A tree is
+        labelled the first time it is asked about; an edit moving words
+        in or out of it marks it stale, and it is labelled again the next
+        time it is asked about.
+
+    """
+    def __init__(self, root=None, base=None, num_words=0):
+        """ Creates the index, filling it in from the etym element root
+
+            base is the read-only base index and num_words the number of
+            words it holds. base must have a method get(field, value)
+            returning a new list of the words holding value in field, and
+            a method values(field) yielding the values of field.
+
+        """
+        self.fields = dict((field, {}) for field in INDEX_FIELDS)
+        # field -> value -> [tree, ...], for the values of the tree roots
+        self.roots = dict((field, {}) for field in INDEX_FIELDS)
+        self._base = base
+        # tree -> its position in the database
+        self._tree_order = {}
+        self._next_tree = 0
+        self._num_words = num_words
+        # field -> fuzzy_funcs.TrigramIndex, once built
+        self._trigrams = {}
+        # field -> prefix_funcs.PrefixIndex, once built
+        self._prefixes = {}
+        # field -> text_funcs.TextIndex, once built
+        self._texts = {}
+        # field -> search key -> set of values, once built
+        self._keys = {}
+        # lang -> set of words and tree roots, once built
+        self._langs = None
+        # node -> (tree, enter number, leave number), for labelled trees
+        self._labels = {}
+        # labelled tree -> its labelled nodes
+        self._labelled = {}
+        # The labelled trees changed since they were labelled
+        self._stale = set()
+        # labelled tree -> lca_funcs.TreeLCA, once built
+        self._lcas = {}
+        if base is None:
+            self._keys = dict((field, {}) for field in INDEX_FIELDS)
+            self._langs = {}
+        if root is not None:
+            with pausedGC():
+                for tree in root.iterchildren(tag='tree'):
+                    self.addSubtree(tree, tree)
+
+    def __len__(self):
+        """ The number of indexed words """
+        return self._num_words
+
+    def addTree(self, tree, position=None):
+        """ Records tree as the last tree of the database, with its root
+
+            position is the position to give tree instead, to put back a
+            tree that was removed (see position()).
+
+        """
+        if tree not in self._tree_order:
+            if position is None:
+                position = self._next_tree
+                self._next_tree += 1
+            self._tree_order[tree] = position
+            self.addRoot(tree)
+
+    def position(self, tree):
+        """ Returns the position of tree in the database, or None if tree
+            isn't indexed
+
+        """
+        return self._tree_order.get(tree)
+
+    def addRoot(self, tree):
+        """ Adds the values of the tree root to the index """
+        self._addText(tree)
+        for child in tree.iterchildren('lang', *INDEX_FIELDS):
+            if child.tag == 'lang':
+                self._addLang(tree, child.text)
+                continue
+            trees = self.roots[child.tag].setdefault(child.text, [])
+            if not trees:
+                self._addKey(child.tag, child.text)
+            trees.append(tree)
+
+    def removeRoot(self, tree):
+        """ Removes the values of the tree root from the index """
+        self._removeText(tree)
+        for child in tree.iterchildren('lang', *INDEX_FIELDS):
+            if child.tag == 'lang':
+                self._removeLang(tree, child.text)
+                continue
+            trees = self.roots[child.tag].get(child.text, [])
+            if tree in trees:
+                trees.remove(tree)
+                if not trees:
+                    del self.roots[child.tag][child.text]
+                    if not self._words(child.tag, child.text):
+                        self._dropKey(child.tag, child.text)
+
+    def addSubtree(self, tree, node):
+        """ Indexes node and all of its descendant words
+
+            tree is the tree root that node belongs to (node can be the
+            tree root itself).
+
+        """
+        self.addTree(tree)
+        if tree in self._labelled:
+            self._stale.add(tree)
+        if node.tag == 'word':
+            self.addWord(node)
+        for word in node.iterdescendants(tag='word'):
+            self.addWord(word)
+
+    def removeSubtree(self, node):
+        """ Removes node and all of its descendant words from the index """
+        label = self._labels.get(node)
+        if label is not None:
+            self._stale.add(label[0])
+        if node.tag == 'word':
+            self.removeWord(node)
+        elif node.tag == 'tree' and node in self._tree_order:
+            del self._tree_order[node]
+            self.removeRoot(node)
+        for word in node.iterdescendants(tag='word'):
+            self.removeWord(word)
+
+    def addWord(self, word):
+        """ Adds a single word to the index """
+        self._addText(word)
+        for child in word.iterchildren('lang', *INDEX_FIELDS):
+            if child.tag == 'lang':
+                self._addLang(word, child.text)
+                continue
+            words = self._words(child.tag, child.text, True)
+            if not words:
+                if child.tag in self._trigrams:
+                    self._trigrams[child.tag].add(child.text)
+                if child.tag in self._prefixes:
+                    self._prefixes[child.tag].add(child.text)
+                self._addKey(child.tag, child.text)
+            words.append(word)
+        self._num_words += 1
+
+    def removeWord(self, word):
+        """ Removes a single word from the index """
+        self._removeText(word)
+        removed = False
+        for child in word.iterchildren('lang', *INDEX_FIELDS):
+            if child.tag == 'lang':
+                self._removeLang(word, child.text)
+                continue
+            words = self._words(child.tag, child.text, True)
+            if word in words:
+                words.remove(word)
+                removed = True
+                if not words:
+                    if child.tag in self._trigrams:
+                        self._trigrams[child.tag].remove(child.text)
+                    if child.tag in self._prefixes:
+                        self._prefixes[child.tag].remove(child.text)
+                    if child.text not in self.roots[child.tag]:
+                        self._dropKey(child.tag, child.text)
+                    if self._base is None:
+                        del self.fields[child.tag][child.text]
+        if removed:
+            self._num_words -= 1
+
+    def lookup(self, field, value):
+        """ Returns the matches of value in field
+
+            The output is a list of (tree, word) tuples in document order.
+
+        """
+        return self._sortMatches(self._words(field, value))
+
+    def normalLookup(self, field, value):
+        """ Returns the matches of the values with the search key of value
+
+            The output is a list of (tree, word) tuples in document order,
+            each word listed once. A matching tree root is listed as
+            (tree, tree).
+
+        """
+        key = searchKey(value)
+        words = []
+        for key_value in chain([key], self._keyValues(field).get(key, ())):
+            words.extend(self._words(field, key_value))
+            words.extend(self.roots[field].get(key_value, ()))
+        return uniqueMatches([self._sortMatches(words)])
+
+    def values(self, field):
+        """ Yields each value held by some word in field """
+        values = self.fields[field]
+        for value, words in values.iteritems():
+            if words:
+                yield value
+        if self._base is not None:
+            for value in self._base.values(field):
+                if value not in values:
+                    yield value
+
+    def fuzzyValues(self, field, value, limit=fuzzy_funcs.MAX_VALUES):
+        """ Returns the values of field nearly matching value, best first
+
+            See fuzzy_funcs.TrigramIndex.search().
+
+        """
+        if field not in self._trigrams:
+            with pausedGC():
+                self._trigrams[field] = fuzzy_funcs.TrigramIndex(
+                    self.values(field))
+        return self._trigrams[field].search(value, limit)
+
+    def fuzzyLookup(self, field, value, limit=fuzzy_funcs.MAX_VALUES):
+        """ Returns the matches of the values nearly matching value
+
+            The output is a list of (tree, word) tuples: the matches of the
+            best value first (in document order), then those of the next
+            one, and so on. Each word is listed once.
+
+        """
+        return uniqueMatches(self.lookup(field, fuzzy_value) for
+                             fuzzy_value in self.fuzzyValues(field, value,
+                                                             limit))
+
+    def complete(self, field, prefix, limit=prefix_funcs.MAX_VALUES):
+        """ Returns the values of field starting with prefix
+
+            The values are matched by their search key, so prefix can
+            leave out the diacritics and the '*' of PIE roots. See
+            prefix_funcs.PrefixIndex.complete().
+
+        """
+        if field not in self._prefixes:
+            with pausedGC():
+                self._prefixes[field] = prefix_funcs.PrefixIndex(
+                    self.values(field), searchKey)
+        return self._prefixes[field].complete(prefix, limit)
+
+    def textLookup(self, root, field, query, limit):
+        """ Returns the words whose field best matches the free text query
+
+            root is the etym element of the database. The output is a list
+            of at most limit (tree, word) tuples, best match first (see
+            text_funcs.TextIndex.search()). A matching tree root is listed
+            as (tree, tree).
+
+        """
+        if field not in self._texts:
+            texts = text_funcs.TextIndex()
+            with pausedGC():
+                for node in root.iter('tree', 'word'):
+                    if node.tag == 'word' or node in self._tree_order:
+                        texts.add(node, node.findtext(field))
+            self._texts[field] = texts
+        matches = []
+        for score, node in self._texts[field].search(query, limit):
+            tree, order = self._docOrder(node)
+            matches.append((-score, order, tree, node))
+        matches.sort(key=lambda match: match[:2])
+        return [(tree, node) for score, order, tree, node in matches]
+
+    def langLookup(self, root, lang):
+        """ Returns the words and tree roots whose lang is lang
+
+            root is the etym element of the database. The output is a list
+            of (tree, node) tuples in document order, where node is either
+            a word or the tree root (as (tree, tree)).
+
+        """
+        nodes = self._langNodes(root).get(lang, ())
+        with pausedGC():
+            return self._sortMatches(nodes)
+
+    def langCounts(self, root):
+        """ Returns the dict: lang -> number of words and tree roots """
+        return dict((lang, len(nodes)) for lang, nodes in
+                    self._langNodes(root).iteritems())
+
+    def _langNodes(self, root):
+        """ Returns the language table, building it from root if needed """
+        if self._langs is None:
+            self._langs = {}
+            with pausedGC():
+                for node in root.iter('tree', 'word'):
+                    if node.tag == 'word' or node in self._tree_order:
+                        self._addLang(node, node.findtext('lang'))
+        return self._langs
+
+    def _addLang(self, node, lang):
+        """ Adds node, whose lang is lang, to the language table, once it's
+            built
+
+        """
+        if self._langs is not None:
+            nodes = self._langs.get(lang)
+            if nodes is None:
+                nodes = self._langs[lang] = set()
+            nodes.add(node)
+
+    def _removeLang(self, node, lang):
+        """ Removes node, whose lang is lang, from the language table """
+        if self._langs is not None:
+            nodes = self._langs.get(lang)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    del self._langs[lang]
+
+    def label(self, node):
+        """ Returns the ancestry label of the word or tree root node
+
+            The label is (tree, enter number, leave number), where tree is
+            the tree root of node. Returns None if node isn't in a tree of
+            this index.
+
+        """
+        label = self._labels.get(node)
+        if label is None or label[0] in self._stale:
+            if label is not None:
+                self._labelTree(label[0])
+                label = self._labels.get(node)
+            if label is None or label[0] in self._stale:
+                # Not labelled yet, or moved into a changed tree
+                tree = node if node.tag == 'tree' else next(
+                    node.iterancestors('tree'), None)
+                if tree is None:
+                    return None
+                self._labelTree(tree)
+                label = self._labels.get(node)
+        return label
+
+    def isDescendant(self, source, node):
+        """ Whether node is source or one of its descendants
+
+            Returns None if either isn't in a tree of this index.
+
+        """
+        source_label = self.label(source)
+        label = self.label(node)
+        if source_label is None or label is None:
+            return None
+        return (label[0] is source_label[0] and
+                source_label[1] <= label[1] and label[2] <= source_label[2])
+
+    def treeLCA(self, node):
+        """ Returns the lca_funcs.TreeLCA of the tree of node
+
+            It is built the first time it is needed, and again after the
+            tree is changed. Returns None if node isn't in a tree of this
+            index.
+
+        """
+        label = self.label(node)
+        if label is None:
+            return None
+        tree = label[0]
+        if tree not in self._lcas:
+            import lca_funcs
+            self._lcas[tree] = lca_funcs.TreeLCA(tree)
+        return self._lcas[tree]
+
+    def _labelTree(self, tree):
+        """ (Re)labels the nodes of tree, see label() """
+        self._lcas.pop(tree, None)
+        for node in self._labelled.pop(tree, ()):
+            label = self._labels.get(node)
+            if label is not None and label[0] is tree:
+                del self._labels[node]
+        self._stale.discard(tree)
+        if tree not in self._tree_order:
+            return
+        nodes = self._labelled[tree] = []
+        enters = []
+        for num, (event, node) in enumerate(ET.iterwalk(tree,
+                events=('start', 'end'), tag=('tree', 'word'))):
+            if event == 'start':
+                enters.append(num)
+            else:
+                self._labels[node] = (tree, enters.pop(), num)
+                nodes.append(node)
+
+    def _addText(self, node):
+        """ Adds node to the full-text indexes that are built """
+        for field, texts in self._texts.iteritems():
+            texts.add(node, node.findtext(field))
+
+    def _removeText(self, node):
+        """ Removes node from the full-text indexes that are built """
+        for field, texts in self._texts.iteritems():
+            texts.remove(node, node.findtext(field))
+
+    def _keyValues(self, field):
+        """ Returns the dict: search key -> set of values of field
+
+            A value is kept under each of its search keys (see
+            searchKeys()), except the value itself: a value that is its
+            own search key (as most are) is found by looking up the key.
+
+        """
+        if field not in self._keys:
+            self._keys[field] = {}
+            with pausedGC():
+                for value in chain(self.values(field), self.roots[field]):
+                    self._addKey(field, value)
+        return self._keys[field]
+
+    def _addKey(self, field, value):
+        """ Files value of field under its search keys, once they're built """
+        if field in self._keys:
+            keys = self._keys[field]
+            for key in searchKeys(value):
+                if key != value:
+                    keys.setdefault(key, set()).add(value)
+
+    def _dropKey(self, field, value):
+        """ Drops value of field from under its search keys """
+        if field in self._keys:
+            keys = self._keys[field]
+            for key in searchKeys(value):
+                values = keys.get(key)
+                if values is not None:
+                    values.discard(value)
+                    if not values:
+                        del keys[key]
+
+    def _sortMatches(self, words):
+        """ Returns the list of (tree, word) of words, in document order """
+        matches = []
+        for word in words:
+            tree, order = self._docOrder(word)
+            matches.append((order, tree, word))
+        matches.sort(key=lambda match: match[0])
+        return [(tree, word) for order, tree, word in matches]
+
+    def _words(self, field, value, create=False):
+        """ Returns the list of words holding value in field
+
+            If create is True, the list is kept in this index (copying it
+            out of the base index if needed) so that it can be changed.
+
+        """
+        values = self.fields[field]
+        if value in values:
+            return values[value]
+        if self._base is not None:
+            words = self._base.get(field, value)
+        else:
+            words = []
+        if create:
+            values[value] = words
+        return words
+
+    def _docOrder(self, word):
+        """ Returns (tree, sort key placing word in document order) """
+        path = []
+        node = word
+        parent = node.getparent()
+        while node.tag != 'tree':
+            path.append(parent.index(node))
+            node = parent
+            parent = node.getparent()
+        path.reverse()
+        return (node, (self._tree_order[node], path))
+
+###
+# Functions
+@contextmanager
+def pausedGC():
+    """ Turns off the cyclic garbage collector for the enclosed block
+
+        Building an index allocates many small containers that are never
+        garbage, and the collector would otherwise keep rescanning them.
+
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def searchKey(value):
+    """ Returns the search key of the text or morpheme value
+
+        The key is the value in NFKD form with the diacritics stripped,
+        in lower case, without a leading '*' or a trailing '-' (as PIE
+        roots are written). So '*Ker-' and 'ker' have the same key, and
+        so do a word written with and without its accents.
+
+    """
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        if value.isalnum() and value.islower():
+            # Already a plain lower case ASCII word
+            return value
+        if not _NON_ASCII.search(value):
+            # No diacritics on a plain ASCII value
+            return value.lower().lstrip('*').rstrip('-')
+        value = value.decode('utf-8', 'replace')
+    value = unicodedata.normalize('NFKD', value).translate(_COMBINING)
+    return value.lower().lstrip(u'*').rstrip(u'-')
+
+def searchKeys(value):
+    """ Returns the list of search keys of value and its variant spellings
+
+        See searchKey() and variant_funcs.expand().
+
+    """
+    if not variant_funcs.hasVariants(value):
+        return [searchKey(value)]
+    keys = []
+    for spelling in variant_funcs.expand(value):
+        key = searchKey(spelling)
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+def uniqueMatches(match_lists):
+    """ Joins the lists of (tree, word) matches, keeping each word once """
+    matches = []
+    seen = set()
+    for match_list in match_lists:
+        for tree, word in match_list:
+            if word not in seen:
+                seen.add(word)
+                matches.append((tree, word))
+    return matches
+
+def attachIndex(root, index=None):
+    """ Builds the index of the etym element root and keeps it there
+
+        If index is given, it is kept instead of building a new one.
+        Returns the index. If root can't hold an index (it wasn't created
+        by common_funcs.loadDB) then the index is returned but not kept.
+
+    """
+    if index is None:
+        index = WordIndex(root)
+    try:
+        root._word_index = index
+    except AttributeError:
+        pass
+    return index
+
+def getIndex(root):
+    """ Returns the index of the etym element root, building it if needed """
+    index = getattr(root, '_word_index', None)
+    if index is None:
+        index = attachIndex(root)
+    return index
+
+def rootIndex(node):
+    """ Returns the index of the database holding node, or None
+
+        Unlike findIndex(), this doesn't walk up from node: the etym
+        element is the root of the document of node.
+
+    """
+    return getattr(node.getroottree().getroot(), '_word_index', None)
+
+def findIndex(node):
+    """ Finds the index and tree root that node is a part of
+
+        Returns (index, tree). If node isn't attached to an indexed
+        database, then index is None.
+
+    """
+    tree = node if node.tag == 'tree' else None
+    top = node
+    for ancestor in node.iterancestors():
+        if ancestor.tag == 'tree':
+            tree = ancestor
+        top = ancestor
+    index = getattr(top, '_word_index', None)
+    if tree is None:
+        index = None
+    return (index, tree)
+# EOF
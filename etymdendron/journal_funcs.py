@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+""" This module keeps an append-only journal of the edits to a database
+
+    Once a journal is opened for a database (common_funcs.loadDB(filename,
+    journal=True)), every edit made through common_funcs is appended to
+    the journal file (words.xml.journal) as soon as it is done, and synced
+    to disk. Loading the database again replays the journal over the XML
+    file, so no edit is lost if the program dies before the next save.
+
+    Saving the database back into its own file folds the journal into the
+    XML (a compaction) and starts an empty journal.
+
+    The journal is a text file with one JSON record per line. The first
+    line records the size, modification time and SHA-1 of the XML file the
+    journal applies to. Each further line is an edit:
+        {"op": function name, "args": [...], "kwargs": {...}}
+    The words in the arguments are recorded by their position in the
+    database at the time of the edit, and new words (not yet in the
+    database) as XML.
+
+"""
+
+###
+# Imports
+import os
+import json
+import binascii
+
+import common_funcs as cf
+import snapshot_funcs
+
+###
+# Constants
+# Suffix of the journal file, added to the database filename
+JOURNAL_SUFFIX = '.journal'
+# A journal that doesn't apply to the XML file is moved aside to this
+STALE_SUFFIX = '.stale'
+# Bumped whenever the record layout changes
+JOURNAL_VERSION = 1
+
+###
+# Classes
+class Journal(object):
+    """ The journal of the database loaded from filename """
+    def __init__(self, words_db, filename):
+        """ Opens the journal of words_db, without replaying it """
+        self.words_db = words_db
+        self.filename = filename
+        self.journal_file = filename + JOURNAL_SUFFIX
+        # How many journaled edits are running; the edits they make
+        # through other journaled functions aren't recorded themselves
+        self.depth = 0
+        # How many edits are in the journal file
+        self.num_edits = 0
+
+    def __len__(self):
+        """ The number of edits in the journal """
+        return self.num_edits
+
+    def encode(self, value):
+        """ Returns value in a form that can be written to the journal """
+        if isinstance(value, cf.ET._ElementTree):
+            return {'db': True}
+        elif isinstance(value, cf.ET._Element):
+            path = self.path(value)
+            if path is None:
+                return {'xml': cf.ET.tostring(value, encoding=unicode)}
+            return {'path': path}
+        elif isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        elif isinstance(value, dict):
+            return {'dict': dict((key, self.encode(item)) for key, item in
+                                 value.iteritems())}
+        return value
+
+    def decode(self, value):
+        """ Returns the value that encode() gave value for """
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        elif isinstance(value, dict):
+            if 'db' in value:
+                return self.words_db
+            elif 'path' in value:
+                return self.find(value['path'])
+            elif 'xml' in value:
+                return cf.ET.fromstring(value['xml'], cf.makeParser())
+            return dict((key, self.decode(item)) for key, item in
+                        value['dict'].iteritems())
+        return value
+
+    def path(self, node):
+        """ Returns the position of node in the database, or None
+
+            The position is a list: the number of the tree (not counting
+            the trees emptied by common_funcs.deleteTree(), which aren't
+            saved) followed by the index of each element below it.
+
+        """
+        path = []
+        while node.tag != 'tree':
+            parent = node.getparent()
+            if parent is None:
+                return None
+            path.append(parent.index(node))
+            node = parent
+        if node.getparent() is not self.words_db.getroot():
+            return None
+        path.append(sum(1 for tree in node.itersiblings(preceding=True)
+                        if len(tree)))
+        path.reverse()
+        return path
+
+    def find(self, path):
+        """ Returns the node at the position path (see path()) """
+        trees = (tree for tree in self.words_db.getroot().iterchildren(
+                 tag='tree') if len(tree))
+        try:
+            for num, node in enumerate(trees):
+                if num == path[0]:
+                    break
+            else:
+                raise IndexError(path[0])
+            for index in path[1:]:
+                node = node[index]
+        except IndexError:
+            raise cf.EtymExceptDB('ERROR: No word at {0} in {1}'.format(
+                path, self.filename))
+        return node
+
+    def record(self, op, args, kwargs):
+        """ Returns the journal record of a call to the function op """
+        return {'op': op, 'args': self.encode(list(args)),
+                'kwargs': dict((key, self.encode(item)) for key, item in
+                               kwargs.iteritems())}
+
+    def append(self, record):
+        """ Appends record to the journal file and syncs it """
+        self.extend([record])
+
+    def extend(self, records):
+        """ Appends the list records to the journal file, syncing it once """
+        new_file = self.num_edits == 0 or not os.path.exists(
+            self.journal_file)
+        with open(self.journal_file, 'w' if new_file else 'a') as f:
+            if new_file:
+                f.write(json.dumps(baseStamp(self.filename)) + '\n')
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_edits += len(records)
+
+    def replay(self):
+        """ Replays the journal file over the database
+
+            Returns the number of edits replayed. A journal written for
+            another version of the XML file (for example one that was
+            already folded in by a save that died before clearing it) is
+            moved aside instead.
+
+        """
+        try:
+            with open(self.journal_file, 'r') as f:
+                lines = f.read().splitlines()
+        except IOError:
+            return 0
+        try:
+            header = json.loads(lines[0]) if lines else None
+        except ValueError:
+            header = None
+        if header is None or not matchesBase(header, self.filename):
+            os.rename(self.journal_file, self.journal_file + STALE_SUFFIX)
+            return 0
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last record may be cut short by a crash
+                break
+            func = getattr(cf, record['op'])
+            args = self.decode(record['args'])
+            kwargs = dict((str(key), self.decode(item)) for key, item in
+                          record['kwargs'].iteritems())
+            func(*args, **kwargs)
+            self.num_edits += 1
+        return self.num_edits
+
+    def clear(self):
+        """ Empties the journal, once it has been folded into the XML """
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.num_edits = 0
+
+###
+# Functions
+def baseStamp(filename):
+    """ Returns the header recording the state of the XML file filename """
+    stat = os.stat(filename)
+    return {'version': JOURNAL_VERSION, 'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': binascii.hexlify(snapshot_funcs.fileHash(filename))}
+
+def matchesBase(header, filename):
+    """ Whether the journal header applies to the XML file filename """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    if (header.get('version') != JOURNAL_VERSION or
+            header.get('size') != stat.st_size):
+        return False
+    if header.get('mtime') == stat.st_mtime:
+        return True
+    return header.get('sha1') == binascii.hexlify(
+        snapshot_funcs.fileHash(filename))
+
+def openJournal(words_db, filename):
+    """ Replays the journal of filename over words_db and keeps it there
+
+        From then on, the edits to words_db are appended to the journal.
+        Returns the Journal.
+
+    """
+    journal = Journal(words_db, filename)
+    journal.replay()
+    words_db.getroot()._journal = journal
+    return journal
+
+def getJournal(words_db):
+    """ Returns the Journal of words_db, or None """
+    if not isinstance(words_db, cf.ET._ElementTree):
+        return None
+    return getattr(words_db.getroot(), '_journal', None)
+
+def findJournal(values):
+    """ Finds the Journal of the database that one of values is a part of
+
+        values are the arguments of an edit: elements, databases or lists
+        of them. Returns None if none of them are in a journaled database.
+
+    """
+    for value in values:
+        if isinstance(value, list):
+            journal = findJournal(value)
+        elif isinstance(value, cf.ET._ElementTree):
+            journal = getJournal(value)
+        elif isinstance(value, cf.ET._Element):
+            top = value
+            for top in value.iterancestors():
+                pass
+            journal = getattr(top, '_journal', None)
+        else:
+            journal = None
+        if journal is not None:
+            return journal
+    return None
+# EOF
@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+""" This module loads the trees of a word database only when needed
+
+    A sidecar file (words.xml.idx) records the byte range of every tree
+    in the XML file and, for each field, the postings of its values: the
+    trees holding each value, and the trees holding each search key (see
+    index_funcs.searchKeys()). The values and the keys are packed into
+    sorted string tables (see compact_funcs.StringTable), so opening the
+    database only reads the flat arrays of the sidecar, and a search finds
+    the word by a binary search before parsing just the trees holding it.
+    Only regex, fuzzy searches and completions read out every value.
+    Parsed trees are kept in a bounded LRU cache.
+
+    The trees given out are read-only: edits to them are not saved.
+
+"""
+
+###
+# Imports
+import os
+import re
+import struct
+from array import array
+from itertools import chain
+from collections import OrderedDict
+
+import common_funcs as cf
+import index_funcs
+import fuzzy_funcs
+import prefix_funcs
+import regex_funcs
+import compact_funcs
+
+###
+# Constants
+# Suffix of the sidecar file, added to the database filename
+SIDECAR_SUFFIX = '.idx'
+# Bumped whenever the sidecar layout changes
+SIDECAR_VERSION = 3
+SIDECAR_MAGIC = b'ETYMIDX\0'
+# How many parsed trees are kept by default
+CACHE_SIZE = 64
+
+# Matches comments (so they can be skipped) and tree start/end tags
+_TREE_TAGS = re.compile(br'<!--.*?-->|<tree[\s/>]|</tree\s*>', re.S)
+
+# magic, version, XML size, XML mtime
+_HEADER = struct.Struct('<8sIQd')
+# typecode, number of items
+_ARRAY_HEADER = struct.Struct('<cQ')
+
+###
+# Classes
+class LazyDB(object):
+    """ A word database whose trees are parsed on demand
+
+        This is returned by common_funcs.loadDB(filename, lazy=True) and
+        is understood by common_funcs.searchDB() and countTrees().
+
+    """
+    # Its search results aren't cached (see cache_funcs.getCache()): they
+    # would keep their trees parsed beyond cache_size, and a tree parsed
+    # again is made of new elements
+    cache_results = False
+
+    def __init__(self, filename, cache_size=CACHE_SIZE):
+        """ Opens the database filename, (re)building its sidecar """
+        self.filename = filename
+        self.cache_size = cache_size
+        self.sidecar = loadSidecar(filename)
+        # tree number -> (tree, WordIndex), least recently used first
+        self._cache = OrderedDict()
+        # field -> fuzzy_funcs.TrigramIndex, once built
+        self._trigrams = {}
+        # field -> prefix_funcs.PrefixIndex, once built
+        self._prefixes = {}
+
+    def __len__(self):
+        """ The number of trees in the database """
+        return len(self.sidecar)
+
+    def loadTree(self, num):
+        """ Returns the tree element number num (counting from 0) """
+        return self._loadTree(num)[0]
+
+    def searchDB(self, search_word, field='text', mode='exact'):
+        """ Searches the database, parsing only the trees that match
+
+            The output is the same as common_funcs.searchDB(). A regular
+            expression on the text or morpheme is matched against the
+            values in the sidecar first, so only the trees holding a match
+            are parsed; one on the def parses every tree.
+
+        """
+        if mode == 'fulltext':
+            raise cf.EtymExceptDB('A full-text search needs the whole '
+                                  'database loaded, not a lazy one')
+        if mode == 'regex':
+            regex = regex_funcs.compilePattern(search_word)
+            if field == 'def':
+                nums = xrange(len(self))
+            else:
+                nums = sorted(self.sidecar.fields[field].regexTrees(regex))
+            matched_words = []
+            for num in nums:
+                tree = self._loadTree(num)[0]
+                nodes = list(tree.iter('tree', 'word'))
+                matched_words.extend((tree, nodes[node_num]) for node_num in
+                                     regex_funcs.matchTree(tree, regex, field))
+            num_trees = len(set(tree for tree, word in matched_words))
+            return (num_trees, matched_words)
+
+        if mode == 'normal':
+            nums = self.sidecar.fields[field].keyTrees(
+                index_funcs.searchKey(search_word))
+            matched_words = []
+            for num in nums:
+                tree, index = self._loadTree(num)
+                matched_words.extend(index.normalLookup(field, search_word))
+            num_trees = len(set(tree for tree, word in matched_words))
+            return (num_trees, matched_words)
+
+        if mode == 'fuzzy':
+            if field not in self._trigrams:
+                self._trigrams[field] = fuzzy_funcs.TrigramIndex(
+                    self.sidecar.fields[field].values())
+            values = self._trigrams[field].search(search_word)
+        else:
+            values = [search_word]
+        match_lists = []
+        for value in values:
+            matches = []
+            for num in self.sidecar.fields[field].trees(value):
+                tree, index = self._loadTree(num)
+                matches.extend(index.lookup(field, value))
+            match_lists.append(matches)
+        if mode == 'fuzzy':
+            matched_words = index_funcs.uniqueMatches(match_lists)
+        else:
+            matched_words = match_lists[0]
+        num_trees = len(set(tree for tree, word in matched_words))
+
+        return (num_trees, matched_words)
+
+    def searchDB_many(self, search_words, field='text', mode='exact'):
+        """ Searches the database for each of search_words
+
+            The output is the same as common_funcs.searchDB_many(). For
+            exact matches, the trees holding any of the words are parsed
+            once each, in turn, rather than once for every word.
+
+        """
+        if mode != 'exact':
+            return dict((search_word, self.searchDB(search_word, field, mode))
+                        for search_word in set(search_words))
+
+        # tree number -> the words it holds
+        tree_words = {}
+        matches = {}
+        for search_word in search_words:
+            matches[search_word] = []
+            for num in self.sidecar.fields[field].trees(search_word):
+                tree_words.setdefault(num, set()).add(search_word)
+        for num in sorted(tree_words):
+            tree, index = self._loadTree(num)
+            for search_word in tree_words[num]:
+                matches[search_word].extend(index.lookup(field, search_word))
+
+        return dict((search_word, (len(set(tree for tree, word in
+                                           matched_words)), matched_words))
+                    for search_word, matched_words in matches.iteritems())
+
+    def completeDB(self, prefix, field='text', limit=10):
+        """ Completes prefix, see common_funcs.completeDB() """
+        if field not in self._prefixes:
+            self._prefixes[field] = prefix_funcs.PrefixIndex(
+                self.sidecar.fields[field].values(), index_funcs.searchKey)
+        return self._prefixes[field].complete(prefix, limit)
+
+    def iterLanguage(self, lang, under=None):
+        """ Yields the (tree, word) in lang, see common_funcs.iterLanguage()
+
+            The sidecar doesn't know the languages, so every tree is
+            parsed in turn (only the last few are kept).
+
+        """
+        under = None if under is None else set(under)
+        for num in xrange(len(self)):
+            loaded, index = self._loadTree(num)
+            for tree, word in index.langLookup(loaded, lang):
+                if under is None or tree in under or word in under or any(
+                        ancestor in under for ancestor in
+                        word.iterancestors('word')):
+                    yield (tree, word)
+
+    def countLanguages(self):
+        """ Returns lang -> number of words, see common_funcs.countLanguages()
+        """
+        counts = {}
+        for num in xrange(len(self)):
+            loaded, index = self._loadTree(num)
+            for lang, count in index.langCounts(loaded).iteritems():
+                counts[lang] = counts.get(lang, 0) + count
+        return counts
+
+    def _loadTree(self, num):
+        """ Returns (tree, WordIndex) for tree number num, using the cache """
+        if num in self._cache:
+            item = self._cache.pop(num)
+        else:
+            start = self.sidecar.starts[num]
+            with open(self.filename, 'rb') as f:
+                f.seek(start)
+                data = f.read(self.sidecar.ends[num] - start)
+            try:
+                tree = cf.ET.fromstring(data,
+                        cf.makeParser(remove_blank_text=True))
+            except cf.ET.XMLSyntaxError as err:
+                raise cf.EtymExceptDB("ERROR: Error parsing tree {0} of "
+                        "{1}\n{2}".format(num, self.filename, err))
+            index = index_funcs.WordIndex()
+            index.addSubtree(tree, tree)
+            item = (tree, index)
+        self._cache[num] = item
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return item
+
+class Sidecar(object):
+    """ The contents of a sidecar: where the trees are, and what they hold
+    """
+    def __init__(self, starts, ends, fields):
+        """ starts and ends are arrays of the byte range of each tree,
+            fields a dict: field -> its FieldPostings
+
+        """
+        self.starts = starts
+        self.ends = ends
+        self.fields = fields
+
+    def __len__(self):
+        """ The number of trees """
+        return len(self.starts)
+
+    def write(self, f):
+        """ Writes the sidecar (after its header) into the file object f """
+        _writeArray(f, self.starts)
+        _writeArray(f, self.ends)
+        for field in index_funcs.INDEX_FIELDS:
+            self.fields[field].write(f)
+
+class FieldPostings(object):
+    """ The values of one field in the trees, and which trees hold them
+
+        The postings are kept in flat arrays: the tree numbers of value
+        number num (see compact_funcs.StringTable) are
+        word_trees[word_offsets[num]:word_offsets[num+1]], and likewise
+        for the search keys. The values of the root of tree number num
+        are root_values[root_offsets[num]:root_offsets[num+1]].
+
+    """
+    def __init__(self, values, word_offsets, word_trees, root_offsets,
+                 root_values, keys, key_offsets, key_trees):
+        """ Sets up the postings from their arrays """
+        self._values = values
+        self._word_offsets = word_offsets
+        self._word_trees = word_trees
+        self._root_offsets = root_offsets
+        self._root_values = root_values
+        self._keys = keys
+        self._key_offsets = key_offsets
+        self._key_trees = key_trees
+
+    def trees(self, value):
+        """ Returns the list of the numbers of the trees whose words hold
+            value
+
+        """
+        num = self._values.find(value) if value is not None else None
+        if not num:
+            return []
+        return self._word_trees[self._word_offsets[num]:
+                                self._word_offsets[num + 1]].tolist()
+
+    def keyTrees(self, key):
+        """ Returns the sorted list of the numbers of the trees holding a
+            value (in a word or the tree root) with the search key key
+
+        """
+        num = self._keys.find(key) if key is not None else None
+        if not num:
+            return []
+        return self._key_trees[self._key_offsets[num]:
+                               self._key_offsets[num + 1]].tolist()
+
+    def values(self):
+        """ Returns the list of the values held by some word """
+        offsets = self._word_offsets
+        return [self._values[num] for num in xrange(1, len(self._values))
+                if offsets[num] != offsets[num + 1]]
+
+    def regexTrees(self, regex):
+        """ Returns the set of the numbers of the trees holding a value
+            (in a word or the tree root) matched by the compiled regex
+
+        """
+        matched = array('b', [0]) * len(self._values)
+        for num in xrange(1, len(self._values)):
+            if regex.search(self._values[num]):
+                matched[num] = 1
+        offsets = self._word_offsets
+        nums = set()
+        for num in xrange(1, len(self._values)):
+            if matched[num]:
+                nums.update(self._word_trees[offsets[num]:offsets[num + 1]])
+        offsets = self._root_offsets
+        for tree_num in xrange(len(offsets) - 1):
+            if any(matched[num] for num in
+                   self._root_values[offsets[tree_num]:
+                                     offsets[tree_num + 1]]):
+                nums.add(tree_num)
+        return nums
+
+    def write(self, f):
+        """ Writes the postings into the file object f, see readPostings()
+        """
+        self._values.write(f)
+        for items in [self._word_offsets, self._word_trees,
+                      self._root_offsets, self._root_values]:
+            _writeArray(f, items)
+        self._keys.write(f)
+        for items in [self._key_offsets, self._key_trees]:
+            _writeArray(f, items)
+
+###
+# Functions
+def findTreeRanges(data):
+    """ Finds the byte range of each tree element in the XML data
+
+        Returns a list of (start, end) tuples, end is one past the last
+        byte of the tree element.
+
+    """
+    ranges = []
+    start = None
+    for match in _TREE_TAGS.finditer(data):
+        tag = match.group()
+        if tag.startswith(b'<!--'):
+            continue
+        elif tag.startswith(b'</'):
+            ranges.append((start, match.end()))
+            start = None
+        else:
+            tag_end = data.index(b'>', match.start())
+            if data[tag_end-1:tag_end] == b'/':
+                # An empty <tree/>
+                ranges.append((match.start(), tag_end+1))
+            else:
+                start = match.start()
+    return ranges
+
+def buildSidecar(filename):
+    """ Builds the Sidecar of the database filename
+
+        The whole file is validated once here.
+
+    """
+    try:
+        with open(filename, 'rb') as f:
+            ranges = findTreeRanges(f.read())
+    except IOError as err:
+        raise cf.EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
+            filename, err))
+
+    # field -> value -> [tree number, ...], and field -> [[root value,
+    # ...] of each tree]
+    words = dict((field, {}) for field in index_funcs.INDEX_FIELDS)
+    roots = dict((field, []) for field in index_funcs.INDEX_FIELDS)
+    num_trees = 0
+    with index_funcs.pausedGC():
+        for num, tree in enumerate(cf.iterDB(filename, drop=True)):
+            for field in index_funcs.INDEX_FIELDS:
+                field_words = words[field]
+                for value in set(child.text for word in
+                                 tree.iterdescendants(tag='word')
+                                 for child in word.iterchildren(tag=field)):
+                    if value is not None:
+                        field_words.setdefault(value, []).append(num)
+                roots[field].append([child.text for child in
+                                     tree.iterchildren(tag=field)
+                                     if child.text is not None])
+            num_trees += 1
+        if num_trees != len(ranges):
+            raise cf.EtymExceptDB("ERROR: Tree offsets of {0} don't match "
+                    "its trees".format(filename))
+        fields = dict((field, _buildPostings(words[field], roots[field]))
+                      for field in index_funcs.INDEX_FIELDS)
+    # 'L' is 64 bits on the platforms we build for; Python 2 has no 'Q'
+    return Sidecar(array('L', [start for start, end in ranges]),
+                   array('L', [end for start, end in ranges]), fields)
+
+def loadSidecar(filename):
+    """ Returns the Sidecar of filename, rebuilding it if stale
+
+        The sidecar is stale if the size or modification time of filename
+        have changed since it was written. If the sidecar can't be
+        written, the rebuilt one is still returned.
+
+    """
+    sidecar_file = filename + SIDECAR_SUFFIX
+    stat = os.stat(filename) if os.path.exists(filename) else None
+    try:
+        with open(sidecar_file, 'rb') as f:
+            magic, version, size, mtime = _HEADER.unpack(
+                    f.read(_HEADER.size))
+            if (stat is not None and magic == SIDECAR_MAGIC and
+                    version == SIDECAR_VERSION and size == stat.st_size and
+                    mtime == stat.st_mtime):
+                return readSidecar(f)
+    except (IOError, EOFError, struct.error):
+        pass
+
+    sidecar = buildSidecar(filename)
+    tmp_file = sidecar_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION,
+                                 stat.st_size, stat.st_mtime))
+            sidecar.write(f)
+        os.rename(tmp_file, sidecar_file)
+    except (IOError, OSError):
+        pass
+    return sidecar
+
+def readSidecar(f):
+    """ Reads a Sidecar written by Sidecar.write() from the file object f
+    """
+    starts = _readArray(f)
+    ends = _readArray(f)
+    fields = {}
+    for field in index_funcs.INDEX_FIELDS:
+        values = compact_funcs.readStringTable(f)
+        arrays = [_readArray(f) for num in range(4)]
+        keys = compact_funcs.readStringTable(f)
+        fields[field] = FieldPostings(values, *(arrays + [keys] + [
+            _readArray(f) for num in range(2)]))
+    return Sidecar(starts, ends, fields)
+
+def _buildPostings(words, roots):
+    """ Returns the FieldPostings of a field
+
+        words is a dict: value -> [number of a tree whose words hold it,
+        ...], and roots the list of the values of each tree root.
+
+    """
+    encoded = {}
+    for value in chain(words, *roots):
+        if value not in encoded:
+            encoded[value] = value.encode('utf-8')
+    ordered = sorted(set(encoded.itervalues()))
+    values = compact_funcs.StringTable(ordered)
+    numbers = dict((value, num) for num, value in enumerate(ordered, 1))
+
+    word_offsets = array('I', [0])
+    word_trees = array('I')
+    # search key -> set of tree numbers
+    keys = {}
+    by_number = [None] * (len(ordered) + 1)
+    for value, nums in words.iteritems():
+        by_number[numbers[encoded[value]]] = nums
+        for key in index_funcs.searchKeys(value):
+            keys.setdefault(key, set()).update(nums)
+    for num in xrange(1, len(ordered) + 1):
+        word_trees.extend(by_number[num] or ())
+        word_offsets.append(len(word_trees))
+    # The number 0 (None) holds nothing
+    word_offsets.insert(0, 0)
+
+    root_offsets = array('I', [0])
+    root_values = array('I')
+    for tree_num, tree_values in enumerate(roots):
+        for value in tree_values:
+            root_values.append(numbers[encoded[value]])
+            for key in index_funcs.searchKeys(value):
+                keys.setdefault(key, set()).add(tree_num)
+        root_offsets.append(len(root_values))
+
+    encoded_keys = sorted((key if isinstance(key, bytes) else
+                           key.encode('utf-8'), nums)
+                          for key, nums in keys.iteritems())
+    key_offsets = array('I', [0, 0])
+    key_trees = array('I')
+    for key, nums in encoded_keys:
+        key_trees.extend(sorted(nums))
+        key_offsets.append(len(key_trees))
+    return FieldPostings(values, word_offsets, word_trees, root_offsets,
+                         root_values, compact_funcs.StringTable(
+                             [key for key, nums in encoded_keys]),
+                         key_offsets, key_trees)
+
+def _writeArray(f, items):
+    """ Writes the array items into the file object f """
+    f.write(_ARRAY_HEADER.pack(items.typecode, len(items)))
+    f.write(items.tostring())
+
+def _readArray(f):
+    """ Reads an array written by _writeArray() from the file object f """
+    typecode, length = _ARRAY_HEADER.unpack(f.read(_ARRAY_HEADER.size))
+    items = array(typecode)
+    items.fromfile(f, length)
+    return items
+# EOF
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+""" This module tells how two words of a tree are related
+
+    commonAncestor(word, other) is the lowest common ancestor of two
+    words: the closest word (or tree root) that both come from. For
+    example, 'horse' (Modern English) and 'hross' (Old Norse) meet at the
+    PIE root 'khursa'. relationPath(word, other) is the list of words
+    leading from word up to that ancestor and down again to other.
+
+    In a loaded database, each tree gets a TreeLCA the first time it is
+    asked about: the Euler tour of the tree (its nodes in the order a
+    walk passes through them) with a sparse table of the minimum depths
+    along it, so the ancestor is found in constant time. The search index
+    keeps it with the ancestry labels of the tree, and drops both once
+    an edit moves words in or out of the tree (see
+    index_funcs.WordIndex.label()). Other words (of a backend, or not in
+    a loaded database) are related by walking up their parents.
+
+"""
+
+###
+# Imports
+from lxml import etree as ET
+
+import common_funcs as cf
+import index_funcs
+
+###
+# Classes
+class TreeLCA(object):
+    """ Finds the lowest common ancestor of two nodes of a tree """
+    def __init__(self, tree):
+        """ Walks tree and builds the sparse table of its Euler tour """
+        # The nodes in the order the walk passes through them, and their
+        # depths
+        self._tour = []
+        depths = []
+        # node -> the first position of node in the tour
+        self._first = {}
+        stack = []
+        for event, node in ET.iterwalk(tree, events=('start', 'end'),
+                                       tag=('tree', 'word')):
+            if event == 'start':
+                self._first[node] = len(self._tour)
+                stack.append(node)
+            else:
+                stack.pop()
+                if not stack:
+                    break
+                node = stack[-1]
+            self._tour.append(node)
+            depths.append(len(stack))
+        # _table[k][i] is the position of the shallowest node of the tour
+        # between positions i and i + 2**k - 1
+        self._depths = depths
+        self._table = [range(len(depths))]
+        span = 1
+        while 2 * span <= len(depths):
+            row = self._table[-1]
+            self._table.append([self._shallowest(row[pos], row[pos + span])
+                                for pos in xrange(len(depths) - 2 * span + 1)])
+            span *= 2
+
+    def __contains__(self, node):
+        """ Whether node is a node of the tree """
+        return node in self._first
+
+    def ancestor(self, node, other):
+        """ Returns the lowest common ancestor of the nodes node and other """
+        start, end = sorted((self._first[node], self._first[other]))
+        level = (end - start + 1).bit_length() - 1
+        row = self._table[level]
+        return self._tour[self._shallowest(row[start],
+                                           row[end - (1 << level) + 1])]
+
+    def _shallowest(self, pos, other_pos):
+        """ Returns whichever tour position is shallower """
+        if self._depths[other_pos] < self._depths[pos]:
+            return other_pos
+        return pos
+
+###
+# Functions
+def commonAncestor(word, other):
+    """ Returns the lowest common ancestor of word and other
+
+        That is the closest word or tree root that word and other both
+        descend from; it is word itself if other descends from word.
+        Returns None if they aren't in the same tree.
+
+    """
+    cf.checkNode(word)
+    cf.checkNode(other)
+    if not isinstance(word, cf.BackendWord):
+        index = index_funcs.rootIndex(word)
+        if index is not None:
+            lca = index.treeLCA(word)
+            if lca is not None and other in lca:
+                return lca.ancestor(word, other)
+
+    ancestors = _parents(word)
+    other_ancestors = set(_parents(other))
+    for ancestor in ancestors:
+        if ancestor in other_ancestors:
+            return ancestor
+    return None
+
+def relationPath(word, other):
+    """ Returns the path of words relating word to other
+
+        The path is a list of words (and maybe a tree root) starting with
+        word, going up its parents to commonAncestor(word, other), then
+        down to other. Returns None if they aren't in the same tree.
+
+    """
+    ancestor = commonAncestor(word, other)
+    if ancestor is None:
+        return None
+    up = _parents(word, ancestor)
+    down = _parents(other, ancestor)
+    down.pop()
+    down.reverse()
+    return up + down
+
+def _parents(word, ancestor=None):
+    """ Returns [word, its parent, ...] up to ancestor or its tree root
+
+        If the chain doesn't end in a tree root (word isn't in a tree),
+        the list is empty.
+
+    """
+    chain = [word]
+    while chain[-1] != ancestor and cf.checkNode(chain[-1]) != 'tree':
+        parent = cf.loadWordParents(chain[-1])
+        if parent is None:
+            return []
+        chain.append(parent)
+    return chain
+# EOF
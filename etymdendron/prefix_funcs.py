@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" This module completes the start of a word to the values beginning with it
+
+    A PrefixIndex keeps the values in a list sorted by their key (such as
+    index_funcs.searchKey()), so the values whose key starts with a prefix
+    sit next to each other and are found with a binary search (bisect).
+    Values are added and removed in place, so the list stays sorted
+    without being rebuilt.
+
+"""
+
+###
+# Imports
+import bisect
+
+###
+# Constants
+# How many completions are returned by default
+MAX_VALUES = 10
+
+###
+# Classes
+class PrefixIndex(object):
+    """ A sorted index of values for completing prefixes """
+    def __init__(self, values=(), key=None):
+        """ Creates the index of values
+
+            key is a function giving the key a value is sorted and matched
+            by; by default it is the value itself.
+
+        """
+        if key is None:
+            key = lambda value: value
+        self._key = key
+        # [(key, value), ...], sorted
+        self._entries = sorted((key(value), value) for value in set(values)
+                               if value is not None)
+
+    def __len__(self):
+        """ The number of values in the index """
+        return len(self._entries)
+
+    def add(self, value):
+        """ Adds value to the index """
+        if value is None:
+            return
+        entry = (self._key(value), value)
+        pos = bisect.bisect_left(self._entries, entry)
+        if pos == len(self._entries) or self._entries[pos] != entry:
+            self._entries.insert(pos, entry)
+
+    def remove(self, value):
+        """ Removes value from the index """
+        if value is None:
+            return
+        entry = (self._key(value), value)
+        pos = bisect.bisect_left(self._entries, entry)
+        if pos < len(self._entries) and self._entries[pos] == entry:
+            del self._entries[pos]
+
+    def complete(self, prefix, limit=MAX_VALUES):
+        """ Returns the values whose key starts with the key of prefix
+
+            At most limit values are returned, in the order of their keys
+            (so a shorter completion comes before the longer ones it
+            starts).
+
+        """
+        start = self._key(prefix)
+        entries = self._entries
+        pos = bisect.bisect_left(entries, (start,))
+        values = []
+        while pos < len(entries) and len(values) < limit:
+            key, value = entries[pos]
+            if not key.startswith(start):
+                break
+            values.append(value)
+            pos += 1
+        return values
+# EOF
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+""" This module searches a word database with a regular expression
+
+    common_funcs.searchDB(word_db, pattern, field, mode='regex') matches
+    the pattern (re.search(), so '^' and '$' anchor it) against the text,
+    morpheme or def of every word and tree root. A word is listed once,
+    however many of its values match.
+
+    The trees of a large database are split into chunks that are matched
+    in a pool of processes, one per CPU, and the matches are merged back
+    in document order. The workers are forked from this process, so they
+    read the trees from its memory instead of having them sent over; where
+    there is no fork (Windows), the trees are matched in this process.
+
+"""
+
+###
+# Imports
+import os
+import re
+import multiprocessing
+
+import common_funcs as cf
+
+###
+# Constants
+# The word detail elements a pattern can be matched against
+REGEX_FIELDS = ('text', 'morpheme', 'def')
+# Fewer trees than this are matched in this process, as starting a pool
+# would take longer than the search
+PARALLEL_TREES = 500
+# How many chunks of trees each process gets, so that a slow chunk
+# doesn't hold up the others
+CHUNKS_PER_PROCESS = 4
+
+# The trees being searched, read by the forked workers
+_trees = None
+
+###
+# Functions
+def compilePattern(pattern):
+    """ Returns the compiled pattern, raising EtymExceptDB if it's invalid """
+    try:
+        return re.compile(pattern, re.UNICODE)
+    except re.error as err:
+        raise cf.EtymExceptDB('Invalid pattern {0}: {1}'.format(pattern, err))
+
+def matchTree(tree, regex, field):
+    """ Returns the numbers of the nodes of tree matching regex in field
+
+        The nodes are the tree root (number 0) and its words, numbered in
+        document order.
+
+    """
+    nums = []
+    for num, node in enumerate(tree.iter('tree', 'word')):
+        for child in node.iterchildren(tag=field):
+            if child.text is not None and regex.search(child.text):
+                nums.append(num)
+                break
+    return nums
+
+def matchTrees(job):
+    """ Matches a chunk of the trees, this runs in a worker process
+
+        job is (first tree number, end tree number, pattern, field).
+        Returns the list of (tree number, node number) matches.
+
+    """
+    start, end, pattern, field = job
+    regex = compilePattern(pattern)
+    matches = []
+    for tree_num in xrange(start, end):
+        for num in matchTree(_trees[tree_num], regex, field):
+            matches.append((tree_num, num))
+    return matches
+
+def searchTrees(trees, pattern, field='text', processes=None):
+    """ Matches pattern against field of the words of trees
+
+        Returns the list of (tree, word) matches, in document order. A
+        matching tree root is listed as (tree, tree). processes is the
+        size of the pool; by default there is one process for each CPU,
+        as long as there are at least PARALLEL_TREES trees.
+
+    """
+    global _trees
+    if field not in REGEX_FIELDS:
+        raise cf.EtymExceptDB('Cannot search on the field {0}'.format(field))
+    compilePattern(pattern)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+        if len(trees) < PARALLEL_TREES:
+            processes = 1
+    if not hasattr(os, 'fork'):
+        processes = 1
+
+    num_chunks = min(len(trees), processes * CHUNKS_PER_PROCESS)
+    jobs = []
+    for chunk in xrange(num_chunks):
+        jobs.append((len(trees) * chunk // num_chunks,
+                     len(trees) * (chunk + 1) // num_chunks, pattern, field))
+
+    _trees = trees
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(matchTrees, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [matchTrees(job) for job in jobs]
+    finally:
+        _trees = None
+
+    matched_words = []
+    for matches in results:
+        nodes = None
+        for tree_num, num in matches:
+            if nodes is None or nodes[0] is not trees[tree_num]:
+                nodes = list(trees[tree_num].iter('tree', 'word'))
+            matched_words.append((nodes[0], nodes[num]))
+    return matched_words
+# EOF
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+""" This module loads a word database split into many XML files (shards)
+
+    A manifest (a file ending in one of MANIFEST_EXTENSIONS) lists the
+    shard files, one per line, relative to the manifest. Blank lines and
+    lines starting with '#' are skipped. For example, words.manifest:
+        # One shard per language family
+        shards/germanic.xml
+        shards/italic.xml
+
+    common_funcs.loadDB() hands the shards to a pool of processes, with
+    no more processes than CPUs. Each worker validates its shard and
+    works out the search index postings of its words, which become the
+    base of the search index. They are sent back packed into flat arrays
+    (see packPostings()), so that the main process doesn't spend on
+    unpickling them what the workers saved it. lxml elements can't be
+    passed between processes, so meanwhile the main process parses the
+    shards itself, in turn, and merges their trees into one database:
+    each shard is parsed twice, and only the validation and the indexing
+    are taken off the main process. On a single CPU there is nothing to
+    gain from that, so the shards are simply loaded in turn.
+
+    common_funcs.saveDB() into the manifest rewrites only the shards that
+    were edited (through the edit functions of common_funcs, see
+    markEdited()), or whose trees have changed; new trees are added to
+    the last shard. The other shards aren't written, or even read.
+
+"""
+
+###
+# Imports
+import os
+import multiprocessing
+from array import array
+
+import common_funcs as cf
+import index_funcs
+import validation_funcs
+import compact_funcs
+
+###
+# Constants
+# File extensions of a manifest
+MANIFEST_EXTENSIONS = ('.manifest',)
+
+###
+# Classes
+class Shard(object):
+    """ A shard file and the trees of the database it holds """
+    def __init__(self, filename, trees):
+        """ filename is relative to the manifest """
+        self.filename = filename
+        self.trees = trees
+        # Whether a tree of the shard was edited since it was last written
+        self.edited = False
+
+class ShardPostings(object):
+    """ The search index postings of the shards, used as a base index
+
+        See index_funcs.WordIndex for how this is used.
+
+    """
+    def __init__(self, nodes, postings, offsets):
+        """ Sets up the postings of the shards
+
+            nodes is the list of tree and word elements in document order.
+            postings holds, for each shard, a dict: field -> its postings
+            packed by packPostings(), by node number within the shard.
+            offsets holds the number of the first node of each shard.
+
+        """
+        self._nodes = nodes
+        self._postings = postings
+        self._offsets = offsets
+
+    def get(self, field, value):
+        """ Returns a new list of the words holding value in field """
+        words = []
+        for shard_postings, offset in zip(self._postings, self._offsets):
+            table, num_offsets, nums = shard_postings[field]
+            value_num = table.find(value)
+            if value_num is None:
+                continue
+            for num in nums[num_offsets[value_num]:
+                            num_offsets[value_num + 1]]:
+                words.append(self._nodes[offset + num])
+        return words
+
+    def values(self, field):
+        """ Returns the set of values of field """
+        values = set()
+        for shard_postings in self._postings:
+            table, num_offsets, nums = shard_postings[field]
+            if num_offsets[1]:
+                values.add(None)
+            values.update(table[value_num]
+                          for value_num in xrange(1, len(table)))
+        return values
+
+###
+# Functions
+def isManifest(filename):
+    """ Whether filename is a manifest (by its extension) """
+    return os.path.splitext(filename)[1].lower() in MANIFEST_EXTENSIONS
+
+def readManifest(filename):
+    """ Returns the list of shard files of filename, relative to it """
+    try:
+        with open(filename, 'r') as f:
+            lines = [line.strip() for line in f]
+    except IOError as err:
+        raise cf.EtymExceptDB("ERROR: Error reading {0}\n{1}".format(
+            filename, err))
+    shard_files = [line for line in lines
+                   if line and not line.startswith('#')]
+    if not shard_files:
+        raise cf.EtymExceptDB("ERROR: {0} lists no shards".format(filename))
+    return shard_files
+
+def writeManifest(filename, shard_files):
+    """ Writes the manifest filename listing shard_files (relative to it) """
+    lines = [shard_file + '\n' for shard_file in shard_files]
+    cf.replaceFile(filename, lambda f: f.writelines(lines))
+
+def readShard(filename, validate):
+    """ Parses (and validates) the shard filename
+
+        Returns (words_db, result), result is a dict:
+            error: the error message if the shard couldn't be loaded
+            trees: how many trees the shard has
+            seconds: the time spent validating
+
+    """
+    words_db = cf.ET.ElementTree()
+    try:
+        words_db.parse(filename, cf.makeParser(remove_blank_text=True))
+    except cf.ET.XMLSyntaxError as err:
+        return (None, {'error': "ERROR: Error parsing {0}\n{1}".format(
+            filename, err)})
+    except IOError as err:
+        return (None, {'error': "ERROR: Error reading {0}\n{1}".format(
+            filename, err)})
+
+    result = {'seconds': 0.0}
+    if validate:
+        report = validation_funcs.ValidationReport(
+            validation_funcs.VALIDATE_LOAD)
+        try:
+            validation_funcs.validateDB(words_db, filename, report)
+        except cf.EtymExceptDB as err:
+            return (None, {'error': str(err)})
+        result['seconds'] = report.seconds
+
+    result['trees'] = len(words_db.getroot().findall('tree'))
+    return (words_db, result)
+
+def parseShard(job):
+    """ Parses a shard, this runs in a worker process
+
+        job is (shard filename, whether to validate it). Returns the
+        result of readShard(), with these added:
+            words: how many words the shard has
+            postings: field -> its postings, see packPostings()
+        The node numbers are those of the trees and words of the shard in
+        document order, as the main process parses it again.
+
+    """
+    words_db, result = readShard(*job)
+    if words_db is None:
+        return result
+
+    root = words_db.getroot()
+    postings = dict((field, {}) for field in index_funcs.INDEX_FIELDS)
+    num_words = 0
+    with index_funcs.pausedGC():
+        for num, node in enumerate(root.iter('tree', 'word')):
+            if node.tag != 'word':
+                continue
+            num_words += 1
+            for child in node.iterchildren(*index_funcs.INDEX_FIELDS):
+                postings[child.tag].setdefault(child.text, []).append(num)
+        postings = dict((field, packPostings(field_postings))
+                        for field, field_postings in postings.iteritems())
+    result.update({'words': num_words, 'postings': postings})
+    return result
+
+def packPostings(postings):
+    """ Packs postings, a dict: value -> [node number, ...], into flat
+        arrays, which are much quicker to pass between processes
+
+        Returns (table, offsets, nums): table is a compact_funcs.StringTable
+        of the values, and the node numbers of value number n (0 for None)
+        are nums[offsets[n]:offsets[n + 1]].
+
+    """
+    items = sorted((value.encode('utf-8'), value_nums)
+                   for value, value_nums in postings.iteritems()
+                   if value is not None)
+    offsets = array('I', [0])
+    nums = array('I', postings.get(None, []))
+    offsets.append(len(nums))
+    for value, value_nums in items:
+        nums.extend(value_nums)
+        offsets.append(len(nums))
+    return (compact_funcs.StringTable([value for value, value_nums in items]),
+            offsets, nums)
+
+def loadShards(filename, report, processes=None):
+    """ Loads the database of the manifest filename
+
+        report is the validation_funcs.ValidationReport of the load. The
+        shards are validated and indexed in a pool of processes (by
+        default, and at most, one for each CPU) while they are parsed
+        here. With a single process, the shards are parsed and validated
+        in turn and the database is indexed as a whole instead. Either
+        way, the trees of the shards are moved into the merged database,
+        which is returned as common_funcs.loadDB() does.
+
+    """
+    filename = os.path.abspath(filename)
+    directory = os.path.dirname(filename)
+    shard_files = readManifest(filename)
+    validate = report.mode == validation_funcs.VALIDATE_LOAD
+    jobs = [(os.path.join(directory, shard_file), validate)
+            for shard_file in shard_files]
+    cpus = multiprocessing.cpu_count()
+    if processes is None:
+        processes = cpus
+    processes = min(processes, cpus, len(jobs))
+    words_db = cf.newDB()
+    root = words_db.getroot()
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            pending = pool.map_async(parseShard, jobs)
+            # The workers validate, so the shards aren't validated here
+            shard_dbs = [readShard(shard_file, False)
+                         for shard_file, validate in jobs]
+            results = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+        checkResults(results, report)
+        for shard_db, parsed in shard_dbs:
+            if shard_db is None:
+                raise cf.EtymExceptDB(parsed['error'])
+            root.extend(shard_db.getroot().iterchildren(tag='tree'))
+    else:
+        results = []
+        for job in jobs:
+            shard_db, result = readShard(*job)
+            checkResults([result], report)
+            root.extend(shard_db.getroot().iterchildren(tag='tree'))
+            results.append(result)
+
+    trees = list(root.iterchildren(tag='tree'))
+    shards = []
+    num_trees = 0
+    for shard_file, result in zip(shard_files, results):
+        shard_trees = trees[num_trees:num_trees + result['trees']]
+        shards.append(Shard(shard_file, shard_trees))
+        num_trees += result['trees']
+    _setShards(root, filename, shards)
+
+    if processes > 1:
+        nodes = list(root.iter('tree', 'word'))
+        offsets = []
+        num_nodes = 0
+        for result in results:
+            offsets.append(num_nodes)
+            num_nodes += result['trees'] + result['words']
+        base = ShardPostings(nodes, [result['postings'] for result in
+                                     results], offsets)
+        index = index_funcs.WordIndex(base=base, num_words=sum(
+            result['words'] for result in results))
+        for tree in trees:
+            index.addTree(tree)
+        index_funcs.attachIndex(root, index)
+    else:
+        index_funcs.attachIndex(root)
+    return words_db
+
+def checkResults(results, report):
+    """ Raises the error of the first failed shard, or adds the results
+        to the validation report
+
+    """
+    for result in results:
+        if 'error' in result:
+            raise cf.EtymExceptDB(result['error'])
+        report.seconds += result['seconds']
+        if report.mode == validation_funcs.VALIDATE_LOAD:
+            report.trees += result['trees']
+
+def markEdited(values):
+    """ Marks the shards holding values as edited, called by every edit
+
+        values are the arguments of an edit function of common_funcs:
+        elements, databases or lists of them. This is called before the
+        edit, so a word moved out of its shard marks that shard.
+
+    """
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            markEdited(value)
+        elif isinstance(value, cf.ET._Element):
+            tree = value if value.tag == 'tree' else None
+            top = value
+            for top in value.iterancestors():
+                if tree is None and top.tag == 'tree':
+                    tree = top
+            shard = getattr(top, '_shard_of', {}).get(tree)
+            if shard is not None:
+                shard.edited = True
+
+def getShards(words_db):
+    """ Returns (manifest filename, [Shard, ...]) of words_db, or None """
+    return getattr(words_db.getroot(), '_shards', None)
+
+def saveShards(words_db, filename):
+    """ Saves words_db into the manifest filename and its shards
+
+        Each shard is written at the same place relative to filename as
+        it was loaded from. Saving into the manifest the database was
+        loaded from only writes the shards that were edited, or that gain
+        or lose trees. A database that wasn't loaded from a manifest is
+        written as a single shard.
+
+        A shard left without trees is dropped from the manifest (but its
+        file is kept), since a shard must hold at least one tree.
+
+    """
+    filename = os.path.abspath(filename)
+    directory = os.path.dirname(filename)
+    loaded = getShards(words_db)
+    if loaded is None:
+        base = os.path.splitext(os.path.basename(filename))[0]
+        manifest, shards = None, [Shard(base + '.xml', [])]
+    else:
+        manifest, shards = loaded
+    in_place = manifest == filename
+
+    # Share the trees out to the shards they came from; new trees go to
+    # the last shard
+    shard_of = {}
+    for num, shard in enumerate(shards):
+        for tree in shard.trees:
+            shard_of[tree] = num
+    shard_trees = [[] for shard in shards]
+    for tree in words_db.getroot().iterchildren(tag='tree'):
+        if len(tree):
+            shard_trees[shard_of.get(tree, len(shards) - 1)].append(tree)
+
+    kept = []
+    for shard, trees in zip(shards, shard_trees):
+        if not trees:
+            continue
+        kept.append(shard)
+        shard_file = os.path.join(directory, shard.filename)
+        if in_place and not shard.edited and trees == shard.trees and \
+                os.path.exists(shard_file):
+            continue
+        if not os.path.isdir(os.path.dirname(shard_file)):
+            os.makedirs(os.path.dirname(shard_file))
+        cf.replaceFile(shard_file,
+                       lambda f, trees=trees: cf.writeDB(words_db, f, trees))
+        if in_place:
+            shard.trees = trees
+            shard.edited = False
+    if not in_place or len(kept) != len(shards):
+        writeManifest(filename, [shard.filename for shard in kept])
+    if in_place:
+        _setShards(words_db.getroot(), filename, kept)
+
+def _setShards(root, filename, shards):
+    """ Keeps the manifest filename and its shards on the etym element
+        root, along with which shard each tree is in
+
+    """
+    root._shards = (filename, shards)
+    root._shard_of = dict((tree, shard) for shard in shards
+                          for tree in shard.trees)
+# EOF
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+""" This module keeps a binary snapshot of a word database
+
+    The snapshot (words.xml.snap) is written next to the XML file after it
+    has been loaded and validated, only when asked for with
+    common_funcs.loadDB(filename, write_snapshot=True). It holds the
+    number of trees and words, a packed string table and the postings of
+    the search index: for each indexed (field, value), sorted by value,
+    the words holding it, by their number in document order. While the
+    snapshot is fresh, loading the database skips the DTD validation, and
+    the search index answers lookups by a binary search of the snapshot
+    postings instead of being built from the detail elements of every
+    word.
+
+    The XML is still parsed in full: the elements handed out can only
+    come from it. So the snapshot doesn't keep the structure of the trees
+    (the parent of every word), and ancestry is walked on the parsed
+    elements rather than answered from the snapshot.
+
+    A snapshot is fresh if the size and modification time of the XML file
+    match the ones recorded. If only the modification time differs (the
+    file was touched or copied), the SHA-1 of the contents is compared.
+
+"""
+
+###
+# Imports
+import os
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+
+import common_funcs as cf
+import index_funcs
+
+###
+# Constants
+# Suffix of the snapshot file, added to the database filename
+SNAPSHOT_SUFFIX = '.snap'
+SNAPSHOT_MAGIC = b'ETYMSNAP'
+# Bumped whenever the snapshot layout changes
+SNAPSHOT_VERSION = 2
+
+# magic, version, XML size, XML mtime, XML SHA-1
+_HEADER = struct.Struct('<8sIQd20s')
+# number of trees and words
+_COUNTS = struct.Struct('<II')
+# typecode, number of items
+_ARRAY_HEADER = struct.Struct('<cI')
+# length of the string table
+_BLOB_HEADER = struct.Struct('<I')
+
+###
+# Classes
+class SnapshotPostings(object):
+    """ The read-only postings of a snapshot, used as a base index
+
+        See index_funcs.WordIndex for how this is used.
+
+    """
+    def __init__(self, nodes, table, key_fields, key_strings,
+                 posting_offsets, posting_nodes):
+        """ Sets up the postings from the snapshot arrays
+
+            nodes is the list of tree and word elements in document order,
+            which the node numbers of posting_nodes refer to.
+
+        """
+        self._nodes = nodes
+        self._posting_offsets = posting_offsets
+        self._posting_nodes = posting_nodes
+        # field -> (number of its first key, [value, ...] sorted)
+        self._values = {}
+        start = 0
+        for field_num, field in enumerate(index_funcs.INDEX_FIELDS):
+            end = start
+            while end < len(key_fields) and key_fields[end] == field_num:
+                end += 1
+            self._values[field] = (start, [table[string_id] for string_id
+                                           in key_strings[start:end]])
+            start = end
+
+    def get(self, field, value):
+        """ Returns a new list of the words holding value in field """
+        if isinstance(value, bytes):
+            # The string table is unicode
+            try:
+                value = value.decode('ascii')
+            except UnicodeDecodeError:
+                return []
+        first, values = self._values[field]
+        pos = bisect_left(values, value)
+        if pos == len(values) or values[pos] != value:
+            return []
+        key = first + pos
+        return [self._nodes[num] for num in self._posting_nodes[
+                self._posting_offsets[key]:self._posting_offsets[key+1]]]
+
+    def values(self, field):
+        """ Returns the list of values of field """
+        return self._values[field][1]
+
+###
+# Functions
+def fileHash(filename):
+    """ Returns the SHA-1 digest of the contents of filename """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def writeSnapshot(words_db, filename):
+    """ Writes the snapshot of words_db, which was loaded from filename
+
+        The snapshot is written to a temporary file first and then renamed
+        into place, so a reader never sees half a snapshot.
+
+    """
+    fields = index_funcs.INDEX_FIELDS
+    nodes = list(words_db.getroot().iter('tree', 'word'))
+
+    num_words = 0
+    # field -> value -> [node number, ...]
+    postings = dict((field, {}) for field in fields)
+    strings = {}
+    key_fields = array('B')
+    key_strings = array('I')
+    posting_offsets = array('I', [0])
+    posting_nodes = array('I')
+    with index_funcs.pausedGC():
+        for num, node in enumerate(nodes):
+            if node.tag == 'tree':
+                continue
+            num_words += 1
+            for child in node.iterchildren(*fields):
+                if child.text is not None:
+                    postings[child.tag].setdefault(child.text, []).append(num)
+
+        for field_num, field in enumerate(fields):
+            field_postings = postings[field]
+            for value in sorted(field_postings):
+                key_fields.append(field_num)
+                key_strings.append(strings.setdefault(value, len(strings)))
+                posting_nodes.extend(field_postings[value])
+                posting_offsets.append(len(posting_nodes))
+        table = [None] * len(strings)
+        for value, string_id in strings.iteritems():
+            table[string_id] = value
+        blob = u'\0'.join(table).encode('utf-8')
+
+    stat = os.stat(filename)
+    snapshot = filename + SNAPSHOT_SUFFIX
+    tmp_snapshot = snapshot + '.tmp'
+    with open(tmp_snapshot, 'wb') as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, stat.st_size,
+                             stat.st_mtime, fileHash(filename)))
+        f.write(_COUNTS.pack(len(nodes) - num_words, num_words))
+        f.write(_BLOB_HEADER.pack(len(blob)))
+        f.write(blob)
+        for items in [key_fields, key_strings, posting_offsets,
+                      posting_nodes]:
+            f.write(_ARRAY_HEADER.pack(items.typecode, len(items)))
+            f.write(items.tostring())
+    try:
+        os.rename(tmp_snapshot, snapshot)
+    except OSError:
+        # Windows won't rename over an existing file
+        os.remove(snapshot)
+        os.rename(tmp_snapshot, snapshot)
+
+def loadSnapshot(filename):
+    """ Loads the database filename using its snapshot
+
+        Returns the database (as common_funcs.loadDB does), or None if
+        there is no fresh snapshot of filename.
+
+    """
+    snapshot = filename + SNAPSHOT_SUFFIX
+    try:
+        stat = os.stat(filename)
+        with open(snapshot, 'rb') as f:
+            magic, version, size, mtime, digest = _HEADER.unpack(
+                    f.read(_HEADER.size))
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                return None
+            if size != stat.st_size:
+                return None
+            if mtime != stat.st_mtime and digest != fileHash(filename):
+                return None
+            num_trees, num_words = _COUNTS.unpack(f.read(_COUNTS.size))
+            blob_size, = _BLOB_HEADER.unpack(f.read(_BLOB_HEADER.size))
+            blob = f.read(blob_size)
+            table = blob.decode('utf-8').split(u'\0') if blob_size else []
+            arrays = []
+            for num in range(4):
+                typecode, length = _ARRAY_HEADER.unpack(
+                        f.read(_ARRAY_HEADER.size))
+                items = array(typecode)
+                items.fromfile(f, length)
+                arrays.append(items)
+    except (IOError, OSError, EOFError, struct.error, UnicodeDecodeError):
+        return None
+
+    # The XML is unchanged since it was validated, so skip the DTD
+    words_db = cf.ET.ElementTree()
+    try:
+        words_db.parse(filename, cf.makeParser(remove_blank_text=True))
+    except cf.ET.XMLSyntaxError:
+        return None
+    nodes = list(words_db.getroot().iter('tree', 'word'))
+    if len(nodes) != num_trees + num_words:
+        return None
+
+    base = SnapshotPostings(nodes, table, *arrays)
+    index = index_funcs.WordIndex(base=base, num_words=num_words)
+    for tree in words_db.getroot().iterchildren(tag='tree'):
+        index.addTree(tree)
+    index_funcs.attachIndex(words_db.getroot(), index)
+    return words_db
+# EOF
@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+""" This module is the SQLite backend for the word database
+
+    A database file ending in one of SQLITE_EXTENSIONS is opened by
+    common_funcs.loadDB() as an SQLiteDB. Its words are handed out as
+    common_funcs.BackendWord objects, which the functions in common_funcs
+    pass on to the SQLiteDB methods of the same name. So a search or an
+    edit is an indexed query or a row update instead of a walk over (or a
+    rewrite of) the whole XML document.
+
+    The tables are:
+        words: one row per tree root or word (tag, tree, lang, def)
+        texts: the text and morpheme values of each word, in order
+        links: the parent of each word and its position among its siblings
+        trees: the tree roots, in order, with their XML id attribute
+
+    Every edit is committed right away.
+
+"""
+
+###
+# Imports
+import os
+import re
+import sqlite3
+
+import common_funcs as cf
+import index_funcs
+import fuzzy_funcs
+import prefix_funcs
+import regex_funcs
+import text_funcs
+
+###
+# Constants
+# File extensions that select this backend
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS words (
+    id INTEGER PRIMARY KEY,
+    tag TEXT NOT NULL,
+    tree_id INTEGER NOT NULL,
+    lang TEXT,
+    def TEXT);
+CREATE TABLE IF NOT EXISTS texts (
+    word_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT);
+CREATE TABLE IF NOT EXISTS links (
+    child_id INTEGER PRIMARY KEY,
+    parent_id INTEGER NOT NULL,
+    position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS trees (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    xml_id TEXT);
+CREATE INDEX IF NOT EXISTS texts_value ON texts (field, value);
+CREATE INDEX IF NOT EXISTS texts_word ON texts (word_id, field, position);
+CREATE INDEX IF NOT EXISTS words_lang ON words (lang);
+CREATE INDEX IF NOT EXISTS words_tree ON words (tree_id);
+CREATE INDEX IF NOT EXISTS links_parent ON links (parent_id, position);
+CREATE INDEX IF NOT EXISTS trees_position ON trees (position);
+'''
+
+# The word and all of its descendants
+_SUBTREE = '''
+WITH RECURSIVE subtree(id) AS (
+    SELECT ?
+    UNION ALL
+    SELECT links.child_id FROM links JOIN subtree
+        ON links.parent_id = subtree.id)
+SELECT id FROM subtree'''
+
+###
+# Classes
+class SQLiteDB(object):
+    """ A word database kept in an SQLite file """
+    def __init__(self, filename):
+        """ Opens (or creates) the SQLite database filename """
+        self.filename = filename
+        # field -> fuzzy_funcs.TrigramIndex, dropped by every edit
+        self._trigrams = {}
+        # field -> search key -> set of values, dropped by every edit
+        self._keys = {}
+        # field -> prefix_funcs.PrefixIndex, dropped by every edit
+        self._prefixes = {}
+        # field -> text_funcs.TextIndex of word ids, dropped by every edit
+        self._text_indexes = {}
+        try:
+            self.conn = sqlite3.connect(filename)
+            self.conn.create_function('REGEXP', 2, regexp)
+            with self.conn:
+                self.conn.executescript(_SCHEMA)
+        except sqlite3.Error as err:
+            raise cf.EtymExceptDB("ERROR: Error opening {0}\n{1}".format(
+                filename, err))
+
+    def __len__(self):
+        """ The number of trees in the database """
+        return self._one('SELECT COUNT(*) FROM trees')
+
+    def close(self):
+        """ Closes the database file """
+        self.conn.close()
+
+    ###
+    # Reading
+    def searchDB(self, search_word, field='text', mode='exact'):
+        """ Searches the database, see common_funcs.searchDB() """
+        if mode == 'fuzzy':
+            if field not in self._trigrams:
+                self._trigrams[field] = fuzzy_funcs.TrigramIndex(row[0] for
+                        row in self.conn.execute('SELECT DISTINCT value '
+                        'FROM texts JOIN words ON words.id = texts.word_id '
+                        "WHERE texts.field = ? AND words.tag = 'word'",
+                        (field,)))
+            matched_words = index_funcs.uniqueMatches(self._lookup(field,
+                    value) for value in self._trigrams[field].search(
+                    search_word))
+        elif mode == 'fulltext':
+            if field not in self._text_indexes:
+                texts = self._text_indexes[field] = text_funcs.TextIndex()
+                # field is one of text_funcs.TEXT_FIELDS, both columns
+                for word_id, text in self.conn.execute(
+                        'SELECT id, {0} FROM words'.format(field)):
+                    texts.add(word_id, text)
+            matches = sorted((-score, self._docOrder(word_id), word_id)
+                    for score, word_id in self._text_indexes[field].search(
+                        search_word, text_funcs.MAX_RESULTS))
+            matched_words = [(self._word(self._one('SELECT tree_id FROM '
+                    'words WHERE id = ?', (word_id,))), self._word(word_id))
+                    for score, order, word_id in matches]
+        elif mode == 'regex':
+            regex_funcs.compilePattern(search_word)
+            if field == 'def':
+                rows = self.conn.execute('SELECT tree_id, id FROM words '
+                        'WHERE def REGEXP ?', (search_word,)).fetchall()
+            else:
+                rows = self.conn.execute('SELECT DISTINCT words.tree_id, '
+                        'words.id FROM texts JOIN words ON words.id = '
+                        'texts.word_id WHERE texts.field = ? AND '
+                        'texts.value REGEXP ?', (field, search_word)).fetchall()
+            rows.sort(key=lambda row: self._docOrder(row[1]))
+            matched_words = [(self._word(tree_id), self._word(word_id))
+                             for tree_id, word_id in rows]
+        elif mode == 'normal':
+            if field not in self._keys:
+                keys = self._keys[field] = {}
+                for row in self.conn.execute('SELECT DISTINCT value '
+                        'FROM texts WHERE field = ?', (field,)):
+                    for key in index_funcs.searchKeys(row[0]):
+                        keys.setdefault(key, set()).add(row[0])
+            matched_words = []
+            for value in self._keys[field].get(
+                    index_funcs.searchKey(search_word), ()):
+                matched_words.extend(self._lookup(field, value, roots=True))
+            matched_words.sort(key=lambda match: self._docOrder(match[1].id))
+            matched_words = index_funcs.uniqueMatches([matched_words])
+        else:
+            matched_words = self._lookup(field, search_word)
+        num_trees = len(set(tree for tree, word in matched_words))
+
+        return (num_trees, matched_words)
+
+    def searchDB_many(self, search_words, field='text', mode='exact'):
+        """ Searches the database for each of search_words, see
+            common_funcs.searchDB_many()
+
+        """
+        return dict((search_word, self.searchDB(search_word, field, mode))
+                    for search_word in set(search_words))
+
+    def completeDB(self, prefix, field='text', limit=10):
+        """ Completes prefix, see common_funcs.completeDB() """
+        if field not in self._prefixes:
+            self._prefixes[field] = prefix_funcs.PrefixIndex((row[0] for
+                    row in self.conn.execute('SELECT DISTINCT value '
+                    'FROM texts JOIN words ON words.id = texts.word_id '
+                    "WHERE texts.field = ? AND words.tag = 'word'",
+                    (field,))), index_funcs.searchKey)
+        return self._prefixes[field].complete(prefix, limit)
+
+    def iterLanguage(self, lang, under=None):
+        """ Yields the (tree, word) in lang, see common_funcs.iterLanguage()
+        """
+        rows = self.conn.execute('SELECT tree_id, id FROM words '
+                                 'WHERE lang IS ?', (lang,)).fetchall()
+        rows.sort(key=lambda row: self._docOrder(row[1]))
+        for tree_id, word_id in rows:
+            word = self._word(word_id)
+            if under is None or any(self.isDescendant(source, word)
+                                    for source in under):
+                yield (self._word(tree_id), word)
+
+    def countLanguages(self):
+        """ Returns lang -> number of words, see common_funcs.countLanguages()
+        """
+        return dict(self.conn.execute('SELECT lang, COUNT(*) FROM words '
+                                      'GROUP BY lang'))
+
+    def loadWordDetails(self, word):
+        """ Returns the details of word, see common_funcs.loadWordDetails() """
+        row = self.conn.execute('SELECT lang, def, tag FROM words '
+                'WHERE id = ?', (word.id,)).fetchone()
+        if row is None:
+            raise cf.EtymExceptWord('Word {0} not found'.format(word.id))
+        texts = self._texts(word.id, 'text')
+        morphemes = self._texts(word.id, 'morpheme')
+
+        return {'lang': row[0], 'def': row[1], 'text': texts,
+                'morpheme': morphemes[0] if morphemes else None,
+                'tag': row[2]}
+
+    def loadWordParents(self, word):
+        """ Returns the parent of word, or None for a tree root """
+        parent_id = self._one('SELECT parent_id FROM links '
+                              'WHERE child_id = ?', (word.id,))
+        if parent_id is None:
+            return None
+        return self._word(parent_id)
+
+    def loadWordChildren(self, word):
+        """ Returns the list of children of word """
+        return [self._word(row[0]) for row in self.conn.execute(
+                'SELECT child_id FROM links WHERE parent_id = ? '
+                'ORDER BY position', (word.id,))]
+
+    def countWordChildren(self, word):
+        """ Returns how many children word has """
+        return self._one('SELECT COUNT(*) FROM links WHERE parent_id = ?',
+                         (word.id,))
+
+    def checkNode(self, word):
+        """ Returns 'word' or 'tree', see common_funcs.checkNode() """
+        tag = self._one('SELECT tag FROM words WHERE id = ?', (word.id,))
+        if tag is None:
+            raise cf.EtymExceptWord('Word {0} not found'.format(word.id))
+        return tag
+
+    def findRoot(self, word):
+        """ Returns the tree root of word """
+        return self._word(self._one('SELECT tree_id FROM words '
+                                    'WHERE id = ?', (word.id,)))
+
+    def isDescendant(self, source, test_word):
+        """ Whether test_word is source or one of its descendants """
+        word_id = test_word.id
+        while word_id is not None:
+            if word_id == source.id:
+                return True
+            word_id = self._one('SELECT parent_id FROM links '
+                                'WHERE child_id = ?', (word_id,))
+        return False
+
+    def validateWord(self, word):
+        """ Checks that word exists (the rows always follow the DTD) """
+        self.checkNode(word)
+        return True
+
+    ###
+    # Editing
+    def editWordDetails(self, word, details):
+        """ Edits the details of word, see common_funcs.editWordDetails()
+
+            details must already have been checked.
+
+        """
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            self.conn.execute('UPDATE words SET lang = ?, def = ? '
+                    'WHERE id = ?', (details['lang'], details['def'], word.id))
+            self.conn.execute('DELETE FROM texts WHERE word_id = ?',
+                              (word.id,))
+            self._insertTexts(word.id, details)
+
+    def editWordParent(self, word, parent):
+        """ Makes word the last child of parent
+
+            word can also be an lxml element (such as one made by
+            common_funcs.createWord()), which is then copied into the
+            database. If parent is None, word and its descendants are
+            deleted: a word can't be kept outside of a tree.
+
+            Returns the word as kept in this database.
+
+        """
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            return self._editWordParent(word, parent)
+
+    def moveWord(self, source, dest):
+        """ Moves source to be a child of dest """
+        return self.editWordParent(source, dest)
+
+    def deleteWord(self, word):
+        """ Deletes word, its children move up to its parent """
+        parent = self.loadWordParents(word)
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            for child in self.loadWordChildren(word):
+                self._editWordParent(child, parent)
+            self._deleteSubtree(word.id)
+
+    def deleteTree(self, tree):
+        """ Deletes the tree and all of its words """
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            self._deleteSubtree(tree.id)
+
+    def addTree(self, tree_details, children):
+        """ Adds a tree as the last one, see common_funcs.addTree()
+
+            children can be words of this database or lxml elements.
+
+        """
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            position = self._one('SELECT COALESCE(MAX(position), -1) + 1 '
+                                 'FROM trees')
+            tree_id = self._insertWord('tree', None, tree_details)
+            self.conn.execute('INSERT INTO trees (id, position) '
+                              'VALUES (?, ?)', (tree_id, position))
+            tree = self._word(tree_id)
+            for child in children:
+                self._editWordParent(child, tree)
+        return tree
+
+    def addTrees(self, trees):
+        """ Copies the lxml tree elements trees in as the last trees, see
+            common_funcs.addTrees()
+
+        """
+        with self.conn:
+            self._trigrams.clear()
+            self._keys.clear()
+            self._prefixes.clear()
+            self._text_indexes.clear()
+            position = self._one('SELECT COALESCE(MAX(position), -1) + 1 '
+                                 'FROM trees')
+            for tree in trees:
+                tree_id = self._insertElement(tree, None, None)
+                self.conn.execute('INSERT INTO trees (id, position, xml_id) '
+                                  'VALUES (?, ?, ?)', (tree_id, position,
+                                                       tree.get('id')))
+                position += 1
+        return len(trees)
+
+    ###
+    # Saving
+    def saveDB(self, filename):
+        """ Saves the database into filename
+
+            Edits are already committed, so saving to this database's own
+            file does nothing. Otherwise the database is written out as XML
+            or as another SQLite file, depending on the extension.
+
+        """
+        if os.path.abspath(filename) == os.path.abspath(self.filename):
+            self.conn.commit()
+        elif isSQLiteFile(filename):
+            importXML(self.toElementTree(), filename).close()
+        else:
+            cf.saveDB(self.toElementTree(), filename)
+
+    def toElementTree(self):
+        """ Returns the whole database as an lxml ElementTree """
+        words_db = cf.newDB()
+        root = words_db.getroot()
+        elements = {}
+        rows = self.conn.execute('SELECT words.id, words.tag, words.lang, '
+                'words.def, trees.xml_id, trees.position FROM words '
+                'LEFT JOIN trees ON trees.id = words.id')
+        for word_id, tag, lang, definition, xml_id, position in rows:
+            element = cf.ET.Element(tag)
+            if xml_id is not None:
+                element.set('id', xml_id)
+            cf.ET.SubElement(element, 'lang').text = lang
+            elements[word_id] = (element, definition, position)
+        for word_id, field, value in self.conn.execute('SELECT word_id, '
+                "field, value FROM texts ORDER BY word_id, field = "
+                "'morpheme', position"):
+            cf.ET.SubElement(elements[word_id][0], field).text = value
+        for element, definition, position in elements.values():
+            cf.ET.SubElement(element, 'def').text = definition
+        for child_id, parent_id in self.conn.execute('SELECT child_id, '
+                'parent_id FROM links ORDER BY parent_id, position'):
+            elements[parent_id][0].append(elements[child_id][0])
+        trees = sorted((position, element) for element, definition, position
+                       in elements.values() if position is not None)
+        for position, element in trees:
+            root.append(element)
+        return words_db
+
+    ###
+    # Helpers
+    def _lookup(self, field, value, roots=False):
+        """ Returns the (tree, word) matches of value, in document order
+
+            The tree roots holding value are only matched if roots is True.
+
+        """
+        tags = ('word', 'tree') if roots else ('word', 'word')
+        rows = self.conn.execute('SELECT words.tree_id, words.id FROM texts '
+                'JOIN words ON words.id = texts.word_id WHERE '
+                'texts.field = ? AND texts.value = ? AND words.tag IN (?, ?)',
+                (field, value) + tags).fetchall()
+        rows.sort(key=lambda row: self._docOrder(row[1]))
+        return [(self._word(tree_id), self._word(word_id))
+                for tree_id, word_id in rows]
+
+    def _one(self, query, params=()):
+        """ Returns the first column of the first row of query, or None """
+        row = self.conn.execute(query, params).fetchone()
+        return None if row is None else row[0]
+
+    def _word(self, word_id):
+        """ Returns the BackendWord of word_id """
+        return cf.BackendWord(self, word_id)
+
+    def _texts(self, word_id, field):
+        """ Returns the list of values of field for word_id """
+        return [row[0] for row in self.conn.execute('SELECT value FROM texts '
+                'WHERE word_id = ? AND field = ? ORDER BY position',
+                (word_id, field))]
+
+    def _docOrder(self, word_id):
+        """ Sort key placing word_id in document order """
+        path = []
+        while True:
+            row = self.conn.execute('SELECT parent_id, position FROM links '
+                    'WHERE child_id = ?', (word_id,)).fetchone()
+            if row is None:
+                break
+            word_id = row[0]
+            path.append(row[1])
+        path.reverse()
+        return (self._one('SELECT position FROM trees WHERE id = ?',
+                          (word_id,)), path)
+
+    def _editWordParent(self, word, parent):
+        """ editWordParent() without committing """
+        if isinstance(word, cf.BackendWord) and word.db is not self:
+            raise cf.EtymExceptWord('Word {0} is from another '
+                                    'database'.format(word.id))
+        if parent is None:
+            if isinstance(word, cf.BackendWord):
+                self._deleteSubtree(word.id)
+            return None
+        tree_id = self._one('SELECT tree_id FROM words WHERE id = ?',
+                            (parent.id,))
+        if not isinstance(word, cf.BackendWord):
+            return self._word(self._insertElement(word, tree_id, parent.id))
+        if self.isDescendant(word, parent):
+            # A link from a word to its own descendant would be a cycle
+            raise cf.EtymExceptWord('Word {0} can\'t be moved under itself '
+                                    'or one of its descendants'.format(word.id))
+        self.conn.execute('DELETE FROM links WHERE child_id = ?', (word.id,))
+        self._link(word.id, parent.id)
+        self.conn.execute('UPDATE words SET tree_id = ? WHERE id IN '
+                          '({0})'.format(_SUBTREE), (tree_id, word.id))
+        return word
+
+    def _link(self, child_id, parent_id):
+        """ Makes child_id the last child of parent_id """
+        self.conn.execute('INSERT INTO links (child_id, parent_id, position) '
+                'SELECT ?, ?, COALESCE(MAX(position), -1) + 1 FROM links '
+                'WHERE parent_id = ?', (child_id, parent_id, parent_id))
+
+    def _insertWord(self, tag, tree_id, details):
+        """ Inserts a word row and its texts, returns its id
+
+            If tree_id is None, the word is its own tree root.
+
+        """
+        cursor = self.conn.execute('INSERT INTO words (tag, tree_id, lang, '
+                'def) VALUES (?, -1, ?, ?)', (tag, details['lang'],
+                                              details['def']))
+        word_id = cursor.lastrowid
+        self.conn.execute('UPDATE words SET tree_id = ? WHERE id = ?',
+                (word_id if tree_id is None else tree_id, word_id))
+        self._insertTexts(word_id, details)
+        return word_id
+
+    def _insertTexts(self, word_id, details):
+        """ Inserts the text and morpheme rows of word_id """
+        morphemes = details['morpheme']
+        if not isinstance(morphemes, list):
+            morphemes = [morphemes]
+        rows = [(word_id, 'text', position, value)
+                for position, value in enumerate(details['text'])]
+        rows += [(word_id, 'morpheme', position, value)
+                 for position, value in enumerate(morphemes)]
+        self.conn.executemany('INSERT INTO texts (word_id, field, position, '
+                              'value) VALUES (?, ?, ?, ?)', rows)
+
+    def _insertElement(self, element, tree_id, parent_id):
+        """ Copies the lxml word element (and its descendants) in
+
+            If tree_id is None, element is a tree root. Returns its id.
+
+        """
+        details = {'lang': element.findtext('lang'),
+                   'def': element.findtext('def'),
+                   'text': [child.text for child in element.iterchildren(
+                            tag='text')],
+                   'morpheme': [child.text for child in element.iterchildren(
+                                tag='morpheme')]}
+        word_id = self._insertWord(element.tag, tree_id, details)
+        if parent_id is not None:
+            self._link(word_id, parent_id)
+        if tree_id is None:
+            tree_id = word_id
+        for child in element.iterchildren(tag='word'):
+            self._insertElement(child, tree_id, word_id)
+        return word_id
+
+    def _deleteSubtree(self, word_id):
+        """ Deletes word_id and its descendants """
+        ids = [row[0] for row in self.conn.execute(_SUBTREE, (word_id,))]
+        for start in xrange(0, len(ids), 500):
+            chunk = ids[start:start+500]
+            marks = ', '.join('?' * len(chunk))
+            for query in ['DELETE FROM texts WHERE word_id IN ({0})',
+                          'DELETE FROM links WHERE child_id IN ({0})',
+                          'DELETE FROM trees WHERE id IN ({0})',
+                          'DELETE FROM words WHERE id IN ({0})']:
+                self.conn.execute(query.format(marks), chunk)
+
+###
+# Functions
+def regexp(pattern, value):
+    """ The REGEXP function of SQLite: whether pattern is found in value """
+    return value is not None and re.search(pattern, value,
+                                           re.UNICODE) is not None
+
+def isSQLiteFile(filename):
+    """ Whether filename is meant for this backend (by its extension) """
+    return os.path.splitext(filename)[1].lower() in SQLITE_EXTENSIONS
+
+def importXML(words_db, filename):
+    """ Writes the XML database words_db into the SQLite file filename
+
+        Any existing file is replaced. Returns the new SQLiteDB.
+
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    sqlite_db = SQLiteDB(filename)
+    with sqlite_db.conn:
+        for position, tree in enumerate(
+                words_db.getroot().iterchildren(tag='tree')):
+            if len(tree) == 0:
+                # A tree emptied by common_funcs.deleteTree()
+                continue
+            tree_id = sqlite_db._insertElement(tree, None, None)
+            sqlite_db.conn.execute('INSERT INTO trees (id, position, '
+                    'xml_id) VALUES (?, ?, ?)', (tree_id, position,
+                                                 tree.get('id')))
+    return sqlite_db
+
+def exportXML(sqlite_db, filename):
+    """ Writes the SQLiteDB sqlite_db out as the XML file filename """
+    cf.saveDB(sqlite_db.toElementTree(), filename)
+# EOF
@@ -6,13 +6,46 @@
 """
 
 import unittest
-import sys, os
+import sys, os, re
+import shutil, tempfile
 from lxml import etree as ET
 import global_opts
 import common_funcs as cf
+import lazy_funcs
+import snapshot_funcs
+import journal_funcs
+import validation_funcs
+import shard_funcs
+import fuzzy_funcs
+import index_funcs
+import lca_funcs
+import prefix_funcs
+import variant_funcs
+import regex_funcs
+import text_funcs
+import cache_funcs
+import view_funcs
+import compact_funcs
+import import_funcs
 import cli_funcs as cli
 import StringIO
 
+# The source tree copy of the db, the tests use one in a temporary
+# directory so that the files written next to it (the snapshot, the lazy
+# sidecar) stay out of the source tree
+SOURCE_WORDS_FILE = global_opts.WORDS_FILE
+
+def setUpModule():
+    """ Points global_opts.WORDS_FILE at a copy of the db """
+    tmp_dir = tempfile.mkdtemp()
+    global_opts.WORDS_FILE = os.path.join(tmp_dir, 'words.xml')
+    shutil.copy(SOURCE_WORDS_FILE, global_opts.WORDS_FILE)
+
+def tearDownModule():
+    """ Removes the copy of the db, and what was written next to it """
+    shutil.rmtree(os.path.dirname(global_opts.WORDS_FILE))
+    global_opts.WORDS_FILE = SOURCE_WORDS_FILE
+
 class EtymDB(unittest.TestCase):
     """ Various tests for the database """
     def testTypeDB(self):
@@ -31,6 +64,58 @@ class EtymDB(unittest.TestCase):
         cf.saveDB(db, tmp_file)
         os.remove(tmp_file)
 
+    def testSaveDBStreaming(self):
+        """ Test the streamed save matches the whole document and is atomic """
+        db = self.getDB()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            tmp_file = os.path.join(tmp_dir, 'words.xml')
+            cf.saveDB(db, tmp_file)
+            with open(tmp_file, 'rb') as f:
+                self.assertEqual(f.read(), ET.tostring(db, encoding='utf-8',
+                    pretty_print=True, xml_declaration=True, standalone=True))
+            # The document keeps its own DTD
+            with open(global_opts.WORDS_FILE, 'rb') as f:
+                data = f.read()
+            extra = b'<!ATTLIST word note CDATA #IMPLIED>'
+            with open(tmp_file, 'wb') as f:
+                f.write(data.replace(b'\n]>', b'\n' + extra + b'\n]>', 1))
+            own_db = cf.loadDB(tmp_file, snapshot=False)
+            own_db.getroot()[0][-1].set('note', 'kept')
+            before = ET.tostring(own_db)
+            cf.saveDB(own_db, tmp_file)
+            self.assertEqual(ET.tostring(own_db), before)
+            with open(tmp_file, 'rb') as f:
+                self.assertIn(extra, f.read())
+            self.assertEqual(ET.tostring(cf.loadDB(tmp_file,
+                                                   snapshot=False)), before)
+            # A new file follows the umask, an old one keeps its mode
+            umask = os.umask(0o027)
+            try:
+                os.remove(tmp_file)
+                cf.saveDB(db, tmp_file)
+                self.assertEqual(os.stat(tmp_file).st_mode & 0o777, 0o640)
+                os.chmod(tmp_file, 0o604)
+                cf.saveDB(db, tmp_file)
+                self.assertEqual(os.stat(tmp_file).st_mode & 0o777, 0o604)
+            finally:
+                os.umask(umask)
+            # A save that fails halfway leaves the old file alone
+            def badWrite(words_db, f):
+                f.write(b'<?xml')
+                raise IOError('disk full')
+            writeDB = cf.writeDB
+            cf.writeDB = badWrite
+            try:
+                self.assertRaises(IOError, cf.saveDB, db, tmp_file)
+            finally:
+                cf.writeDB = writeDB
+            self.assertEqual(os.listdir(tmp_dir), ['words.xml'])
+            self.assertEqual(ET.tostring(cf.loadDB(tmp_file, snapshot=False)),
+                             ET.tostring(db))
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def getDB(self):
         """ Helper function to load the DB """
         return cf.loadDB(global_opts.WORDS_FILE)
@@ -220,6 +305,57 @@ class EtymDB(unittest.TestCase):
         '<def>lkjfs</def></word>')
         self.assertEqual(ET.tostring(test_word), sort_output)
 
+    def testCheckWord(self):
+        """ Tests checking a word leaves it alone, normalizing reorders it """
+        chosen_word = self.getWord('far')
+        self.assertEqual(cf.checkWord(chosen_word), True)
+        test_word = ET.fromstring('<word>testing<def>lkjfs</def>'
+                '<text>23rds</text><word/><lang>asdf</lang>'
+                '<morpheme>sdf0</morpheme><text>203fjklsdfj</text></word>')
+        before = ET.tostring(test_word)
+        children = list(test_word)
+        self.assertEqual(cf.checkWord(test_word), False)
+        self.assertEqual(ET.tostring(test_word), before)
+        self.assertEqual(cf.normalizeWord(test_word), True)
+        self.assertEqual(ET.tostring(test_word), '<word>testing'
+                '<lang>asdf</lang><text>23rds</text><text>203fjklsdfj</text>'
+                '<morpheme>sdf0</morpheme><def>lkjfs</def><word/></word>')
+        # The same elements, only moved
+        self.assertEqual(sorted(map(id, test_word)), sorted(map(id, children)))
+        self.assertEqual(cf.checkWord(test_word), True)
+        self.assertEqual(cf.normalizeWord(test_word), False)
+        test_word.append(ET.Element('def'))
+        self.assertRaises(cf.EtymExceptWord, cf.checkWord, test_word)
+        self.assertRaises(cf.EtymExceptWord, cf.normalizeWord, test_word)
+
+    def testEditNormalizes(self):
+        """ Tests an edit puts a word back in order, so it saves and loads """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            tmp_file = os.path.join(tmp_dir, 'words.xml')
+            for grouped in (False, True):
+                db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+                ros = cf.searchDB(db, 'ros')[1][1][1]
+                horse = cf.searchDB(db, 'horse')[1][0][1]
+                texts = cf.loadWordDetails(ros)['text']
+                # Put the lang last, behind the edit functions' back
+                ros.insert(ros.index(ros.find('def')) + 1, ros.find('lang'))
+                self.assertEqual(cf.checkWord(ros), False)
+                if grouped:
+                    with cf.transaction():
+                        cf.moveWord(ros, horse)
+                else:
+                    cf.moveWord(ros, horse)
+                self.assertEqual(cf.checkWord(ros), True)
+                self.assertEqual(ros[0].tag, 'lang')
+                cf.saveDB(db, tmp_file)
+                db = cf.loadDB(tmp_file, snapshot=False)
+                horse = cf.searchDB(db, 'horse')[1][0][1]
+                self.assertIn(texts, [cf.loadWordDetails(child)['text']
+                                      for child in cf.loadWordChildren(horse)])
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def testChangeChildren(self):
         """ Tests modifying the children of a word """
         chosen_word = self.getWord('far')
@@ -468,6 +604,1703 @@ class EtymDB(unittest.TestCase):
         self.assertRaises(cf.EtymExceptWord, cf.addTree, 
                           db, tree_dets, [new_word])
 
+class EtymIndex(unittest.TestCase):
+    """ Tests for the search index """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def scanDB(self, search_word):
+        """ Helper function, searches by walking the whole db """
+        return [(tree, word) for tree in self.db.getroot()
+                for word in tree.iterdescendants(tag='word')
+                for text in word.iterchildren(tag='text')
+                if text.text == search_word]
+
+    def testIndexMatchesScan(self):
+        """ Tests the index gives the same results as a full scan """
+        texts = set(text.text for text in self.db.getroot().iter('text'))
+        for search_word in texts:
+            num_trees, matched_words = cf.searchDB(self.db, search_word)
+            self.assertEqual(matched_words, self.scanDB(search_word))
+            self.assertEqual(num_trees,
+                    len(set(tree for tree, word in matched_words)))
+
+    def testSearchMorpheme(self):
+        """ Tests searching on the morpheme """
+        num_trees, matched_words = cf.searchDB(self.db, 'hors', 'morpheme')
+        self.assertEqual(len(matched_words), 2)
+        num_trees, matched_words = cf.searchDB(self.db, 'horce', 'morpheme')
+        self.assertEqual(num_trees, 0)
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB, self.db, 'hors',
+                          'def')
+
+    def testIndexEdits(self):
+        """ Tests the index follows edits to the db """
+        # Edit the details of a word
+        num_trees, matched_words = cf.searchDB(self.db, 'hross')
+        word = matched_words[0][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = ['hrossy']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(cf.searchDB(self.db, 'hross')[0], 0)
+        self.assertEqual(cf.searchDB(self.db, 'hrossy')[1][0][1], word)
+        # Create a new word under it
+        word_dets = {'lang': 'English', 'text': ['banana'],
+                'morpheme': 'banana', 'def': 'A fruity thing'}
+        new_word = cf.createWord(word_dets, word_parent=word)
+        self.assertEqual(cf.searchDB(self.db, 'banana')[1][0][1], new_word)
+        # Delete the word, the new word moves up
+        cf.deleteWord(word)
+        self.assertEqual(cf.searchDB(self.db, 'hrossy')[0], 0)
+        self.assertEqual(cf.searchDB(self.db, 'banana')[1][0][1], new_word)
+        # Add a tree and delete it again
+        tree_dets = {'lang': 'PIE', 'text': ['bane'],
+                'morpheme': 'bane', 'def': 'Some fruit'}
+        new_tree = cf.addTree(self.db, tree_dets, [new_word])
+        self.assertEqual(cf.searchDB(self.db, 'banana')[1][0][0], new_tree)
+        cf.deleteTree(new_tree)
+        self.assertEqual(cf.searchDB(self.db, 'banana')[0], 0)
+        self.assertEqual(cf.searchDB(self.db, 'banana', 'morpheme')[0], 0)
+
+    def testStreamDB(self):
+        """ Tests loading and searching the db a tree at a time """
+        stream_db = cf.loadDB(global_opts.WORDS_FILE, streaming=True)
+        self.assertIsInstance(stream_db, type(ET.ElementTree()))
+        self.assertEqual(len(stream_db.getroot()), len(self.db.getroot()))
+        for search_word in ['horse', 'ros', 'biology', 'kumquat']:
+            num_trees, matched_words = cf.searchDB(self.db, search_word)
+            self.assertEqual(cf.searchDB(stream_db, search_word)[0],
+                             num_trees)
+            stream_trees, stream_words = cf.scanDB(global_opts.WORDS_FILE,
+                                                   search_word)
+            self.assertEqual(stream_trees, num_trees)
+            self.assertEqual([ET.tostring(word) for tree, word in stream_words],
+                    [ET.tostring(word) for tree, word in matched_words])
+        # The dropped trees are detached from the etym root
+        trees = list(cf.iterDB(global_opts.WORDS_FILE, drop=True))
+        self.assertEqual(trees[-1].getparent(), None)
+        self.assertRaises(cf.EtymExceptDB, cf.scanDB, 'sdf', 'horse')
+        self.assertRaises(cf.EtymExceptDB, cf.loadDB, 'sdf', True)
+
+class EtymLazyDB(unittest.TestCase):
+    """ Tests for loading trees on demand """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+        self.db = cf.loadDB(self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testLazySearch(self):
+        """ Tests the lazy db finds the same words as the full db """
+        lazy_db = cf.loadDB(self.db_file, lazy=True)
+        self.assertTrue(os.path.exists(self.db_file +
+                                       lazy_funcs.SIDECAR_SUFFIX))
+        self.assertEqual(cf.countTrees(lazy_db), cf.countTrees(self.db))
+        for search_word in ['horse', 'ros', 'biology', 'kumquat']:
+            num_trees, matched_words = cf.searchDB(self.db, search_word)
+            lazy_trees, lazy_words = cf.searchDB(lazy_db, search_word)
+            self.assertEqual(lazy_trees, num_trees)
+            self.assertEqual([ET.tostring(word) for tree, word in lazy_words],
+                    [ET.tostring(word) for tree, word in matched_words])
+        # Only the searched trees were parsed
+        self.assertEqual(len(lazy_db._cache), 3)
+
+    def testLazyNoResultCache(self):
+        """ Tests the search results don't keep evicted trees parsed """
+        lazy_db = lazy_funcs.LazyDB(self.db_file, cache_size=1)
+        for search_word in ['horse', 'ros', 'biology']:
+            cf.searchDB(lazy_db, search_word)
+        self.assertEqual(len(cache_funcs.getCache(lazy_db)), 0)
+        self.assertFalse(hasattr(lazy_db, '_result_cache'))
+        # The words come from the trees parsed now
+        tree = cf.searchDB(lazy_db, 'horse')[1][0][0]
+        self.assertTrue(lazy_db.loadTree(lazy_db._cache.keys()[0]) is tree)
+
+    def testLazyCache(self):
+        """ Tests the parsed trees are evicted from the cache """
+        lazy_db = lazy_funcs.LazyDB(self.db_file, cache_size=2)
+        tree = lazy_db.loadTree(0)
+        self.assertEqual(cf.loadWordDetails(tree)['text'], ['khursa'])
+        self.assertEqual(lazy_db.loadTree(0), tree)
+        lazy_db.loadTree(1)
+        lazy_db.loadTree(0)
+        lazy_db.loadTree(2)
+        self.assertEqual(sorted(lazy_db._cache.keys()), [0, 2])
+
+    def testStaleSidecar(self):
+        """ Tests the sidecar is rebuilt after the db changes """
+        cf.loadDB(self.db_file, lazy=True)
+        num_trees, matched_words = cf.searchDB(self.db, 'hross')
+        word_dets = cf.loadWordDetails(matched_words[0][1])
+        word_dets['text'] = ['hrossy']
+        cf.editWordDetails(matched_words[0][1], word_dets)
+        cf.saveDB(self.db, self.db_file)
+        lazy_db = cf.loadDB(self.db_file, lazy=True)
+        self.assertEqual(cf.searchDB(lazy_db, 'hross')[0], 0)
+        self.assertEqual(cf.searchDB(lazy_db, 'hrossy')[0], 1)
+
+    def testSidecarReopen(self):
+        """ Tests a reopen reads the stored postings without a rebuild """
+        cf.loadDB(self.db_file, lazy=True)
+        build_sidecar = lazy_funcs.buildSidecar
+        def failBuild(filename):
+            raise AssertionError('sidecar rebuilt')
+        lazy_funcs.buildSidecar = failBuild
+        try:
+            lazy_db = cf.loadDB(self.db_file, lazy=True)
+        finally:
+            lazy_funcs.buildSidecar = build_sidecar
+        for search_word, mode in [('horse', 'exact'), ('WAIT', 'normal'),
+                                  ('^hr.ss', 'regex')]:
+            self.assertEqual(cf.searchDB(lazy_db, search_word, mode=mode)[0],
+                             cf.searchDB(self.db, search_word, mode=mode)[0])
+
+class EtymSnapshot(unittest.TestCase):
+    """ Tests for the binary snapshot of the db """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testSnapshotLoad(self):
+        """ Tests loading through the snapshot gives the same db """
+        xml_db = cf.loadDB(self.db_file)
+        # Writing the snapshot is opt-in
+        self.assertFalse(os.path.exists(self.db_file +
+                                        snapshot_funcs.SNAPSHOT_SUFFIX))
+        xml_db = cf.loadDB(self.db_file, write_snapshot=True)
+        self.assertTrue(os.path.exists(self.db_file +
+                                       snapshot_funcs.SNAPSHOT_SUFFIX))
+        snap_db = snapshot_funcs.loadSnapshot(self.db_file)
+        self.assertNotEqual(snap_db, None)
+        self.assertEqual(ET.tostring(snap_db), ET.tostring(xml_db))
+        texts = set(text.text for text in xml_db.getroot().iter('text'))
+        for search_word in texts:
+            xml_trees, xml_words = cf.searchDB(xml_db, search_word)
+            snap_trees, snap_words = cf.searchDB(snap_db, search_word)
+            self.assertEqual(snap_trees, xml_trees)
+            self.assertEqual([ET.tostring(word) for tree, word in snap_words],
+                    [ET.tostring(word) for tree, word in xml_words])
+
+    def testSnapshotEdits(self):
+        """ Tests the index of a snapshot db follows edits """
+        cf.loadDB(self.db_file, write_snapshot=True)
+        db = cf.loadDB(self.db_file)
+        num_trees, matched_words = cf.searchDB(db, 'ros')
+        self.assertEqual(len(matched_words), 2)
+        word = matched_words[1][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = ['rosy']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(len(cf.searchDB(db, 'ros')[1]), 1)
+        self.assertEqual(cf.searchDB(db, 'rosy')[1][0][1], word)
+        cf.deleteWord(word)
+        self.assertEqual(cf.searchDB(db, 'rosy')[0], 0)
+
+    def testStaleSnapshot(self):
+        """ Tests a snapshot is only used while the XML is unchanged """
+        db = cf.loadDB(self.db_file, write_snapshot=True)
+        # Touching the file keeps the contents (and the snapshot) good
+        os.utime(self.db_file, (0, 0))
+        self.assertNotEqual(snapshot_funcs.loadSnapshot(self.db_file), None)
+        # Changing the contents makes it stale
+        num_trees, matched_words = cf.searchDB(db, 'hross')
+        word_dets = cf.loadWordDetails(matched_words[0][1])
+        word_dets['text'] = ['hrossy']
+        cf.editWordDetails(matched_words[0][1], word_dets)
+        cf.saveDB(db, self.db_file)
+        self.assertEqual(snapshot_funcs.loadSnapshot(self.db_file), None)
+        db = cf.loadDB(self.db_file, write_snapshot=True)
+        self.assertEqual(cf.searchDB(db, 'hrossy')[0], 1)
+        self.assertNotEqual(snapshot_funcs.loadSnapshot(self.db_file), None)
+
+class EtymSQLite(unittest.TestCase):
+    """ Tests for the SQLite backend """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.sqlite')
+        self.xml_db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+        cf.saveDB(self.xml_db, self.db_file)
+        self.db = cf.loadDB(self.db_file)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def testSQLiteSearch(self):
+        """ Tests searching gives the same words as the XML backend """
+        self.assertEqual(cf.countTrees(self.db), cf.countTrees(self.xml_db))
+        for field in ['text', 'morpheme']:
+            values = set(child.text for child in
+                         self.xml_db.getroot().iter(field))
+            for search_word in values:
+                xml_trees, xml_words = cf.searchDB(self.xml_db, search_word,
+                                                   field)
+                sql_trees, sql_words = cf.searchDB(self.db, search_word,
+                                                   field)
+                self.assertEqual(sql_trees, xml_trees)
+                self.assertEqual([cf.loadWordDetails(word) for tree, word
+                                  in sql_words],
+                                 [cf.loadWordDetails(word) for tree, word
+                                  in xml_words])
+
+    def testSQLiteRoundTrip(self):
+        """ Tests exporting to XML gives back the same db """
+        xml_file = os.path.join(self.tmp_dir, 'words.xml')
+        cf.saveDB(self.db, xml_file)
+        db = cf.loadDB(xml_file, snapshot=False)
+        self.assertEqual(ET.tostring(db.getroot()),
+                         ET.tostring(self.xml_db.getroot()))
+
+    def testSQLiteEdits(self):
+        """ Tests editing words in the SQLite backend """
+        word = cf.searchDB(self.db, 'ros')[1][1][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = ['rosy', 'rosier']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(cf.searchDB(self.db, 'rosy')[1][0][1], word)
+        self.assertEqual(cf.loadWordDetails(word)['text'], ['rosy', 'rosier'])
+
+        # Move the word under horse, then delete it
+        horse = cf.searchDB(self.db, 'horse')[1][0][1]
+        num_children = cf.countWordChildren(horse)
+        self.assertFalse(cf.isDescendant(horse, word))
+        cf.moveWord(word, horse)
+        self.assertTrue(cf.isDescendant(horse, word))
+        # Not under itself or its own descendant
+        grandchild = cf.loadWordChildren(word)[0]
+        self.assertRaises(cf.EtymExceptWord, cf.moveWord, word, word)
+        self.assertRaises(cf.EtymExceptWord, cf.moveWord, horse, grandchild)
+        self.assertEqual(cf.loadWordParents(word), horse)
+        self.assertEqual(cf.findRoot(horse), cf.findRoot(word))
+        self.assertEqual(cf.loadWordParents(word), horse)
+        self.assertEqual(cf.findRoot(word), cf.findRoot(horse))
+        self.assertEqual(cf.loadWordChildren(horse)[-1], word)
+        word_children = cf.loadWordChildren(word)
+        cf.deleteWord(word)
+        self.assertEqual(cf.loadWordChildren(horse)[num_children:],
+                         word_children)
+        self.assertEqual(cf.searchDB(self.db, 'rosy')[0], 0)
+
+        # A new word copied in under horse
+        new_word = cf.createWord({'lang': 'English', 'text': ['hoss'],
+                                  'morpheme': 'hoss', 'def': 'A horse'},
+                                 word_parent=horse)
+        self.assertEqual(cf.checkNode(new_word), 'word')
+        self.assertEqual(cf.loadWordParents(new_word), horse)
+
+    def testSQLiteTrees(self):
+        """ Tests adding and deleting trees in the SQLite backend """
+        num_trees = cf.countTrees(self.db)
+        child = cf.createWord({'lang': 'English', 'text': ['foo'],
+                               'morpheme': 'foo', 'def': 'A foo'})
+        tree = cf.addTree(self.db, {'lang': 'PIE', 'text': ['*foo'],
+                                    'morpheme': '*foo', 'def': 'Foo'},
+                          [child])
+        self.assertEqual(cf.checkNode(tree), 'tree')
+        self.assertEqual(cf.countTrees(self.db), num_trees + 1)
+        self.assertEqual(cf.searchDB(self.db, 'foo')[1][0][0], tree)
+        cf.deleteTree(tree)
+        self.assertEqual(cf.searchDB(self.db, 'foo')[0], 0)
+        self.assertEqual(cf.countTrees(self.db), num_trees)
+
+class EtymJournal(unittest.TestCase):
+    """ Tests for the edit journal """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        self.journal_file = self.db_file + journal_funcs.JOURNAL_SUFFIX
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dumpDB(self, db):
+        """ Returns the XML that db would be saved as """
+        f = StringIO.StringIO()
+        cf.writeDB(db, f)
+        return f.getvalue()
+
+    def makeEdits(self, db):
+        """ Makes one edit of each kind to db """
+        word_dets = {'text': ['NEW WORD'], 'morpheme': 'NEW WORD',
+                     'lang': 'UNKNOWN', 'def': 'Change me!'}
+        ros = cf.searchDB(db, 'ros')[1][1][1]
+        details = cf.loadWordDetails(ros)
+        details['text'] = ['rosy']
+        cf.editWordDetails(ros, details)
+        horse = cf.searchDB(db, 'horse')[1][0][1]
+        cf.moveWord(ros, horse)
+        cf.deleteWord(cf.searchDB(db, 'hors')[1][0][1])
+        cf.createWord(word_dets, word_parent=horse)
+        cf.deleteTree(cf.searchDB(db, 'bios')[1][0][0])
+        cf.addTree(db, {'text': ['NEW ROOT'], 'morpheme': 'NEW ROOT',
+                        'lang': 'UNKNOWN', 'def': 'Change me!'},
+                   [cf.createWord(word_dets)])
+
+    def testReplay(self):
+        """ Tests the journal brings back the edits after a reload """
+        db = cf.loadDB(self.db_file, journal=True)
+        self.makeEdits(db)
+        self.assertEqual(len(journal_funcs.getJournal(db)), 6)
+        # The edits reach the journal, not the XML file
+        self.assertEqual(self.dumpDB(cf.loadDB(self.db_file)),
+                         self.dumpDB(cf.loadDB(global_opts.WORDS_FILE)))
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(self.dumpDB(new_db), self.dumpDB(db))
+        self.assertEqual(cf.searchDB(new_db, 'rosy')[0], 1)
+
+    def testNormalizeJournal(self):
+        """ Tests only a word that is reordered reaches the journal """
+        db = cf.loadDB(self.db_file, journal=True)
+        ros = cf.searchDB(db, 'ros')[1][1][1]
+        generation = cache_funcs.getGeneration()
+        self.assertEqual(cf.validateWord(ros), True)
+        self.assertEqual(cf.normalizeWord(ros), False)
+        self.assertEqual(len(journal_funcs.getJournal(db)), 0)
+        self.assertEqual(cache_funcs.getGeneration(), generation)
+        ros.append(ros.find('lang'))
+        self.assertEqual(cf.normalizeWord(ros), True)
+        self.assertEqual(len(journal_funcs.getJournal(db)), 1)
+        self.assertNotEqual(cache_funcs.getGeneration(), generation)
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(self.dumpDB(new_db), self.dumpDB(db))
+
+    def testCompaction(self):
+        """ Tests saving folds the journal into the XML file """
+        db = cf.loadDB(self.db_file, journal=True)
+        self.makeEdits(db)
+        cf.saveDB(db, self.db_file)
+        self.assertFalse(os.path.exists(self.journal_file))
+        self.assertEqual(self.dumpDB(cf.loadDB(self.db_file)),
+                         self.dumpDB(db))
+        # Edits after the save go into a new journal
+        cf.deleteWord(cf.searchDB(db, 'rosy')[1][0][1])
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(self.dumpDB(new_db), self.dumpDB(db))
+
+    def testBadJournal(self):
+        """ Tests a cut off record or a journal of another file """
+        db = cf.loadDB(self.db_file, journal=True)
+        self.makeEdits(db)
+        with open(self.journal_file, 'a') as f:
+            f.write('{"op": "deleteTree", "ar')
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(self.dumpDB(new_db), self.dumpDB(db))
+        # Once the XML file changes, the journal no longer applies
+        with open(self.db_file, 'a') as f:
+            f.write('\n')
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(cf.searchDB(new_db, 'rosy')[0], 0)
+        self.assertTrue(os.path.exists(self.journal_file +
+                                       journal_funcs.STALE_SUFFIX))
+
+class EtymValidation(unittest.TestCase):
+    """ Tests for the validation policies of loadDB """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        self.bad_file = os.path.join(self.tmp_dir, 'bad.xml')
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+        # A word without a def doesn't follow the DTD
+        with open(global_opts.WORDS_FILE, 'r') as f:
+            data = f.read()
+        with open(self.bad_file, 'w') as f:
+            f.write(data.replace('<def>A man-eating beast</def>', '', 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testValidateLoad(self):
+        """ Tests validating at load """
+        for streaming in [False, True]:
+            db = cf.loadDB(self.db_file, streaming=streaming, snapshot=False)
+            report = validation_funcs.getReport(db)
+            self.assertEqual(report.mode, 'load')
+            self.assertEqual(report.trees, cf.countTrees(db))
+            self.assertTrue(report.seconds > 0)
+            self.assertRaises(cf.EtymExceptDB, cf.loadDB, self.bad_file,
+                              streaming=streaming)
+
+    def testValidateSave(self):
+        """ Tests validating at save """
+        db = cf.loadDB(self.bad_file, validation='save')
+        self.assertEqual(validation_funcs.getReport(db).trees, 0)
+        self.assertRaises(cf.EtymExceptDB, cf.saveDB, db, self.db_file)
+        self.assertEqual(ET.tostring(cf.loadDB(self.db_file)),
+                         ET.tostring(cf.loadDB(global_opts.WORDS_FILE)))
+        db = cf.loadDB(self.db_file, validation='save')
+        cf.deleteTree(cf.searchDB(db, 'bios')[1][0][0])
+        cf.saveDB(db, self.db_file)
+        self.assertEqual(validation_funcs.getReport(db).trees,
+                         cf.countTrees(db) - 1)
+
+    def testValidateNone(self):
+        """ Tests skipping validation """
+        db = cf.loadDB(self.bad_file, validation='none')
+        self.assertEqual(validation_funcs.getReport(db).seconds, 0)
+        self.assertEqual(cf.searchDB(db, 'hors')[0], 1)
+        self.assertRaises(cf.EtymExceptDB, cf.loadDB, self.db_file,
+                          validation='sometimes')
+
+    def testValidateBackground(self):
+        """ Tests validating in the background """
+        db = cf.loadDB(self.bad_file, validation='background')
+        report = validation_funcs.getReport(db)
+        report.done.wait()
+        self.assertEqual(report.trees, cf.countTrees(db))
+        self.assertEqual(len(report.errors), 1)
+        db = cf.loadDB(self.db_file, validation='background', sample=0.5)
+        report = validation_funcs.getReport(db)
+        report.done.wait()
+        self.assertEqual(report.trees, 3)
+        self.assertEqual(report.errors, [])
+
+    def testCheckDB(self):
+        """ Tests the read-only check of a whole database """
+        for db in [self.db_file, cf.loadDB(self.db_file, snapshot=False)]:
+            self.assertEqual(validation_funcs.checkDB(db), [])
+        bad_db = cf.loadDB(self.bad_file, validation='none')
+        before = ET.tostring(bad_db)
+        for db in [self.bad_file, bad_db]:
+            errors = validation_funcs.checkDB(db)
+            self.assertEqual(len(errors), 1)
+            self.assertTrue('"def"' in errors[0])
+        self.assertEqual(ET.tostring(bad_db), before)
+        # Out of order details, and an emptied tree
+        db = cf.loadDB(self.db_file, snapshot=False)
+        word = cf.searchDB(db, 'horse')[1][0][1]
+        word.append(word.find('lang'))
+        cf.deleteTree(cf.searchDB(db, 'bios')[1][0][0])
+        errors = validation_funcs.checkDB(db)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('word "horse"'))
+        cf.normalizeWord(word)
+        self.assertEqual(validation_funcs.checkDB(db), [])
+
+class EtymShards(unittest.TestCase):
+    """ Tests for a db split into shards under a manifest """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tmp_dir, 'words.manifest')
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+        self.shard_files = ['shards/a.xml', 'shards/b.xml', 'shards/c.xml']
+        os.mkdir(os.path.join(self.tmp_dir, 'shards'))
+        trees = list(self.db.getroot())
+        for num, shard_file in enumerate(self.shard_files):
+            with open(os.path.join(self.tmp_dir, shard_file), 'wb') as f:
+                cf.writeDB(self.db, f, trees[2*num:2*num+2])
+        with open(self.manifest, 'w') as f:
+            f.write('# Test shards\n' + '\n'.join(self.shard_files) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def readShards(self):
+        """ Returns the contents of each shard file """
+        contents = []
+        for shard_file in self.shard_files:
+            with open(os.path.join(self.tmp_dir, shard_file), 'rb') as f:
+                contents.append(f.read())
+        return contents
+
+    def testShardLoad(self):
+        """ Tests the merged shards give the same db """
+        # The pool is capped at the number of CPUs, pretend there are
+        # enough of them to run it
+        cpu_count = shard_funcs.multiprocessing.cpu_count
+        shard_funcs.multiprocessing.cpu_count = lambda: 3
+        try:
+            dbs = []
+            for processes in [1, 3]:
+                report = validation_funcs.ValidationReport('load')
+                dbs.append(shard_funcs.loadShards(self.manifest, report,
+                                                  processes))
+                self.assertEqual(report.trees, 6)
+        finally:
+            shard_funcs.multiprocessing.cpu_count = cpu_count
+        index = index_funcs.getIndex(dbs[1].getroot())
+        self.assertTrue(isinstance(index._base, shard_funcs.ShardPostings))
+        for db in dbs:
+            self.assertEqual(ET.tostring(db.getroot()),
+                             ET.tostring(self.db.getroot()))
+            self.assertEqual(cf.searchDB(db, 'WAIT', mode='normal')[0],
+                             cf.searchDB(self.db, 'WAIT', mode='normal')[0])
+            for field in ['text', 'morpheme']:
+                values = set(child.text for child in
+                             self.db.getroot().iter(field))
+                for search_word in values:
+                    num_trees, matched_words = cf.searchDB(db, search_word,
+                                                           field)
+                    self.assertEqual([ET.tostring(word) for tree, word in
+                                      matched_words],
+                                     [ET.tostring(word) for tree, word in
+                                      cf.searchDB(self.db, search_word,
+                                                  field)[1]])
+        # A bad shard fails the load
+        with open(os.path.join(self.tmp_dir, self.shard_files[1]), 'w') as f:
+            f.write('<etym>')
+        self.assertRaises(cf.EtymExceptDB, cf.loadDB, self.manifest)
+
+    def testShardSave(self):
+        """ Tests saving rewrites only the changed shards """
+        db = cf.loadDB(self.manifest)
+        old_shards = self.readShards()
+        word = cf.searchDB(db, 'biology')[1][0][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['def'] = 'The study of life'
+        cf.editWordDetails(word, word_dets)
+        # Only the edited shard is written out
+        written = []
+        writeDB = cf.writeDB
+        def countWrites(words_db, f, trees=None):
+            written.append(trees)
+            writeDB(words_db, f, trees)
+        cf.writeDB = countWrites
+        try:
+            cf.saveDB(db, self.manifest)
+            self.assertEqual(written, [list(db.getroot())[:2]])
+            cf.saveDB(db, self.manifest)
+            self.assertEqual(len(written), 1)
+        finally:
+            cf.writeDB = writeDB
+        new_shards = self.readShards()
+        self.assertNotEqual(new_shards[0], old_shards[0])
+        self.assertEqual(new_shards[1:], old_shards[1:])
+        self.assertEqual(ET.tostring(cf.loadDB(self.manifest).getroot()),
+                         ET.tostring(db.getroot()))
+
+        # New trees go to the last shard, an emptied shard is dropped
+        word_dets = {'text': ['foo'], 'morpheme': 'foo', 'lang': 'English',
+                     'def': 'A foo'}
+        cf.addTree(db, dict(word_dets), [cf.createWord(word_dets)])
+        for tree in list(db.getroot())[2:4]:
+            cf.deleteTree(tree)
+        cf.saveDB(db, self.manifest)
+        self.assertEqual(shard_funcs.readManifest(self.manifest),
+                         [self.shard_files[0], self.shard_files[2]])
+        self.assertEqual(self.readShards()[0], new_shards[0])
+        new_db = cf.loadDB(self.manifest)
+        self.assertEqual(cf.countTrees(new_db), 5)
+        self.assertEqual(cf.searchDB(new_db, 'foo')[1][0][0],
+                         new_db.getroot()[-1])
+
+class EtymFuzzy(unittest.TestCase):
+    """ Tests for the fuzzy search """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def testEditDistance(self):
+        """ Tests the edit distance """
+        self.assertEqual(fuzzy_funcs.editDistance('hors', 'horse'), 1)
+        self.assertEqual(fuzzy_funcs.editDistance('kitten', 'sitting'), 3)
+        self.assertEqual(fuzzy_funcs.editDistance('', 'ros'), 3)
+
+    def testFuzzySearch(self):
+        """ Tests fuzzy matches are ranked, best first """
+        num_trees, matched_words = cf.searchDB(self.db, 'horss',
+                                               mode='fuzzy')
+        texts = [cf.loadWordDetails(word)['text'] for tree, word in
+                 matched_words]
+        self.assertTrue('horsse' in texts[0])
+        self.assertTrue(['horse'] in texts)
+        self.assertEqual(len(matched_words), len(set(word for tree, word
+                                                     in matched_words)))
+        # An exact match comes first
+        num_trees, matched_words = cf.searchDB(self.db, 'biology',
+                                               mode='fuzzy')
+        self.assertEqual(matched_words[:2], cf.searchDB(self.db,
+                                                        'biology')[1])
+        self.assertEqual(cf.searchDB(self.db, 'qqqq', mode='fuzzy'),
+                         (0, []))
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB, self.db, 'ros',
+                          mode='sloppy')
+
+    def testFuzzyEdits(self):
+        """ Tests the trigram index follows edits """
+        self.assertEqual(cf.searchDB(self.db, 'zebraa', mode='fuzzy')[0], 0)
+        word = cf.searchDB(self.db, 'ros')[1][0][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = ['zebra']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(cf.searchDB(self.db, 'zebraa', mode='fuzzy')[1],
+                         [(cf.findRoot(word), word)])
+        cf.deleteWord(word)
+        self.assertEqual(cf.searchDB(self.db, 'zebraa', mode='fuzzy')[0], 0)
+
+    def testFuzzyBackends(self):
+        """ Tests the lazy and SQLite backends give the same matches """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db.close()
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            for db in [cf.loadDB(db_file, lazy=True), sqlite_db]:
+                for search_word in ['horss', 'wisen', 'pork']:
+                    self.assertEqual([cf.loadWordDetails(word) for tree, word
+                                      in cf.searchDB(db, search_word,
+                                                     mode='fuzzy')[1]],
+                                     [cf.loadWordDetails(word) for tree, word
+                                      in cf.searchDB(self.db, search_word,
+                                                     mode='fuzzy')[1]])
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymNormal(unittest.TestCase):
+    """ Tests for the normalised search """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def testSearchKey(self):
+        """ Tests the search keys """
+        searchKey = cf.index_funcs.searchKey
+        self.assertEqual(searchKey('*ekwo-'), 'ekwo')
+        self.assertEqual(searchKey(u'*hiékwos'), u'hiekwos')
+        self.assertEqual(searchKey('Horse'), 'horse')
+        self.assertEqual(searchKey(u'hróss'.encode('utf-8')), u'hross')
+        self.assertEqual(searchKey(None), None)
+
+    def testNormalSearch(self):
+        """ Tests normalised searches, including the tree roots """
+        num_trees, matched_words = cf.searchDB(self.db, 'WAIT', mode='normal')
+        self.assertEqual(num_trees, 1)
+        self.assertEqual([cf.loadWordDetails(word)['lang'] for tree, word in
+                          matched_words], ['Old Germanic', 'Gothic'])
+        self.assertEqual(cf.searchDB(self.db, 'wait')[0], 1)
+        # The tree roots are found too
+        self.assertEqual(cf.searchDB(self.db, 'khursa')[0], 0)
+        for search_word in [u'hiekwos', '*EKWO-', 'ekwo']:
+            num_trees, matched_words = cf.searchDB(self.db, search_word,
+                                                   mode='normal')
+            self.assertEqual(num_trees, 1)
+            tree, word = matched_words[0]
+            self.assertTrue(tree is word)
+            self.assertEqual(cf.loadWordDetails(tree)['text'],
+                             ['*ekwo-', u'*hiékwos'])
+        num_trees, matched_words = cf.searchDB(self.db, 'woid',
+                                               field='morpheme', mode='normal')
+        self.assertEqual(cf.checkNode(matched_words[0][1]), 'tree')
+        self.assertEqual(cf.searchDB(self.db, 'qqqq', mode='normal'), (0, []))
+
+    def testNormalEdits(self):
+        """ Tests the search keys follow edits """
+        self.assertEqual(cf.searchDB(self.db, 'zebra', mode='normal')[0], 0)
+        tree, word = cf.searchDB(self.db, 'ros')[1][0]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = [u'Zébra']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(cf.searchDB(self.db, 'zebra', mode='normal')[1],
+                         [(tree, word)])
+        tree_dets = cf.loadWordDetails(tree)
+        tree_dets['text'] = ['*zebra-']
+        cf.editWordDetails(tree, tree_dets)
+        self.assertEqual(cf.searchDB(self.db, 'zebra', mode='normal')[1],
+                         [(tree, tree), (tree, word)])
+        self.assertEqual(cf.searchDB(self.db, 'khursa', mode='normal')[0], 0)
+        cf.deleteTree(tree)
+        self.assertEqual(cf.searchDB(self.db, 'zebra', mode='normal')[0], 0)
+
+    def testNormalBackends(self):
+        """ Tests the other backends give the same matches """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            cf.loadDB(db_file)
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            for db in [cf.loadDB(db_file, lazy=True), sqlite_db,
+                       cf.loadDB(db_file)]:
+                for search_word in ['wait', u'hiekwos', 'WID', 'ros']:
+                    self.assertEqual([cf.loadWordDetails(word) for tree, word
+                                      in cf.searchDB(db, search_word,
+                                                     mode='normal')[1]],
+                                     [cf.loadWordDetails(word) for tree, word
+                                      in cf.searchDB(self.db, search_word,
+                                                     mode='normal')[1]])
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymComplete(unittest.TestCase):
+    """ Tests for completing the start of a word """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def testPrefixIndex(self):
+        """ Tests the sorted prefix index """
+        index = prefix_funcs.PrefixIndex(['ros', 'hross', 'hros', 'horse',
+                                          'ros', None])
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.complete('hr'), ['hros', 'hross'])
+        self.assertEqual(index.complete('h', limit=2), ['horse', 'hros'])
+        index.add('hrossa')
+        index.add('hrossa')
+        index.remove('hros')
+        index.remove('zebra')
+        self.assertEqual(index.complete('hr'), ['hross', 'hrossa'])
+        self.assertEqual(index.complete('x'), [])
+
+    def testCompleteDB(self):
+        """ Tests completions from the database """
+        self.assertEqual(cf.completeDB(self.db, 'hr'), ['hros', 'hross'])
+        self.assertEqual(cf.completeDB(self.db, 'HOR', limit=3),
+                         ['horce', 'horis', 'hors'])
+        self.assertEqual(cf.completeDB(self.db, 'wait'), ['wait', 'wait-'])
+        self.assertEqual(cf.completeDB(self.db, 'hi', field='morpheme'),
+                         ['hippos'])
+        self.assertRaises(cf.EtymExceptDB, cf.completeDB, self.db, 'h',
+                          field='def')
+
+    def testCompleteEdits(self):
+        """ Tests the prefix index follows edits """
+        self.assertEqual(cf.completeDB(self.db, 'zeb'), [])
+        word = cf.searchDB(self.db, 'hross')[1][0][1]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = [u'Zébra', 'zebu']
+        cf.editWordDetails(word, word_dets)
+        self.assertEqual(cf.completeDB(self.db, 'zeb'), [u'Zébra', 'zebu'])
+        self.assertEqual(cf.completeDB(self.db, 'hr'), ['hros'])
+        cf.deleteWord(word)
+        self.assertEqual(cf.completeDB(self.db, 'zeb'), [])
+
+    def testCompleteBackends(self):
+        """ Tests the other backends give the same completions """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            cf.loadDB(db_file)
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            for db in [cf.loadDB(db_file, lazy=True), sqlite_db,
+                       cf.loadDB(db_file)]:
+                for prefix in ['h', 'wi', 'R', 'qq']:
+                    self.assertEqual(cf.completeDB(db, prefix),
+                                     cf.completeDB(self.db, prefix))
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymVariants(unittest.TestCase):
+    """ Tests for the variant spellings """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def testExpand(self):
+        """ Tests expanding the variant notations """
+        self.assertEqual(variant_funcs.expand('(z)un'), ['(z)un', 'zun', 'un'])
+        self.assertEqual(variant_funcs.expand('ros, hros'),
+                         ['ros, hros', 'ros', 'hros'])
+        self.assertEqual(variant_funcs.expand('wi(z)(z)un'),
+                         ['wi(z)(z)un', 'wiz(z)un', 'wi(z)un', 'wizzun',
+                          'wizun', 'wiun'])
+        self.assertEqual(variant_funcs.expand('a(b),c'),
+                         ['a(b),c', 'a(b)', 'c', 'ab,c', 'a,c', 'ab', 'a'])
+        self.assertEqual(variant_funcs.expand('horse'), ['horse'])
+        self.assertEqual(len(variant_funcs.expand('(a)' * 10)),
+                         variant_funcs.MAX_SPELLINGS)
+        # A rule without a trigger is tried on every value
+        rule = lambda value: [value.upper()]
+        variant_funcs.addRule(rule)
+        try:
+            self.assertEqual(variant_funcs.expand('ros'), ['ros', 'ROS'])
+        finally:
+            variant_funcs.removeRule(rule)
+        self.assertEqual(variant_funcs.expand('ros'), ['ros'])
+
+    def testVariantSearch(self):
+        """ Tests the spellings of a value are found by a normal search """
+        for search_word in ['wizun', 'wizzun', 'giwizan', 'wizumes']:
+            num_trees, matched_words = cf.searchDB(self.db, search_word,
+                                                   mode='normal')
+            self.assertEqual([cf.loadWordDetails(word)['lang'] for tree, word
+                              in matched_words], ['Old High German'])
+        self.assertEqual(cf.searchDB(self.db, 'wizun')[0], 0)
+        # The word holding 'wizan' and '(gi)wizan' is listed once
+        self.assertEqual(len(cf.searchDB(self.db, 'wizan',
+                                         mode='normal')[1]), 1)
+
+    def testVariantEdits(self):
+        """ Tests the spellings follow edits """
+        tree, word = cf.searchDB(self.db, 'hross')[1][0]
+        word_dets = cf.loadWordDetails(word)
+        word_dets['text'] = ['(z)ebra, zebu']
+        cf.editWordDetails(word, word_dets)
+        for search_word in ['zebra', 'ebra', 'zebu']:
+            self.assertEqual(cf.searchDB(self.db, search_word,
+                                         mode='normal')[1], [(tree, word)])
+        self.assertEqual(cf.searchDB(self.db, 'hross', mode='normal')[0], 0)
+        cf.deleteWord(word)
+        self.assertEqual(cf.searchDB(self.db, 'ebra', mode='normal')[0], 0)
+
+    def testAddRule(self):
+        """ Tests a rule added for an orthographic alternation """
+        rule = variant_funcs.alternationRule('zz', 'ss')
+        variant_funcs.addRule(rule, variant_funcs.alternationTrigger('zz',
+                                                                     'ss'))
+        try:
+            db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+            self.assertEqual([cf.loadWordDetails(word)['lang'] for tree, word
+                              in cf.searchDB(db, 'wissen', mode='normal')[1]],
+                             ['Middle High German', '(Modern High) German'])
+            self.assertEqual(cf.searchDB(db, 'wissun', mode='normal')[0], 1)
+        finally:
+            variant_funcs.removeRule(rule)
+        self.assertEqual([cf.loadWordDetails(word)['lang'] for tree, word
+                          in cf.searchDB(self.db, 'wissen', mode='normal')[1]],
+                         ['(Modern High) German'])
+
+class EtymSearchMany(unittest.TestCase):
+    """ Tests for searching many words at once """
+    search_words = ['ros', 'horse', 'biology', 'hors', 'qqqq', 'ros', 'wizan']
+
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def details(self, results):
+        """ Returns results with the details of each word """
+        return dict((search_word, (num_trees, [cf.loadWordDetails(word) for
+                                               tree, word in matched_words]))
+                    for search_word, (num_trees, matched_words) in
+                    results.iteritems())
+
+    def testSearchMany(self):
+        """ Tests the results match those of searchDB() """
+        results = cf.searchDB_many(self.db, self.search_words)
+        self.assertEqual(sorted(results), sorted(set(self.search_words)))
+        for search_word in self.search_words:
+            self.assertEqual(results[search_word],
+                             cf.searchDB(self.db, search_word))
+        results = cf.searchDB_many(self.db, ['Ros', 'ekwo'], mode='normal')
+        self.assertEqual(results['ekwo'][0], 1)
+        self.assertEqual(results['Ros'], cf.searchDB(self.db, 'ros',
+                                                     mode='normal'))
+        self.assertEqual(cf.searchDB_many(self.db, []), {})
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB_many, self.db,
+                          ['ros'], field='def')
+
+    def testScanMany(self):
+        """ Tests a single scan of the file finds the same words """
+        results = cf.scanDB_many(global_opts.WORDS_FILE, self.search_words)
+        self.assertEqual(self.details(results), self.details(
+            cf.searchDB_many(self.db, self.search_words)))
+        results = cf.scanDB_many(global_opts.WORDS_FILE, ['hippos'],
+                                 field='morpheme')
+        self.assertEqual(results['hippos'][0], 1)
+
+    def testSearchManyBackends(self):
+        """ Tests the lazy and SQLite backends give the same results """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            expected = self.details(cf.searchDB_many(self.db,
+                                                     self.search_words))
+            for db in [cf.loadDB(db_file, lazy=True), sqlite_db]:
+                self.assertEqual(self.details(cf.searchDB_many(
+                    db, self.search_words)), expected)
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymRegex(unittest.TestCase):
+    """ Tests for the regular expression search """
+    patterns = [('^hr?os', 'text'), ('.*ology$', 'text'), (r'^\*', 'text'),
+                ('^wit', 'morpheme'), ('^A horse', 'def')]
+
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def scan(self, pattern, field):
+        """ Returns the matches of pattern found by walking the database """
+        matches = []
+        for tree in self.db.getroot().iterchildren(tag='tree'):
+            for node in tree.iter('tree', 'word'):
+                if any(re.search(pattern, child.text, re.UNICODE) for child
+                       in node.iterchildren(tag=field)):
+                    matches.append((tree, node))
+        return matches
+
+    def testRegexSearch(self):
+        """ Tests the matches against a walk over the database """
+        for pattern, field in self.patterns:
+            num_trees, matched_words = cf.searchDB(self.db, pattern, field,
+                                                   mode='regex')
+            self.assertEqual(matched_words, self.scan(pattern, field))
+            self.assertEqual(num_trees, len(set(tree for tree, word in
+                                                matched_words)))
+        self.assertEqual([cf.loadWordDetails(word)['text'] for tree, word in
+                          cf.searchDB(self.db, '^hr?os$', mode='regex')[1]],
+                         [['horse', 'hors', 'horce', 'horsse', 'horis', 'hos',
+                           'ors'], ['ros', 'hros']])
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB, self.db, '(hros',
+                          mode='regex')
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB, self.db, 'A horse',
+                          'def')
+
+    def testRegexProcesses(self):
+        """ Tests a pool of processes finds the same matches """
+        trees = list(self.db.getroot().iterchildren(tag='tree'))
+        for pattern, field in self.patterns:
+            self.assertEqual(regex_funcs.searchTrees(trees, pattern, field,
+                                                     processes=3),
+                             self.scan(pattern, field))
+
+    def testRegexBackends(self):
+        """ Tests the lazy and SQLite backends give the same matches """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            for db in [cf.loadDB(db_file, lazy=True), sqlite_db]:
+                for pattern, field in self.patterns:
+                    self.assertEqual([cf.loadWordDetails(word) for tree, word
+                                      in cf.searchDB(db, pattern, field,
+                                                     mode='regex')[1]],
+                                     [cf.loadWordDetails(word) for tree, word
+                                      in self.scan(pattern, field)])
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymFullText(unittest.TestCase):
+    """ Tests for the full-text search of the definitions """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE)
+
+    def defs(self, query, field='def'):
+        """ Returns the defs of the words best matching query """
+        return [word.findtext('def') for tree, word in
+                cf.searchDB(self.db, query, field, mode='fulltext')[1]]
+
+    def testTextIndex(self):
+        """ Tests the BM25 ranking of a TextIndex """
+        texts = text_funcs.TextIndex()
+        texts.add(1, u'A pig')
+        texts.add(2, u'A pig, a pig')
+        texts.add(3, u'A horse')
+        self.assertEqual(len(texts), 3)
+        self.assertEqual([doc for score, doc in texts.search('pig')], [2, 1])
+        self.assertEqual([doc for score, doc in texts.search('horse pig',
+                                                             limit=1)], [3])
+        self.assertEqual(texts.search('cow'), [])
+        texts.remove(2, u'A pig, a pig')
+        self.assertEqual([doc for score, doc in texts.search('PIG')], [1])
+        self.assertEqual(text_funcs.tokenize(u'A man-eating b\xeate'),
+                         ['a', 'man', 'eating', 'bete'])
+
+    def testFullTextSearch(self):
+        """ Tests the words are ranked by their definitions """
+        self.assertEqual(self.defs('animal'), ['Some kinda animal'])
+        self.assertEqual(self.defs('man-eating')[0], 'A man-eating beast')
+        self.assertEqual(self.defs('pig masculine')[:2],
+                         ['A masculine pig', 'A pig, especially masculine'])
+        self.assertEqual(len(self.defs('pig')),
+                         len(cf.searchDB(self.db, r'\bpig\b', 'def',
+                                         mode='regex')[1]))
+        self.assertEqual(cf.searchDB(self.db, 'unicorn', 'def',
+                                     mode='fulltext'), (0, []))
+        self.assertEqual(set(self.defs('middle high german', 'lang')[:2]),
+                         set(['Eines infizierten Tieres', 'A pig of some sort']))
+        self.assertRaises(cf.EtymExceptDB, cf.searchDB, self.db, 'pig',
+                          'text', mode='fulltext')
+
+    def testFullTextEdit(self):
+        """ Tests the index follows edits of the definitions """
+        self.assertEqual(self.defs('animal'), ['Some kinda animal'])
+        tree, word = cf.searchDB(self.db, 'biology')[1][0]
+        details = cf.loadWordDetails(word)
+        details['def'] = 'A study of animal life'
+        cf.editWordDetails(word, details)
+        self.assertEqual(self.defs('animal'), ['Some kinda animal',
+                                               'A study of animal life'])
+        cf.deleteTree(self.db.getroot().find('tree'))
+        self.assertEqual(self.defs('animal'), ['A study of animal life'])
+
+    def testFullTextBackends(self):
+        """ Tests the SQLite backend ranks the same, the lazy one can't """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            self.assertRaises(cf.EtymExceptDB, cf.searchDB,
+                              cf.loadDB(db_file, lazy=True), 'pig', 'def',
+                              mode='fulltext')
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            for query in ['animal', 'pig masculine', 'horse', 'pig']:
+                self.assertEqual([cf.loadWordDetails(word) for tree, word in
+                                  cf.searchDB(sqlite_db, query, 'def',
+                                              mode='fulltext')[1]],
+                                 [cf.loadWordDetails(word) for tree, word in
+                                  cf.searchDB(self.db, query, 'def',
+                                              mode='fulltext')[1]])
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymCache(unittest.TestCase):
+    """ Tests for the search result cache """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+        self.cache = cache_funcs.getCache(self.db)
+
+    def testCacheStats(self):
+        """ Tests repeated searches are hits """
+        first = cf.searchDB(self.db, 'horse')
+        self.assertEqual(cf.searchDB(self.db, 'horse'), first)
+        cf.searchDB(self.db, 'horse', mode='normal')
+        cf.searchDB(self.db, 'HORSE', mode='normal')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (2, 2, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertTrue(cache_funcs.getCache(self.db) is self.cache)
+        # The caller gets a copy of the cached result
+        cf.searchDB(self.db, 'horse')[1].pop()
+        self.assertEqual(cf.searchDB(self.db, 'horse'), first)
+
+    def testCacheEdit(self):
+        """ Tests an edit makes the cached results stale """
+        num_trees, matched_words = cf.searchDB(self.db, 'horse')
+        self.assertEqual(num_trees, 1)
+        tree, word = matched_words[0]
+        details = cf.loadWordDetails(word)
+        details['text'] = ['steed']
+        cf.editWordDetails(word, details)
+        self.assertEqual(cf.searchDB(self.db, 'steed'), (1, [(tree, word)]))
+        self.assertEqual(len(cf.searchDB(self.db, 'horse')[1]),
+                         len(matched_words) - 1)
+        self.assertEqual(self.cache.hits, 0)
+        cf.deleteTree(tree)
+        self.assertEqual(cf.searchDB(self.db, 'steed'), (0, []))
+
+    def testCacheLRU(self):
+        """ Tests the least recently used result is dropped """
+        cache = cache_funcs.ResultCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual((cache.get('b'), cache.get('a'), cache.get('c')),
+                         (None, 1, 3))
+        self.assertEqual(len(cache), 2)
+        cache_funcs.newGeneration()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+class EtymLanguage(unittest.TestCase):
+    """ Tests for the language table and the per-language queries """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+
+    def scan(self, lang):
+        """ Returns the (tree, word) in lang found by walking the database """
+        return [(tree, node) for tree in self.db.getroot().iterchildren()
+                for node in tree.iter('tree', 'word')
+                if node.findtext('lang') == lang]
+
+    def testIterLanguage(self):
+        """ Tests the words of a language, in document order """
+        for lang in ['Old English', 'PIE', 'Modern English', 'Klingon']:
+            self.assertEqual(list(cf.iterLanguage(self.db, lang)),
+                             self.scan(lang))
+        counts = cf.countLanguages(self.db)
+        self.assertEqual(counts['Old English'], len(self.scan('Old English')))
+        self.assertEqual(sum(counts.values()),
+                         len(list(self.db.getroot().iter('tree', 'word'))))
+
+    def testUnder(self):
+        """ Tests limiting the words to the descendants of some words """
+        trees = [word for tree, word in cf.iterLanguage(self.db, 'PIE')]
+        self.assertEqual(list(cf.iterLanguage(self.db, 'Modern English',
+                                              trees)),
+                         self.scan('Modern English'))
+        self.assertEqual(list(cf.iterLanguage(self.db, 'Modern English',
+                                              trees[0])),
+                         [match for match in self.scan('Modern English')
+                          if match[0] is trees[0]])
+        tree, word = cf.searchDB(self.db, 'hros')[1][0]
+        self.assertEqual([cf.loadWordDetails(match[1])['text'] for match in
+                          cf.iterLanguage(self.db, 'Middle High German',
+                                          word)], [['ros']])
+
+    def testLanguageEdit(self):
+        """ Tests the language table follows the edits """
+        tree, word = cf.searchDB(self.db, 'horse')[1][0]
+        details = cf.loadWordDetails(word)
+        details['lang'] = 'Klingon'
+        cf.editWordDetails(word, details)
+        self.assertEqual(list(cf.iterLanguage(self.db, 'Klingon')),
+                         [(tree, word)])
+        self.assertEqual(list(cf.iterLanguage(self.db, 'Middle English')),
+                         self.scan('Middle English'))
+        num_pie = cf.countLanguages(self.db)['PIE']
+        cf.deleteTree(tree)
+        self.assertEqual(list(cf.iterLanguage(self.db, 'Klingon')), [])
+        self.assertEqual(cf.countLanguages(self.db)['PIE'], num_pie - 1)
+
+    def testLanguageBackends(self):
+        """ Tests the snapshot, lazy and SQLite databases agree """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, 'words.xml')
+            shutil.copy(global_opts.WORDS_FILE, db_file)
+            cf.loadDB(db_file)
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            expected = [cf.loadWordDetails(word) for tree, word in
+                        self.scan('Modern English')]
+            for db in [cf.loadDB(db_file), cf.loadDB(db_file, lazy=True),
+                       sqlite_db]:
+                self.assertEqual([cf.loadWordDetails(word) for tree, word in
+                                  cf.iterLanguage(db, 'Modern English')],
+                                 expected)
+                self.assertEqual(cf.countLanguages(db),
+                                 cf.countLanguages(self.db))
+            pie = [word for tree, word in cf.iterLanguage(sqlite_db, 'PIE')]
+            self.assertEqual(len(list(cf.iterLanguage(sqlite_db, 'Greek',
+                                                      pie[1:2]))), 1)
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymAncestry(unittest.TestCase):
+    """ Tests for the ancestry labels behind isDescendant and findRoot """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+        self.nodes = list(self.db.getroot().iter('tree', 'word'))
+
+    def checkAncestry(self):
+        """ Checks every pair of nodes against a walk up the tree """
+        root = self.db.getroot()
+        nodes = [node for node in self.nodes
+                 if root in node.iterancestors()]
+        for node in nodes:
+            self.assertTrue(cf.findRoot(node) is (node if node.tag == 'tree'
+                    else next(node.iterancestors('tree'))))
+            ancestors = set([node]) | set(node.iterancestors())
+            for source in nodes:
+                self.assertEqual(cf.isDescendant(source, node),
+                                 source in ancestors)
+
+    def testAncestry(self):
+        """ Tests the labels of a loaded database """
+        self.checkAncestry()
+        index = index_funcs.getIndex(self.db.getroot())
+        tree = self.db.getroot()[0]
+        word = tree.find('word/word')
+        tree_label, word_label = index.label(tree), index.label(word)
+        self.assertTrue(tree_label[0] is word_label[0] is tree)
+        self.assertTrue(tree_label[1] < word_label[1] < word_label[2] <
+                        tree_label[2])
+
+    def testAncestryEdit(self):
+        """ Tests the labels follow the edits moving words around """
+        self.checkAncestry()
+        trees = self.db.getroot().findall('tree')
+        word = trees[0].find('word/word')
+        cf.moveWord(word, trees[1].find('word'))
+        self.assertTrue(cf.findRoot(word) is trees[1])
+        self.assertFalse(cf.isDescendant(trees[0], word))
+        self.checkAncestry()
+        cf.deleteWord(trees[2].find('word'))
+        cf.editWordParent(trees[3].find('word'), None)
+        cf.deleteTree(trees[4])
+        self.checkAncestry()
+        new_word = cf.createWord({'lang': 'Modern English', 'text': ['new'],
+                                  'morpheme': 'new', 'def': 'New'},
+                                 word_parent=word)
+        self.nodes.append(new_word)
+        self.assertTrue(cf.isDescendant(trees[1], new_word))
+        self.checkAncestry()
+
+class EtymRelation(unittest.TestCase):
+    """ Tests for the common ancestor and the path between two words """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+
+    def walkAncestor(self, word, other):
+        """ Returns the common ancestor found by walking up the tree """
+        ancestors = [word] + list(word.iterancestors('word', 'tree'))
+        for ancestor in [other] + list(other.iterancestors('word', 'tree')):
+            if ancestor in ancestors:
+                return ancestor
+        return None
+
+    def texts(self, path):
+        """ Returns the first text of each word of path """
+        return [cf.loadWordDetails(word)['text'][0] for word in path]
+
+    def testTreeLCA(self):
+        """ Tests the sparse table against walking up every pair """
+        for tree in self.db.getroot().iterchildren(tag='tree'):
+            lca = lca_funcs.TreeLCA(tree)
+            nodes = list(tree.iter('tree', 'word'))
+            for node in nodes:
+                self.assertTrue(node in lca)
+                for other in nodes:
+                    self.assertTrue(lca.ancestor(node, other) is
+                                    self.walkAncestor(node, other))
+
+    def testRelationPath(self):
+        """ Tests the path between horse and hross """
+        horse = cf.searchDB(self.db, 'horse')[1][1][1]
+        hross = cf.searchDB(self.db, 'hross')[1][0][1]
+        ancestor = lca_funcs.commonAncestor(horse, hross)
+        self.assertTrue(ancestor is cf.findRoot(horse))
+        self.assertEqual(self.texts(lca_funcs.relationPath(horse, hross)),
+                         ['horse', 'horse', 'hors', 'khursa', 'hross'])
+        self.assertEqual(self.texts(lca_funcs.relationPath(hross, hross)),
+                         ['hross'])
+        parent = cf.loadWordParents(horse)
+        self.assertTrue(lca_funcs.commonAncestor(horse, parent) is parent)
+        self.assertEqual(self.texts(lca_funcs.relationPath(parent, horse)),
+                         ['horse', 'horse'])
+        biology = cf.searchDB(self.db, 'biology')[1][0][1]
+        self.assertEqual(lca_funcs.commonAncestor(horse, biology), None)
+        self.assertEqual(lca_funcs.relationPath(horse, biology), None)
+
+    def testRelationEdit(self):
+        """ Tests the ancestors follow the edits """
+        horse = cf.searchDB(self.db, 'horse')[1][1][1]
+        hross = cf.searchDB(self.db, 'hross')[1][0][1]
+        self.assertTrue(lca_funcs.commonAncestor(horse, hross) is
+                        cf.findRoot(hross))
+        cf.moveWord(hross, horse)
+        self.assertTrue(lca_funcs.commonAncestor(horse, hross) is horse)
+        self.assertEqual(self.texts(lca_funcs.relationPath(hross, horse)),
+                         ['hross', 'horse'])
+        cf.editWordParent(hross, None)
+        self.assertEqual(lca_funcs.commonAncestor(horse, hross), None)
+
+    def testRelationSQLite(self):
+        """ Tests the SQLite backend gives the same path """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cf.saveDB(self.db, os.path.join(tmp_dir, 'words.sqlite'))
+            sqlite_db = cf.loadDB(os.path.join(tmp_dir, 'words.sqlite'))
+            horse = cf.searchDB(sqlite_db, 'horse')[1][1][1]
+            ross = cf.searchDB(sqlite_db, 'ross')[1][0][1]
+            self.assertEqual(self.texts(lca_funcs.relationPath(horse, ross)),
+                             ['horse', 'horse', 'hors', 'khursa', 'ros',
+                              'ros', 'ross'])
+            sqlite_db.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class EtymTransaction(unittest.TestCase):
+    """ Tests for the edit transactions """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        self.journal_file = self.db_file + journal_funcs.JOURNAL_SUFFIX
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dumpDB(self, db):
+        """ Returns the XML that db would be saved as """
+        f = StringIO.StringIO()
+        cf.writeDB(db, f)
+        return f.getvalue()
+
+    def makeEdits(self, db):
+        """ Makes one edit of each kind to db, as EtymJournal does """
+        word_dets = {'text': ['NEW WORD'], 'morpheme': 'NEW WORD',
+                     'lang': 'UNKNOWN', 'def': 'Change me!'}
+        ros = cf.searchDB(db, 'ros')[1][1][1]
+        details = cf.loadWordDetails(ros)
+        details['text'] = ['rosy']
+        cf.editWordDetails(ros, details)
+        horse = cf.searchDB(db, 'horse')[1][0][1]
+        cf.moveWord(ros, horse)
+        cf.deleteWord(cf.searchDB(db, 'hors')[1][0][1])
+        cf.createWord(word_dets, word_parent=horse)
+        cf.deleteTree(cf.searchDB(db, 'bios')[1][0][0])
+        cf.addTree(db, {'text': ['NEW ROOT'], 'morpheme': 'NEW ROOT',
+                        'lang': 'UNKNOWN', 'def': 'Change me!'},
+                   [cf.createWord(word_dets)])
+
+    def searches(self, db):
+        """ Returns what a few searches give, as details """
+        return [[cf.loadWordDetails(word) for tree, word in
+                 cf.searchDB(db, search_word, mode=mode)[1]]
+                for search_word, mode in [('ros', 'exact'), ('hors', 'exact'),
+                                          ('bios', 'exact'), ('horse', 'normal'),
+                                          ('new word', 'normal')]]
+
+    def testCommit(self):
+        """ Tests the edits of a transaction are kept and journaled """
+        db = cf.loadDB(self.db_file, journal=True)
+        with cf.transaction():
+            self.makeEdits(db)
+            self.assertEqual(len(journal_funcs.getJournal(db)), 0)
+        self.assertEqual(len(journal_funcs.getJournal(db)), 6)
+        new_db = cf.loadDB(self.db_file, journal=True)
+        self.assertEqual(self.dumpDB(new_db), self.dumpDB(db))
+        self.assertEqual(self.searches(new_db), self.searches(db))
+
+    def testRollback(self):
+        """ Tests an exception undoes the edits of a transaction """
+        db = cf.loadDB(self.db_file, journal=True)
+        before = self.dumpDB(db)
+        searches = self.searches(db)
+        nodes = list(db.getroot().iter())
+        try:
+            with cf.transaction():
+                self.makeEdits(db)
+                raise ValueError('Undo')
+        except ValueError:
+            pass
+        self.assertEqual(self.dumpDB(db), before)
+        # The same elements are back in place, and indexed
+        self.assertEqual(list(db.getroot().iter()), nodes)
+        self.assertEqual(self.searches(db), searches)
+        self.assertEqual(self.searches(db), self.searches(cf.loadDB(
+            global_opts.WORDS_FILE, snapshot=False)))
+        self.assertEqual(len(journal_funcs.getJournal(db)), 0)
+        self.assertFalse(os.path.exists(self.journal_file))
+        # And the database can still be edited
+        self.makeEdits(db)
+        self.assertEqual(self.dumpDB(cf.loadDB(self.db_file, journal=True)),
+                         self.dumpDB(db))
+
+    def testValidation(self):
+        """ Tests each word is checked once, and a failed check undoes """
+        db = cf.loadDB(self.db_file, snapshot=False)
+        validate = cf.checkWord
+        checked = []
+        def countedValidate(word):
+            checked.append(word)
+            return validate(word)
+        cf.checkWord = countedValidate
+        try:
+            horse = cf.searchDB(db, 'horse')[1][0][1]
+            children = cf.searchDB(db, 'ros')[1] + cf.searchDB(db, 'hross')[1]
+            with cf.transaction() as transaction:
+                for tree, word in children:
+                    cf.moveWord(word, horse)
+                self.assertEqual(len(transaction), len(children) + 1)
+                self.assertEqual(checked, [])
+            self.assertEqual(len(checked), len(children) + 1)
+        finally:
+            cf.checkWord = validate
+        self.assertEqual([cf.loadWordParents(word) for tree, word in children],
+                         [horse] * len(children))
+
+        before = self.dumpDB(db)
+        hross = children[-1][1]
+        with self.assertRaises(cf.EtymExceptWord):
+            with cf.transaction():
+                cf.moveWord(hross, cf.findRoot(horse))
+                hross.remove(hross.find('lang'))
+        self.assertEqual(self.dumpDB(db), before)
+        self.assertTrue(cf.loadWordParents(hross) is horse)
+
+    def testNested(self):
+        """ Tests a transaction in another one is part of it """
+        db = cf.loadDB(self.db_file, snapshot=False)
+        before = self.dumpDB(db)
+        with self.assertRaises(ValueError):
+            with cf.transaction() as outer:
+                with cf.transaction() as inner:
+                    self.assertTrue(inner is outer)
+                    cf.deleteWord(cf.searchDB(db, 'hors')[1][0][1])
+                raise ValueError('Undo')
+        self.assertEqual(self.dumpDB(db), before)
+
+class EtymView(unittest.TestCase):
+    """ Tests for the word views behind loadWordDetails and friends """
+    def setUp(self):
+        self.db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+
+    def testView(self):
+        """ Tests a view matches its element, and is kept until an edit """
+        for word in self.db.getroot().iter('tree', 'word'):
+            view = view_funcs.getView(word)
+            self.assertTrue(view_funcs.getView(word) is view)
+            self.assertEqual(view.details(), {
+                    'lang': word.findtext('lang'), 'def': word.findtext('def'),
+                    'morpheme': word.findtext('morpheme'), 'tag': word.tag,
+                    'text': [text.text for text in word.findall('text')]})
+            self.assertEqual(list(view.children), word.findall('word'))
+            self.assertTrue(view.parent is word.getparent())
+        self.assertRaises(AttributeError, setattr, view, 'extra', 1)
+
+        horse = cf.searchDB(self.db, 'horse')[1][0][1]
+        details = cf.loadWordDetails(horse)
+        texts = list(details['text'])
+        details['text'].append('steed')
+        self.assertEqual(cf.loadWordDetails(horse)['text'], texts)
+        cf.editWordDetails(horse, details)
+        self.assertEqual(cf.loadWordDetails(horse)['text'], texts + ['steed'])
+        child = cf.createWord({'lang': 'Modern English', 'text': ['pony'],
+                               'morpheme': 'pony', 'def': 'A small horse'},
+                              word_parent=horse)
+        self.assertEqual(cf.loadWordChildren(horse)[-1], child)
+        self.assertTrue(cf.loadWordParents(child) is horse)
+        cf.deleteWord(child)
+        self.assertFalse(child in cf.loadWordChildren(horse))
+        self.assertTrue(cf.loadWordParents(child) is None)
+
+    def testTreeViews(self):
+        """ Tests an edit only drops the views of its own trees """
+        horse = cf.searchDB(self.db, 'horse')[1][0][1]
+        biology = cf.searchDB(self.db, 'biology')[1][0][1]
+        horse_tree = cf.findRoot(horse)
+        biology_tree = cf.findRoot(biology)
+        self.assertFalse(horse_tree is biology_tree)
+        horse_view = view_funcs.getView(horse)
+        biology_view = view_funcs.getView(biology)
+        details = cf.loadWordDetails(horse)
+        details['def'] = 'A big animal'
+        cf.editWordDetails(horse, details)
+        self.assertFalse(view_funcs.getView(horse) is horse_view)
+        self.assertEqual(view_funcs.getView(horse).definition, 'A big animal')
+        self.assertTrue(view_funcs.getView(biology) is biology_view)
+
+        # Moving a word drops the views of both trees
+        horse_view = view_funcs.getView(horse)
+        cf.editWordParent(horse, biology)
+        self.assertFalse(view_funcs.getView(biology) is biology_view)
+        self.assertTrue(horse in view_funcs.getView(biology).children)
+        self.assertTrue(view_funcs.getView(horse).parent is biology)
+
+        # So does undoing it
+        with self.assertRaises(ValueError):
+            with cf.transaction():
+                cf.editWordParent(horse, horse_tree)
+                self.assertFalse(horse in cf.loadWordChildren(biology))
+                raise ValueError('Undo')
+        self.assertTrue(horse in cf.loadWordChildren(biology))
+        self.assertFalse(horse in cf.loadWordChildren(horse_tree))
+
+    def testDetachedView(self):
+        """ Tests the words outside of a database aren't kept """
+        word = cf.createWord({'lang': 'Modern English', 'text': ['pony'],
+                              'morpheme': 'pony', 'def': 'A small horse'})
+        self.assertFalse(view_funcs.getView(word) is view_funcs.getView(word))
+        word.find('def').text = 'A little horse'
+        self.assertEqual(cf.loadWordDetails(word)['def'], 'A little horse')
+
+class EtymCompact(unittest.TestCase):
+    """ Tests for the compact (array-backed) database """
+    def setUp(self):
+        self.xml_db = cf.loadDB(global_opts.WORDS_FILE, snapshot=False)
+        self.db = cf.loadDB(global_opts.WORDS_FILE, compact=True)
+
+    def details(self, matches):
+        """ Returns the details of the (tree, word) matches """
+        return [(cf.loadWordDetails(tree), cf.loadWordDetails(word))
+                for tree, word in matches]
+
+    def testCompactSearch(self):
+        """ Tests searching gives the same words as the XML backend """
+        self.assertEqual(cf.countTrees(self.db), cf.countTrees(self.xml_db))
+        for field in ['text', 'morpheme']:
+            values = set(child.text for child in
+                         self.xml_db.getroot().iter(field))
+            for search_word in values:
+                for mode in ['exact', 'normal', 'fuzzy']:
+                    xml_trees, xml_words = cf.searchDB(self.xml_db,
+                            search_word, field, mode)
+                    trees, words = cf.searchDB(self.db, search_word, field,
+                                               mode)
+                    self.assertEqual(trees, xml_trees)
+                    self.assertEqual(self.details(words),
+                                     self.details(xml_words))
+        for search_word, field, mode in [('man', 'def', 'fulltext'),
+                                         ('english', 'lang', 'fulltext'),
+                                         ('^h', 'text', 'regex'),
+                                         ('beast', 'def', 'regex')]:
+            self.assertEqual(self.details(cf.searchDB(self.db, search_word,
+                                                      field, mode)[1]),
+                             self.details(cf.searchDB(self.xml_db, search_word,
+                                                      field, mode)[1]))
+        self.assertEqual(cf.completeDB(self.db, 'h'),
+                         cf.completeDB(self.xml_db, 'h'))
+        self.assertEqual(cf.countLanguages(self.db),
+                         cf.countLanguages(self.xml_db))
+        self.assertEqual(self.details(cf.iterLanguage(self.db, 'Old Norse')),
+                         self.details(cf.iterLanguage(self.xml_db,
+                                                      'Old Norse')))
+        self.assertEqual(cf.searchDB(self.db, u'\u00e9tranger')[0], 0)
+
+    def testCompactWords(self):
+        """ Tests walking the words gives the same tree as the XML backend """
+        def walk(word):
+            parent = cf.loadWordParents(word)
+            children = cf.loadWordChildren(word)
+            self.assertEqual(cf.countWordChildren(word), len(children))
+            return (cf.checkNode(word), cf.loadWordDetails(word),
+                    cf.loadWordDetails(cf.findRoot(word)),
+                    cf.checkNode(word) == 'word' and
+                    cf.loadWordDetails(parent),
+                    [walk(child) for child in children])
+        horse = cf.searchDB(self.db, 'horse')[1][0][1]
+        xml_horse = cf.searchDB(self.xml_db, 'horse')[1][0][1]
+        self.assertEqual(walk(cf.findRoot(horse)), walk(cf.findRoot(xml_horse)))
+        self.assertTrue(cf.isDescendant(cf.findRoot(horse), horse))
+        self.assertTrue(cf.isDescendant(horse, horse))
+        self.assertFalse(cf.isDescendant(horse, cf.findRoot(horse)))
+        hross = cf.searchDB(self.db, 'hross')[1][0][1]
+        self.assertEqual(cf.loadWordDetails(lca_funcs.commonAncestor(horse,
+                                                                     hross)),
+                         cf.loadWordDetails(lca_funcs.commonAncestor(
+                             xml_horse,
+                             cf.searchDB(self.xml_db, 'hross')[1][0][1])))
+
+    def testCompactSave(self):
+        """ Tests the compact database is saved back as the same XML, and
+            can't be edited
+
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            xml_file = os.path.join(tmp_dir, 'words.xml')
+            cf.saveDB(self.db, xml_file)
+            self.assertEqual(ET.tostring(cf.loadDB(xml_file).getroot()),
+                             ET.tostring(self.xml_db.getroot()))
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(ET.tostring(compact_funcs.compactDB(
+            self.xml_db).toElementTree().getroot()),
+            ET.tostring(self.xml_db.getroot()))
+        horse = cf.searchDB(self.db, 'horse')[1][0][1]
+        self.assertRaises(cf.EtymExceptDB, cf.deleteWord, horse)
+        self.assertRaises(cf.EtymExceptDB, cf.createWord,
+                          {'lang': 'English', 'text': ['hoss'],
+                           'morpheme': 'hoss', 'def': 'A horse'},
+                          word_parent=horse)
+        self.assertRaises(cf.EtymExceptWord, cf.loadWordDetails,
+                          cf.BackendWord(self.db, 10 ** 6))
+
+class EtymImport(unittest.TestCase):
+    """ Tests for the bulk import of words """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'words.xml')
+        shutil.copy(global_opts.WORDS_FILE, self.db_file)
+        # Two trees, the second with a word before its parent
+        self.rows = [
+            {'tree': 'a', 'id': '1', 'parent': '', 'lang': 'PIE',
+             'text': '*rotako-', 'morpheme': '*rotako-', 'def': 'Cart'},
+            {'tree': 'a', 'id': '2', 'parent': '1', 'lang': 'Latin',
+             'text': 'rotaca|rotax', 'morpheme': 'rotaca', 'def': 'Cart'},
+            {'tree': 'a', 'id': '3', 'parent': '2', 'lang': 'French',
+             'text': u'rotaqu\u00e9', 'morpheme': 'rotaque',
+             'def': 'Of carts'},
+            {'tree': 'b', 'id': '2', 'parent': '1', 'lang': 'English',
+             'text': 'whorlet', 'morpheme': 'whorlet', 'def': 'A wheel'},
+            {'tree': 'b', 'id': '1', 'parent': '', 'lang': 'PIE',
+             'text': '*whorlo-', 'morpheme': '*whorlo-', 'def': 'Wheel'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def writeRows(self, filename, rows):
+        """ Writes rows into filename, as TSV or JSON Lines """
+        import io, json
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            if filename.endswith('.jsonl'):
+                for row in rows:
+                    f.write(unicode(json.dumps(row)) + u'\n')
+            else:
+                columns = import_funcs.IMPORT_COLUMNS
+                f.write(u'\t'.join(columns) + u'\n')
+                for row in rows:
+                    f.write(u'\t'.join(unicode(row.get(column, ''))
+                                       for column in columns) + u'\n')
+
+    def checkImported(self, db):
+        """ Checks the trees of self.rows are the last two of db """
+        trees = db.getroot().findall('tree')[-2:]
+        self.assertEqual([tree.get('id') for tree in trees], ['a', 'b'])
+        rotax = cf.searchDB(db, 'rotax')[1][0][1]
+        self.assertEqual(cf.loadWordDetails(rotax)['text'], ['rotaca', 'rotax'])
+        self.assertTrue(cf.findRoot(rotax) is trees[0])
+        self.assertEqual(cf.loadWordDetails(cf.loadWordChildren(rotax)[0])[
+            'text'], [u'rotaqu\u00e9'])
+        whorlet = cf.searchDB(db, 'whorlet')[1][0][1]
+        self.assertTrue(cf.loadWordParents(whorlet) is trees[1])
+        self.assertEqual(validation_funcs.checkDB(db), [])
+
+    def testImportTSV(self):
+        """ Tests importing a TSV file, with the progress reported """
+        rows_file = os.path.join(self.tmp_dir, 'rows.tsv')
+        self.writeRows(rows_file, self.rows)
+        db = cf.loadDB(self.db_file, snapshot=False)
+        num_trees = cf.countTrees(db)
+        reports = []
+        report = import_funcs.importFile(db, rows_file,
+                progress=lambda report: reports.append(report.trees),
+                batch=1)
+        self.assertEqual((report.rows, report.trees), (5, 2))
+        self.assertEqual(reports, [1, 2, 2])
+        self.assertEqual(cf.countTrees(db), num_trees + 2)
+        self.checkImported(db)
+        cf.saveDB(db, self.db_file)
+        self.checkImported(cf.loadDB(self.db_file, snapshot=False))
+
+    def testImportJSONL(self):
+        """ Tests importing a JSON Lines file into a journaled db """
+        rows = [dict(row) for row in self.rows]
+        rows[1]['text'] = ['rotaca', 'rotax']
+        rows[4]['id'] = 1
+        rows_file = os.path.join(self.tmp_dir, 'rows.jsonl')
+        self.writeRows(rows_file, rows)
+        db = cf.loadDB(self.db_file, snapshot=False, journal=True)
+        import_funcs.importFile(db, rows_file)
+        self.checkImported(db)
+        self.checkImported(cf.loadDB(self.db_file, snapshot=False,
+                                     journal=True))
+
+    def testImportErrors(self):
+        """ Tests a bad row or tree stops the import, leaving the db be """
+        db = cf.loadDB(self.db_file, snapshot=False)
+        before = ET.tostring(db)
+        for num, change in [(4, {'tree': 'a'}), (3, {'parent': ''}),
+                            (0, {'parent': '9'}), (2, {'text': ''}),
+                            (2, {'id': '2'}), (3, {'id': ''}),
+                            # Its own parent, and a cycle of two words
+                            (1, {'parent': '2'}), (4, {'parent': '2'})]:
+            rows = [dict(row) for row in self.rows]
+            rows[num].update(change)
+            self.assertRaises(cf.EtymExceptDB, import_funcs.importRows, db,
+                              rows, batch=1)
+            self.assertEqual(ET.tostring(db), before)
+            self.assertEqual(cf.searchDB(db, 'rotax')[0], 0)
+        self.assertRaises(cf.EtymExceptDB, import_funcs.importFile, db,
+                          os.path.join(self.tmp_dir, 'missing.tsv'))
+        # The cycles are caught before lxml sees them
+        rows = [dict(row) for row in self.rows]
+        rows[1]['parent'] = '2'
+        self.assertRaisesRegexp(cf.EtymExceptDB, 'row 2: word 2 is its own '
+                                'parent', import_funcs.importRows, db, rows)
+        rows = [dict(row) for row in self.rows]
+        rows[4]['parent'] = '2'
+        self.assertRaisesRegexp(cf.EtymExceptDB, 'row 5: word 1 is its own '
+                                'ancestor', import_funcs.importRows, db, rows)
+
 class EtymDisplayCLI(unittest.TestCase):
     """ Various tests for the CLI display """
     dispHorse = u'''Root: khursa (PIE)
@@ -490,6 +2323,11 @@ class EtymDisplayCLI(unittest.TestCase):
       Child: ross (Modern High German, "Eine blutrünstige Monster")
   Child: hross (Old Norse, "A horse")'''
 
+    dispPath = u'''Common ancestor: khursa (PIE)
+  hross (Old Norse, "A horse")
+  ^ khursa (PIE, "Some kinda animal")
+  v hors (Old English, "A man-eating beast")'''
+
     def setUp(self):
         self.db = cf.loadDB(global_opts.WORDS_FILE)
 
@@ -526,6 +2364,84 @@ class EtymDisplayCLI(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(tree_output_string.strip(), self.dispRos)
 
+    def testDispRegex(self):
+        """ Tests the CLI emphasizes the words a regex search matched """
+        num_trees, matched_words = cf.searchDB(self.db, '^h?ros$',
+                                               mode='regex')
+        chosen_root = matched_words[0][0]
+        chosen_word = [match[1] for match in matched_words]
+        # Redirect stdout to a string
+        tree_output = StringIO.StringIO()
+        sys.stdout = tree_output
+        cli.display_tree(chosen_root, chosen_word, '^h?ros$')
+        tree_output_string = tree_output.getvalue()
+        sys.stdout = sys.__stdout__
+        self.maxDiff = None
+        self.assertEqual(tree_output_string.strip(), self.dispRos.replace(
+            '*ros*, hros', '*ros*, *hros*'))
+
+    def runCLI(self, argv):
+        """ Runs etym_cli.py with the arguments argv
+
+            Returns (exit status, output).
+
+        """
+        import etym_cli
+        output = StringIO.StringIO()
+        old_argv = sys.argv
+        sys.argv = ['etym_cli.py'] + argv
+        sys.stdout = output
+        try:
+            etym_cli.main()
+        except SystemExit as err:
+            status = err.code
+        finally:
+            sys.stdout = sys.__stdout__
+            sys.argv = old_argv
+        return (status, output.getvalue())
+
+    def testCLIBadRegex(self):
+        """ Tests a bad regular expression is reported, not raised """
+        status, output = self.runCLI(['--full', '--regex', 'h(ors'])
+        self.assertEqual(status, 1)
+        self.assertIn('Invalid pattern h(ors', output)
+        status, output = self.runCLI(['--full', '--regex', '^h?ros$'])
+        self.assertEqual(status, 0)
+        self.assertIn('*ros*, *hros*', output)
+
+    def testCLIVariants(self):
+        """ Tests a plain search falls back to matching variant spellings """
+        status, output = self.runCLI(['wizun'])
+        self.assertEqual(status, 0)
+        self.assertIn('wizun is not found as is', output)
+        self.assertIn('*wiz(z)un*', output)
+        status, output = self.runCLI(['--full', 'wizun'])
+        self.assertIn('*wiz(z)un*', output)
+
+    def testCLIRelate(self):
+        """ Tests --relate, and that "relate" is an ordinary search word """
+        status, output = self.runCLI(['hross', '--relate', 'ross'])
+        self.assertEqual(status, 0)
+        self.assertIn(u'Common ancestor: khursa (PIE)\n'
+                      u'  hross (Old Norse, "A horse")\n'
+                      u'  ^ khursa (PIE, "Some kinda animal")\n', output)
+        self.assertIn(u'  v ross (Modern High German', output)
+        status, output = self.runCLI(['--full', 'relate'])
+        self.assertEqual(status, 0)
+        self.assertIn('relate is not found', output)
+
+    def testDispPath(self):
+        """ Tests the CLI display of the path from 'hross' to 'hors' """
+        hross = cf.searchDB(self.db, 'hross')[1][0][1]
+        hors = cf.searchDB(self.db, 'hors')[1][0][1]
+        # Redirect stdout to a string
+        path_output = StringIO.StringIO()
+        sys.stdout = path_output
+        cli.display_path(lca_funcs.relationPath(hross, hors),
+                         lca_funcs.commonAncestor(hross, hors))
+        sys.stdout = sys.__stdout__
+        self.assertEqual(path_output.getvalue().strip(), self.dispPath)
+
     def testSearchBiology(self):
         """ Tests how many trees 'biology' is found in """
         num_trees, matched_words = cf.searchDB(self.db, 'biology')
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" This module ranks words by how well their free text matches a query
+
+    A TextIndex is an inverted index over a free text field (the def, or
+    the lang) of the words: each token maps to the words holding it and
+    how many times they do. A query is split into tokens the same way,
+    and only the words holding one of them are scored, using BM25 (see
+    http://en.wikipedia.org/wiki/Okapi_BM25). The best ones are picked
+    with a heap, so the other matches are never sorted.
+
+    The tokens are the runs of letters and digits of the text, folded the
+    way index_funcs.searchKey() folds a value (lower case, diacritics
+    stripped), so 'man-eating' gives 'man' and 'eating'.
+
+"""
+
+###
+# Imports
+import re
+import math
+import heapq
+
+import index_funcs
+
+###
+# Constants
+# The free text fields that can be searched
+TEXT_FIELDS = ('def', 'lang')
+# How many matches a search returns by default
+MAX_RESULTS = 20
+# The BM25 parameters: how quickly the score saturates as a token is
+# repeated, and how much a long text is penalised
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# A token
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+###
+# Classes
+class TextIndex(object):
+    """ An inverted index of the free text of some documents (words) """
+    def __init__(self):
+        """ Creates an empty index """
+        # token -> {document: how many times it holds the token}
+        self._postings = {}
+        # document -> its number of tokens
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        """ The number of documents in the index """
+        return len(self._lengths)
+
+    def add(self, doc, text):
+        """ Adds the document doc, whose text is text """
+        if doc in self._lengths:
+            return
+        tokens = tokenize(text)
+        for token in tokens:
+            counts = self._postings.setdefault(token, {})
+            counts[doc] = counts.get(doc, 0) + 1
+        self._lengths[doc] = len(tokens)
+        self._total_length += len(tokens)
+
+    def remove(self, doc, text):
+        """ Removes the document doc, whose text is (still) text """
+        if doc not in self._lengths:
+            return
+        for token in set(tokenize(text)):
+            counts = self._postings.get(token)
+            if counts is not None:
+                counts.pop(doc, None)
+                if not counts:
+                    del self._postings[token]
+        self._total_length -= self._lengths.pop(doc)
+
+    def search(self, query, limit=MAX_RESULTS):
+        """ Returns the documents best matching query, best first
+
+            The output is a list of at most limit (score, document)
+            tuples.
+
+        """
+        return heapq.nlargest(limit, self.scores(query),
+                              key=lambda match: match[0])
+
+    def scores(self, query):
+        """ Yields (BM25 score, document) for each document holding a
+            token of query
+
+        """
+        num_docs = len(self._lengths)
+        if not num_docs:
+            return
+        avg_length = float(self._total_length) / num_docs or 1.0
+        scores = {}
+        for token in set(tokenize(query)):
+            counts = self._postings.get(token)
+            if not counts:
+                continue
+            idf = math.log(1.0 + (num_docs - len(counts) + 0.5) /
+                           (len(counts) + 0.5))
+            for doc, count in counts.iteritems():
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B *
+                                  self._lengths[doc] / avg_length)
+                scores[doc] = (scores.get(doc, 0.0) +
+                               idf * count * (BM25_K1 + 1.0) / (count + norm))
+        for doc, score in scores.iteritems():
+            yield (score, doc)
+
+###
+# Functions
+def tokenize(text):
+    """ Returns the list of tokens of text """
+    if not text:
+        return []
+    return _TOKEN.findall(index_funcs.searchKey(text))
+# EOF
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+""" This module groups edits to a database into a transaction
+
+    Inside common_funcs.transaction(), the edit functions of common_funcs
+    don't check their words with checkWord() on every call. Instead, each
+    word they are given is checked once, when the transaction ends, so
+    moving thousands of children to the same parent, as deleteWord()
+    does, checks that parent once rather than once per child. The words
+    are in between states until then.
+
+    If a check fails, or an exception leaves the transaction, every edit
+    made in it is undone: the words are put back as they were (the same
+    elements, so references to them stay good) and the search index of
+    the trees they were in is rebuilt. Until the transaction ends, its
+    edits are held back from the edit journal (see journal_funcs), and
+    they are then written to it together, or dropped.
+
+    A transaction opened inside another one is part of it.
+
+"""
+
+###
+# Imports
+import common_funcs as cf
+import index_funcs
+import cache_funcs
+import view_funcs
+
+###
+# Classes
+class Transaction(object):
+    """ The edits made between common_funcs.transaction() and its end """
+    def __init__(self):
+        """ Starts a transaction without any edits """
+        # node -> (children, text, tail, attrib) as before the first edit
+        # touching it, in the order they were saved
+        self._saved = {}
+        self._order = []
+        # tree -> its position in its database before the transaction
+        self._trees = {}
+        # The words to check at the end, in the order they were given
+        self._checks = []
+        self._checked = set()
+        # [(journal, record), ...] of the edits, held back
+        self._records = []
+
+    def __len__(self):
+        """ The number of words waiting to be checked """
+        return len(self._checks)
+
+    def save(self, values):
+        """ Saves the nodes an edit is about to change
+
+            values are the arguments of the edit: elements, databases or
+            lists of them. Each element is saved along with its parent,
+            the first time it is seen.
+
+        """
+        for value in values:
+            if isinstance(value, (list, tuple)):
+                self.save(value)
+            elif isinstance(value, cf.ET._ElementTree):
+                self._saveNode(value.getroot())
+            elif isinstance(value, cf.ET._Element):
+                self._saveNode(value)
+                parent = value.getparent()
+                if parent is not None:
+                    self._saveNode(parent)
+
+    def check(self, word):
+        """ Checks word with checkWord() once the transaction ends """
+        if word not in self._checked:
+            self._checked.add(word)
+            self._checks.append(word)
+
+    def defer(self, journal, record):
+        """ Holds back the journal record of an edit until the end """
+        self._records.append((journal, record))
+
+    def validate(self):
+        """ Checks each word given to the edits once
+
+            A word whose details are only out of order is put back in
+            order with normalizeWord(). A tree emptied by deleteTree() is
+            left out, as it no longer holds any details. Raises
+            EtymExceptWord if a word fails.
+
+        """
+        for word in self._checks:
+            if isinstance(word, cf.BackendWord) or word.tag != 'tree' \
+                    or len(word):
+                if not cf.checkWord(word):
+                    cf.normalizeWord(word)
+
+    def commit(self):
+        """ Writes the held back edits to their journals """
+        journals = []
+        records = {}
+        for journal, record in self._records:
+            if journal not in records:
+                journals.append(journal)
+                records[journal] = []
+            records[journal].append(record)
+        for journal in journals:
+            journal.extend(records[journal])
+        self._records = []
+
+    def rollback(self):
+        """ Undoes every edit of the transaction """
+        # The trees the nodes are in now, and were in before
+        trees = dict(self._trees)
+        for node in self._order:
+            tree = _treeOf(node)
+            if tree is not None and tree not in trees:
+                trees[tree] = None
+        for tree in trees:
+            index, top = index_funcs.findIndex(tree)
+            if index is not None and index.position(tree) is not None:
+                index.removeSubtree(tree)
+
+        # Detach the children first, so that no node is moved into one of
+        # its own (current) descendants
+        for node in self._order:
+            del node[:]
+        for node in self._order:
+            children, text, tail, attrib = self._saved[node]
+            node.extend(children)
+            node.text = text
+            node.tail = tail
+            node.attrib.clear()
+            node.attrib.update(attrib)
+
+        for tree, position in trees.iteritems():
+            index, top = index_funcs.findIndex(tree)
+            if index is not None and len(tree):
+                index.addTree(tree, position)
+                index.addSubtree(tree, tree)
+        self._records = []
+        view_funcs.markEdited(list(trees))
+        cache_funcs.newGeneration()
+
+    def _saveNode(self, node):
+        """ Saves node as it is now, unless it has been saved already """
+        if node in self._saved:
+            return
+        self._saved[node] = (list(node), node.text, node.tail,
+                             dict(node.attrib))
+        self._order.append(node)
+        tree = _treeOf(node)
+        if tree is not None and tree not in self._trees:
+            index, top = index_funcs.findIndex(tree)
+            self._trees[tree] = (index.position(tree) if index is not None
+                                 else None)
+
+###
+# Functions
+def _treeOf(node):
+    """ Returns the tree root node is in (or is), or None """
+    if node.tag == 'tree':
+        return node
+    for ancestor in node.iterancestors('tree'):
+        return ancestor
+    return None
+# EOF
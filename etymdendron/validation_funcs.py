@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+""" This module checks a word database against its DTD
+
+    common_funcs.loadDB() takes a validation policy, one of
+    VALIDATION_MODES:
+        'load': the whole database is validated when it is loaded, and
+            loading fails if it isn't valid (the default)
+        'save': nothing is validated at load, the database is validated
+            by common_funcs.saveDB() before it is written out instead
+        'background': the trees (or a random sample of them) are validated
+            one by one in a background thread after the load; the errors
+            found are kept in the report
+        'none': nothing is validated
+
+    Each loaded database keeps a ValidationReport, with the time spent
+    validating it.
+
+    checkDB() is a quicker, read-only integrity check of a database (or a
+    file, streamed through) that doesn't need its DTD: every word is
+    checked with common_funcs.checkWord() in one sweep over each tree.
+
+"""
+
+###
+# Imports
+import copy
+import time
+import random
+import threading
+from StringIO import StringIO
+
+import common_funcs as cf
+import global_opts
+
+###
+# Constants
+VALIDATE_LOAD = 'load'
+VALIDATE_SAVE = 'save'
+VALIDATE_BACKGROUND = 'background'
+VALIDATE_NONE = 'none'
+VALIDATION_MODES = (VALIDATE_LOAD, VALIDATE_SAVE, VALIDATE_BACKGROUND,
+                    VALIDATE_NONE)
+
+###
+# Classes
+class ValidationReport(object):
+    """ What was validated in a database, and how long it took
+
+        seconds is the time spent validating, trees the number of trees
+        validated and errors a list of error messages. done is set once
+        no more validation is running in the background.
+
+    """
+    def __init__(self, mode):
+        """ Starts an empty report for the validation mode """
+        if mode not in VALIDATION_MODES:
+            raise cf.EtymExceptDB('Unknown validation mode {0}'.format(mode))
+        self.mode = mode
+        self.seconds = 0.0
+        self.trees = 0
+        self.errors = []
+        self.done = threading.Event()
+        self.done.set()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        """ A one line summary of the report """
+        return ('validation {0}: {1} trees in {2:.3f}s, {3} errors'.format(
+            self.mode, self.trees, self.seconds, len(self.errors)))
+
+    def check(self, dtd, node):
+        """ Validates the tree or etym element node against dtd
+
+            Returns True if it is valid. Otherwise the error is added to
+            the report and False is returned.
+
+        """
+        start = time.time()
+        valid = dtd.validate(node)
+        seconds = time.time() - start
+        with self._lock:
+            self.seconds += seconds
+            if node.tag == 'tree':
+                self.trees += 1
+            else:
+                self.trees += len(node)
+            if not valid:
+                self.errors.append(str(dtd.error_log.filter_from_errors()))
+        return valid
+
+###
+# Functions
+def getDTD(words_db):
+    """ Returns the DTD of words_db, or the standard one if it has none """
+    dtd = words_db.docinfo.internalDTD
+    if dtd is None:
+        internal_subset = global_opts.WORDS_DTD.split('[', 1)[1]
+        dtd = cf.ET.DTD(StringIO(internal_subset.rsplit(']', 1)[0]))
+    return dtd
+
+def getReport(words_db):
+    """ Returns the ValidationReport of words_db, or None """
+    if not isinstance(words_db, cf.ET._ElementTree):
+        return None
+    return getattr(words_db.getroot(), '_validation', None)
+
+def attachReport(words_db, report):
+    """ Keeps report with words_db, returns report """
+    try:
+        words_db.getroot()._validation = report
+    except AttributeError:
+        pass
+    return report
+
+def validateDB(words_db, filename, report):
+    """ Validates all of words_db, raising EtymExceptDB if it isn't valid
+
+        The trees emptied by common_funcs.deleteTree() are skipped, as
+        they aren't saved. filename is only used for the error message.
+
+    """
+    dtd = getDTD(words_db)
+    root = words_db.getroot()
+    if all(len(tree) for tree in root):
+        valid = report.check(dtd, root)
+    else:
+        valid = all(report.check(dtd, tree) for tree in root if len(tree))
+    if not valid:
+        raise cf.EtymExceptDB("ERROR: {0} doesn't follow its DTD\n{1}".format(
+            filename, report.errors[-1]))
+
+def startBackground(words_db, report, sample=1.0):
+    """ Validates the trees of words_db in a background thread
+
+        sample is the fraction of the trees (picked at random) that are
+        validated. Each tree is copied before it is validated, so the
+        database can be edited meanwhile. Returns the thread.
+
+    """
+    trees = list(words_db.getroot().iterchildren(tag='tree'))
+    if sample < 1.0:
+        trees = random.sample(trees, int(round(len(trees) * sample)))
+    dtd = getDTD(words_db)
+
+    def validateTrees():
+        try:
+            for tree in trees:
+                # A tree emptied by common_funcs.deleteTree() isn't saved
+                if len(tree):
+                    report.check(dtd, copy.deepcopy(tree))
+        finally:
+            report.done.set()
+
+    report.done.clear()
+    thread = threading.Thread(target=validateTrees,
+                              name='etym-validation')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def checkTree(tree):
+    """ Returns the list of the errors of tree and its words
+
+        Each word is checked with common_funcs.checkWord(), in one sweep
+        over tree, and nothing is changed. A word with its details out of
+        order is an error too (common_funcs.normalizeWord() fixes it), as
+        is a tree without words. An empty list means tree is fine.
+
+    """
+    errors = []
+    for node in tree.iter('tree', 'word'):
+        try:
+            if not cf.checkWord(node):
+                errors.append(_describe(node, 'The details are out of order'))
+        except cf.EtymExceptWord as err:
+            errors.append(_describe(node, str(err).split('\n', 1)[0]))
+    if tree.find('word') is None:
+        errors.append(_describe(tree, 'The tree has no words'))
+    return errors
+
+def checkDB(word_db):
+    """ Returns the list of the errors of the trees of word_db
+
+        word_db is a loaded database, or the name of a file, which is then
+        streamed through with common_funcs.iterDB() (without validating
+        it against its DTD) so that only one tree is in memory at a time.
+        The trees emptied by common_funcs.deleteTree() are skipped. See
+        checkTree().
+
+    """
+    if isinstance(word_db, basestring):
+        trees = cf.iterDB(word_db, drop=True,
+                          report=ValidationReport(VALIDATE_NONE))
+    else:
+        trees = word_db.getroot().iterchildren()
+    errors = []
+    for tree in trees:
+        if tree.tag != 'tree':
+            errors.append('Not a tree: {0}'.format(tree.tag))
+        elif len(tree):
+            errors.extend(checkTree(tree))
+    return errors
+
+def _describe(node, message):
+    """ Returns the error message about the word (or tree) node """
+    return u'{0} "{1}": {2}'.format(node.tag, node.findtext('text'), message)
+# EOF
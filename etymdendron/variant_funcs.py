@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+""" This module expands the variant notations of a value into its spellings
+
+    The texts in the database sometimes pack several spellings into one
+    value, such as 'ros,hros' (either 'ros' or 'hros') or '(z)un' (either
+    'zun' or 'un'). expand() gives all the concrete spellings of a value,
+    and the search index files the value under each of them (see
+    index_funcs.searchKeys()), so a normalised search for 'un' finds
+    '(z)un' with a lookup.
+
+    The spellings are worked out by the rules in VARIANT_RULES. A rule is
+    a function taking a value and returning a list of other spellings of
+    it (an empty list if it doesn't apply). More rules, such as
+    orthographic alternations, can be added with addRule(); they must be
+    added before the database is loaded, since the index is built with the
+    rules in place at the time.
+
+    Each rule can come with a trigger, a regular expression found in
+    every value the rule applies to. A value matching none of the
+    triggers (as most don't) is passed over with a single regex search.
+
+"""
+
+###
+# Imports
+import re
+
+###
+# Constants
+# The most spellings a value is expanded into
+MAX_SPELLINGS = 64
+
+# An optional part of a value, in brackets
+_OPTIONAL = re.compile(r'\(([^()]*)\)')
+# The separator of the spellings listed in a value
+_SEPARATOR = re.compile(r'\s*,\s*')
+
+###
+# Functions
+def optionalRule(value):
+    """ Spells out the first bracketed part of value, with and without it
+
+        For example, '(z)un' gives ['zun', 'un'].
+
+    """
+    if '(' not in value:
+        return []
+    match = _OPTIONAL.search(value)
+    if match is None:
+        return []
+    start, end = value[:match.start()], value[match.end():]
+    return [start + match.group(1) + end, start + end]
+
+def commaRule(value):
+    """ Splits the spellings listed in value, 'ros,hros' gives ['ros', 'hros']
+    """
+    if ',' not in value:
+        return []
+    return [spelling for spelling in _SEPARATOR.split(value.strip())
+            if spelling]
+
+def alternationRule(first, second):
+    """ Returns a rule treating the letters first and second as alternatives
+
+        The rule spells a value holding first with second instead, and the
+        other way around. For example, alternationRule(u'\\xfe', 'th')
+        gives 'thorn' for u'\\xfeorn'. Add it with the trigger
+        alternationTrigger(first, second).
+
+    """
+    def rule(value):
+        spellings = []
+        if first in value:
+            spellings.append(value.replace(first, second))
+        if second in value:
+            spellings.append(value.replace(second, first))
+        return spellings
+    return rule
+
+def alternationTrigger(first, second):
+    """ Returns the trigger of alternationRule(first, second) """
+    return u'{0}|{1}'.format(re.escape(first), re.escape(second))
+
+def addRule(rule, trigger=None):
+    """ Adds rule to the rules used by expand()
+
+        trigger is a regular expression that is found in each value the
+        rule applies to. Without one, the rule is tried on every value.
+
+    """
+    if rule not in VARIANT_RULES:
+        VARIANT_RULES.append(rule)
+        _TRIGGERS[rule] = trigger
+        _compileTriggers()
+
+def removeRule(rule):
+    """ Removes rule from the rules used by expand() """
+    if rule in VARIANT_RULES:
+        VARIANT_RULES.remove(rule)
+        del _TRIGGERS[rule]
+        _compileTriggers()
+
+def _compileTriggers():
+    """ Joins the triggers of the rules into one regular expression """
+    global _trigger
+    if any(_TRIGGERS[rule] is None for rule in VARIANT_RULES):
+        _trigger = None
+    else:
+        _trigger = re.compile(u'|'.join(u'(?:{0})'.format(_TRIGGERS[rule])
+                                        for rule in VARIANT_RULES), re.U)
+
+def hasVariants(value):
+    """ Whether some rule may apply to value, see expand() """
+    return value is not None and (_trigger is None or
+                                  _trigger.search(value) is not None)
+
+def expand(value):
+    """ Returns the list of spellings of value, starting with value itself
+
+        The rules are applied to value and again to each spelling they
+        give, until no new spellings come up (or there are MAX_SPELLINGS
+        of them).
+
+    """
+    spellings = [value]
+    if not hasVariants(value):
+        return spellings
+    seen = set(spellings)
+    pos = 0
+    while pos < len(spellings) and len(spellings) < MAX_SPELLINGS:
+        for rule in VARIANT_RULES:
+            for spelling in rule(spellings[pos]):
+                if spelling not in seen and len(spellings) < MAX_SPELLINGS:
+                    seen.add(spelling)
+                    spellings.append(spelling)
+        pos += 1
+    return spellings
+
+# The rules used by expand(), and their triggers
+VARIANT_RULES = []
+_TRIGGERS = {}
+_trigger = None
+addRule(commaRule, r',')
+addRule(optionalRule, r'\(')
+# EOF
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+""" This module keeps a light view of each word of a loaded database
+
+    A WordView holds the details of a word (lang, def, morpheme, texts),
+    its tag, parent and child words, read from its element in one pass
+    over its children. common_funcs.loadWordDetails(), loadWordParents(),
+    loadWordChildren() and countWordChildren() answer from it, so drawing
+    a tree (which asks for all of them for every word, every time it is
+    drawn) doesn't search the elements again.
+
+    The views of a loaded database are kept on its etym element, by tree,
+    until the next edit of their tree: every edit function of
+    common_funcs drops the views of the trees it is given words of (see
+    markEdited()), so editing a word leaves the views of the other trees
+    alone. The words that aren't part of a loaded database get a new view
+    each time. Edits made around common_funcs, straight to the elements,
+    aren't seen.
+
+"""
+
+###
+# Imports
+from lxml import etree as ET
+
+###
+# Classes
+class WordView(object):
+    """ The details and links of a word, as they were when it was read """
+    __slots__ = ('lang', 'definition', 'morpheme', 'texts', 'tag', 'parent',
+                 'children')
+
+    def __init__(self, word):
+        """ Reads the element word """
+        self.lang = self.definition = self.morpheme = None
+        texts = []
+        children = []
+        found = set()
+        for child in word:
+            tag = child.tag
+            if tag == 'word':
+                children.append(child)
+            elif tag == 'text':
+                texts.append(child.text)
+            elif tag not in found:
+                # The first one counts, as with loadWordDetails()
+                found.add(tag)
+                if tag == 'lang':
+                    self.lang = child.text
+                elif tag == 'def':
+                    self.definition = child.text
+                elif tag == 'morpheme':
+                    self.morpheme = child.text
+        self.texts = tuple(texts)
+        self.children = tuple(children)
+        self.tag = word.tag
+        self.parent = word.getparent()
+
+    def details(self):
+        """ Returns a new details dict, see common_funcs.loadWordDetails() """
+        return {'lang': self.lang, 'def': self.definition,
+                'text': list(self.texts), 'morpheme': self.morpheme,
+                'tag': self.tag}
+
+class ViewCache(object):
+    """ The views of the words of a database, by tree """
+    def __init__(self):
+        """ Creates an empty cache """
+        # tree element -> element -> its WordView
+        self.trees = {}
+
+    def __len__(self):
+        """ The number of views in the cache """
+        return sum(len(views) for views in self.trees.itervalues())
+
+###
+# Functions
+def getView(word):
+    """ Returns the WordView of the element word
+
+        The view is kept until the next edit of its tree if word is part
+        of a loaded database.
+
+    """
+    tree = _treeOf(word)
+    root = tree.getparent() if tree is not None else None
+    if root is None or root.tag != 'etym':
+        return WordView(word)
+    cache = getattr(root, '_view_cache', None)
+    if cache is None:
+        cache = ViewCache()
+        try:
+            root._view_cache = cache
+        except AttributeError:
+            # Not a loaded database, it can't keep the views
+            return WordView(word)
+    views = cache.trees.get(tree)
+    if views is None:
+        views = cache.trees[tree] = {}
+    view = views.get(word)
+    if view is None:
+        view = views[word] = WordView(word)
+    return view
+
+def markEdited(values):
+    """ Drops the views of the trees holding values, called by every edit
+
+        values are the arguments of an edit function of common_funcs:
+        elements, databases or lists of them. Adding trees to a database
+        doesn't change the views of its other trees, so only the elements
+        count. Returns the list of the trees whose views were dropped.
+
+    """
+    trees = []
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            trees.extend(markEdited(value))
+        elif isinstance(value, ET._Element):
+            tree = _treeOf(value)
+            if tree is None:
+                continue
+            cache = getattr(tree.getparent(), '_view_cache', None)
+            if cache is not None:
+                cache.trees.pop(tree, None)
+            trees.append(tree)
+    return trees
+
+def _treeOf(word):
+    """ Returns the tree element word is in (or is), or None """
+    if word.tag == 'tree':
+        return word
+    for tree in word.iterancestors('tree'):
+        return tree
+    return None
+# EOF